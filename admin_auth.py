@@ -0,0 +1,112 @@
+"""
+admin_auth.py
+Stateless, signed admin tokens.
+
+A token is `<payload>.<signature>`: the payload is base64url JSON (subject, issue and expiry
+times, token id) and the signature is its HMAC-SHA256 under ADMIN_TOKEN_SECRET. Verifying a
+token needs no lookup, so every worker that shares the secret accepts tokens issued by any
+other, and nothing is stored per issued token. Rotating the secret invalidates all tokens.
+
+Logging out revokes a token early by putting its id in a small in-process revocation set.
+Entries leave the set once the token would have expired anyway, so it only ever holds tokens
+revoked within the last ADMIN_TOKEN_TTL_SECONDS (at most `max_revoked`). Revocation is per
+worker; on other workers the token stays valid until it expires.
+"""
+import base64
+import hashlib
+import heapq
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from typing import Dict
+
+from log_pipeline import get_logger
+
+log = get_logger("admin_auth")
+
+ADMIN_TOKEN_TTL_SECONDS = int(os.getenv("ADMIN_TOKEN_TTL_SECONDS", "7200"))
+ADMIN_TOKEN_SECRET = os.getenv("ADMIN_TOKEN_SECRET", "")
+if not ADMIN_TOKEN_SECRET:
+    ADMIN_TOKEN_SECRET = secrets.token_hex(32)
+    log.warning("ADMIN_TOKEN_SECRET not set; admin tokens are only valid in this process")
+
+
+class AdminTokenError(Exception):
+    """The token was rejected; `reason` is invalid_token, token_expired or token_revoked."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class AdminTokens:
+    def __init__(self, secret: str = ADMIN_TOKEN_SECRET, ttl_seconds: int = ADMIN_TOKEN_TTL_SECONDS,
+                 max_revoked: int = 10000, clock=time.time):
+        self._key = secret.encode("utf-8")
+        self.ttl_seconds = ttl_seconds
+        self.max_revoked = max_revoked
+        self._clock = clock
+        self._revoked: Dict[str, int] = {}  # token id -> expiry
+        self._revoked_heap = []  # (expiry, token id)
+        self._lock = threading.Lock()
+
+    def _sign(self, payload: str) -> str:
+        return _b64encode(hmac.new(self._key, payload.encode("ascii"), hashlib.sha256).digest())
+
+    def issue(self, subject: str) -> str:
+        now = int(self._clock())
+        claims = {"sub": subject, "iat": now, "exp": now + self.ttl_seconds, "jti": secrets.token_hex(8)}
+        payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+        return f"{payload}.{self._sign(payload)}"
+
+    def verify(self, token: str) -> Dict:
+        """The token's claims, or AdminTokenError."""
+        payload, _, signature = (token or "").partition(".")
+        # Tokens we issue are ASCII; anything else cannot be signed or compared
+        if not signature or not token.isascii() or not hmac.compare_digest(self._sign(payload), signature):
+            raise AdminTokenError("invalid_token")
+        try:
+            claims = json.loads(_b64decode(payload))
+            expires_at = int(claims["exp"])
+        except (ValueError, KeyError, TypeError):
+            raise AdminTokenError("invalid_token")
+        if expires_at <= self._clock():
+            raise AdminTokenError("token_expired")
+        if claims.get("jti") in self._revoked:
+            raise AdminTokenError("token_revoked")
+        return claims
+
+    def revoke(self, claims: Dict):
+        with self._lock:
+            self._prune()
+            if claims["jti"] in self._revoked:
+                return
+            if len(self._revoked) >= self.max_revoked:
+                # Full: forget the revocation that expires soonest
+                _, jti = heapq.heappop(self._revoked_heap)
+                self._revoked.pop(jti, None)
+            self._revoked[claims["jti"]] = claims["exp"]
+            heapq.heappush(self._revoked_heap, (claims["exp"], claims["jti"]))
+
+    def _prune(self):
+        now = self._clock()
+        heap = self._revoked_heap
+        while heap and heap[0][0] <= now:
+            _, jti = heapq.heappop(heap)
+            self._revoked.pop(jti, None)
+
+    def revoked_count(self) -> int:
+        with self._lock:
+            self._prune()
+            return len(self._revoked)
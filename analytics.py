@@ -0,0 +1,293 @@
+"""
+analytics.py
+Incrementally maintained counters behind /admin/stats.
+
+The booking and chat paths call `record_booking` / `record_chat`, which only add to an
+in-process dict of pending increments. A background thread flushes them every
+ANALYTICS_FLUSH_MS as one atomic increment (the `increment_daily_stats` function) into
+`daily_stats`, one row per (UTC day, metric, dimension), then reloads the last
+ANALYTICS_WINDOW_DAYS days of counters (also every ten intervals when idle, to pick up
+other workers' increments). /admin/stats is answered from that in-memory copy,
+so reads never touch the database and are at most about one flush interval behind.
+
+Metrics (dimension is the hotel id for bookings and revenue, empty otherwise):
+    bookings, revenue_inr         bookings created, and their total price
+    chat_messages, chat_users     user messages, and distinct chatting users per day
+    chat_bookings                 bookings confirmed inside the chat flow
+    llm_replies, fallback_replies replies from the LLM, and the generic fallback reply
+Derived per day: conversion_rate = chat_bookings / chat_users, and llm_fallback_rate, the
+share of messages no rule-based handler answered ((llm_replies + fallback_replies) /
+chat_messages). Distinct chat users are tracked per process, like the chatbot's own state.
+
+Backfill or repair with:  python analytics.py --rebuild [--since YYYY-MM-DD]
+which recomputes the counters from the bookings and conversations tables and replaces them in
+one transaction (the `replace_daily_stats` function). Each table's metrics are only replaced
+from `since` or the first day the table still fully covers, whichever is later: months the
+archiver has moved out of conversations keep the counters they have.
+"""
+import os
+import sys
+import threading
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from log_pipeline import get_logger
+
+log = get_logger("analytics")
+
+ANALYTICS_FLUSH_MS = int(os.getenv("ANALYTICS_FLUSH_MS", "1000"))
+ANALYTICS_WINDOW_DAYS = int(os.getenv("ANALYTICS_WINDOW_DAYS", "90"))
+
+DAILY_METRICS = ("chat_messages", "chat_users", "chat_bookings", "llm_replies", "fallback_replies")
+HOTEL_METRICS = ("bookings", "revenue_inr")
+
+Key = Tuple[str, str, str]  # (day, metric, dimension)
+
+
+def stat_id(day: str, metric: str, dimension: str = "") -> str:
+    return f"{day}|{metric}|{dimension}"
+
+
+def stat_rows(counters: Dict[Key, float]) -> List[Dict[str, Any]]:
+    return [{"id": stat_id(*key), "day": key[0], "metric": key[1], "dimension": key[2], "value": value}
+            for key, value in counters.items()]
+
+
+def _today() -> str:
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+def _day_of(row: Dict[str, Any]) -> str:
+    return str(row.get("created_at") or _today())[:10]
+
+
+def _ratio(numerator: float, denominator: float) -> Optional[float]:
+    return round(numerator / denominator, 4) if denominator else None
+
+
+def summarize(counters: Dict[Key, float], days: int, today: Optional[str] = None) -> Dict[str, Any]:
+    """The /admin/stats payload for the last `days` days, newest first."""
+    end = date.fromisoformat(today or _today())
+    first = (end - timedelta(days=days - 1)).isoformat()
+    per_day: Dict[str, Dict[str, Any]] = {}
+    hotels: Dict[str, Dict[str, float]] = defaultdict(lambda: {"bookings": 0, "revenue_inr": 0})
+    totals: Dict[str, float] = defaultdict(float)
+    for (day, metric, dimension), value in counters.items():
+        if day < first:
+            continue
+        entry = per_day.setdefault(day, {"day": day, **{m: 0 for m in DAILY_METRICS + HOTEL_METRICS}, "hotels": {}})
+        entry[metric] += value
+        totals[metric] += value
+        if metric in HOTEL_METRICS:
+            entry["hotels"].setdefault(dimension, {"bookings": 0, "revenue_inr": 0})[metric] += value
+            hotels[dimension][metric] += value
+    for entry in per_day.values():
+        entry["conversion_rate"] = _ratio(entry["chat_bookings"], entry["chat_users"])
+        entry["llm_fallback_rate"] = _ratio(entry["llm_replies"] + entry["fallback_replies"], entry["chat_messages"])
+    totals = {m: totals[m] for m in DAILY_METRICS + HOTEL_METRICS}
+    totals["llm_fallback_rate"] = _ratio(totals["llm_replies"] + totals["fallback_replies"], totals["chat_messages"])
+    return {
+        "from": first,
+        "to": end.isoformat(),
+        "totals": totals,
+        "hotels": dict(sorted(hotels.items(), key=lambda h: h[1]["revenue_inr"], reverse=True)),
+        "days": sorted(per_day.values(), key=lambda d: d["day"], reverse=True),
+    }
+
+
+class StatsCounters:
+    def __init__(self, flush_fn: Callable[[List[Dict[str, Any]]], Any],
+                 load_fn: Callable[[str], List[Dict[str, Any]]],
+                 flush_ms: int = ANALYTICS_FLUSH_MS, window_days: int = ANALYTICS_WINDOW_DAYS,
+                 max_backoff: float = 30.0):
+        self._flush_fn = flush_fn
+        self._load_fn = load_fn
+        self.flush_interval = flush_ms / 1000.0
+        self.window_days = window_days
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._pending: Dict[Key, float] = defaultdict(float)
+        self._counters: Dict[Key, float] = {}
+        self._summaries: Dict[int, Dict[str, Any]] = {}
+        self._seen_day = None
+        self._seen_users: set = set()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"flushes": 0, "failed_flushes": 0, "reloads": 0}
+
+    # ---- recording (request path) ----
+
+    def record_booking(self, booking: Dict[str, Any]):
+        day, hotel = _today(), str(booking.get("hotel_id") or "")
+        with self._lock:
+            self._pending[(day, "bookings", hotel)] += 1
+            self._pending[(day, "revenue_inr", hotel)] += float(booking.get("total_price") or 0)
+
+    def record_chat(self, user_id: Optional[str], meta: Optional[Dict[str, Any]] = None):
+        day, meta = _today(), meta or {}
+        with self._lock:
+            self._pending[(day, "chat_messages", "")] += 1
+            if day != self._seen_day:
+                self._seen_day, self._seen_users = day, set()
+            if user_id not in self._seen_users:
+                self._seen_users.add(user_id)
+                self._pending[(day, "chat_users", "")] += 1
+            if meta.get("booking_confirmed"):
+                self._pending[(day, "chat_bookings", "")] += 1
+            if meta.get("ai_powered"):
+                self._pending[(day, "llm_replies", "")] += 1
+            elif meta.get("fallback"):
+                self._pending[(day, "fallback_replies", "")] += 1
+
+    # ---- reading ----
+
+    def summary(self, days: int) -> Dict[str, Any]:
+        days = max(1, min(days, self.window_days))
+        cached = self._summaries.get(days)
+        if cached is None or cached["to"] != _today():
+            cached = self._summaries[days] = summarize(self._counters, days)
+        return cached
+
+    # ---- background flush ----
+
+    def start(self):
+        if self._thread:
+            return
+        try:
+            self.reload()
+        except Exception as e:
+            log.warning(f"Could not load analytics counters: {e}")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="analytics-flush", daemon=True)
+        self._thread.start()
+
+    def flush(self) -> bool:
+        """Write pending increments; on failure they are kept and retried on the next flush."""
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(float)
+        if not pending:
+            return False
+        try:
+            self._flush_fn(stat_rows(pending))
+            self.stats["flushes"] += 1
+            return True
+        except Exception:
+            with self._lock:
+                for key, value in pending.items():
+                    self._pending[key] += value
+            raise
+
+    def reload(self):
+        since = (date.fromisoformat(_today()) - timedelta(days=self.window_days - 1)).isoformat()
+        counters = {(str(r["day"])[:10], r["metric"], r.get("dimension") or ""): float(r["value"])
+                    for r in self._load_fn(since)}
+        self._counters, self._summaries = counters, {}
+        self.stats["reloads"] += 1
+
+    def _run(self):
+        backoff, idle = self.flush_interval, 0
+        while not self._stop.is_set():
+            self._wake.wait(backoff)
+            self._wake.clear()
+            try:
+                idle = 0 if self.flush() else idle + 1
+                if idle % 10 == 0:
+                    self.reload()
+                backoff = self.flush_interval
+            except Exception as e:
+                self.stats["failed_flushes"] += 1
+                backoff = min(backoff * 2, self.max_backoff)
+                log.warning(f"Analytics flush failed, retrying in {backoff:.1f}s: {e}")
+
+    def close(self, timeout: float = 5.0):
+        """Flush what is pending (best effort) and stop."""
+        if not self._thread:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            log.warning(f"Analytics counters lost on shutdown: {e}")
+
+
+def count_rows(bookings: Iterable[Dict[str, Any]], conversations: Iterable[Dict[str, Any]]) -> Dict[Key, float]:
+    """Recompute every counter from booking and conversation rows."""
+    counters: Dict[Key, float] = defaultdict(float)
+    for b in bookings:
+        day, hotel = _day_of(b), str(b.get("hotel_id") or "")
+        counters[(day, "bookings", hotel)] += 1
+        counters[(day, "revenue_inr", hotel)] += float(b.get("total_price") or 0)
+    users_by_day: Dict[str, set] = defaultdict(set)
+    for c in conversations:
+        day, meta = _day_of(c), c.get("meta") or {}
+        if c.get("role") == "user":
+            counters[(day, "chat_messages", "")] += 1
+            users_by_day[day].add(c.get("user_id"))
+        elif meta.get("booking_confirmed"):
+            counters[(day, "chat_bookings", "")] += 1
+        if meta.get("ai_powered"):
+            counters[(day, "llm_replies", "")] += 1
+        elif meta.get("fallback"):
+            counters[(day, "fallback_replies", "")] += 1
+    for day, users in users_by_day.items():
+        counters[(day, "chat_users", "")] = len(users)
+    return counters
+
+
+def _covered_since(table: str, since: Optional[str]) -> Optional[str]:
+    """First day from which `table` still holds every row (and at or after `since`), or None if empty."""
+    import db
+    from archiver import ARCHIVED_TABLES, add_months, archived_months
+
+    oldest = db.get_oldest_created_at(table)
+    if not oldest:
+        return None
+    first = oldest[:10]
+    archived = archived_months(table) if table in ARCHIVED_TABLES else []
+    if archived and archived[-1] >= first[:7]:
+        # The archiver moves whole months; rows left in an archived month are a remainder
+        first = f"{add_months(archived[-1], 1)}-01"
+    return max(first, since) if since else first
+
+
+def rebuild(since: Optional[str] = None, page_rows: int = 1000) -> Dict[str, Any]:
+    """Recompute the counters each table covers from `since` on and replace them in daily_stats."""
+    import db
+
+    def scan(table, start, columns):
+        after_id = None
+        while start:
+            page = db.get_rows_page(table, start, None, after_id, page_rows, columns)
+            yield from page
+            if len(page) < page_rows:
+                return
+            after_id = page[-1]["id"]
+
+    bookings_since = _covered_since("bookings", since)
+    conversations_since = _covered_since("conversations", since)
+    ranges = {}
+    for metric in HOTEL_METRICS if bookings_since else ():
+        ranges[metric] = bookings_since
+    for metric in DAILY_METRICS if conversations_since else ():
+        ranges[metric] = conversations_since
+    if not ranges:
+        return {"since": {}, "rows": 0}
+    counters = count_rows(scan("bookings", bookings_since, "id, hotel_id, total_price, created_at"),
+                          scan("conversations", conversations_since, "id, user_id, role, meta, created_at"))
+    rows = stat_rows(counters)
+    db.replace_daily_stats(ranges, rows)
+    return {"since": {"bookings": bookings_since, "conversations": conversations_since}, "rows": len(rows)}
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[:1] != ["--rebuild"]:
+        print("usage: python analytics.py --rebuild [--since YYYY-MM-DD]")
+        sys.exit(2)
+    since = args[args.index("--since") + 1] if "--since" in args else None
+    print(rebuild(since))
@@ -0,0 +1,317 @@
+"""
+archiver.py
+Monthly archival and retention for the append-mostly tables (conversations, audit_logs).
+
+Rows are grouped into calendar months by `created_at`. Months older than the table's hot
+window (ARCHIVE_HOT_MONTHS, "conversations=3,audit_logs=3") are moved out of the database
+into `ARCHIVE_DIR/<table>/<YYYY-MM>.ndjson.gz`, so the hot tables only ever hold the last few
+months and their created_at indexes stay small.
+
+An archive file is a series of gzip members of up to ARCHIVE_BLOCK_ROWS rows each, sorted by
+id, and `<YYYY-MM>.index.json` records the first id, byte offset and length of every block.
+A point lookup (`find_archived`) binary-searches the index and decompresses a single block.
+
+Archiving is crash-safe: the new archive is written to a temporary file, fsync'd and
+renamed into place before any row is deleted, and rows are deleted by the ids read back
+from the archive. If a run stops half way, the next run merges what is left of the month
+into the existing archive. Archives older than ARCHIVE_KEEP_MONTHS (0 = keep forever) are
+removed.
+
+Run from cron, e.g. daily:  python archiver.py [--dry-run]
+Look up one archived row:   python archiver.py --find conversations <id>
+"""
+import bisect
+import gzip
+import heapq
+import json
+import os
+import sys
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import db
+from log_pipeline import get_logger, dumps
+
+log = get_logger("archiver")
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_HOT_MONTHS = os.getenv("ARCHIVE_HOT_MONTHS", "conversations=3,audit_logs=3")
+ARCHIVE_KEEP_MONTHS = os.getenv("ARCHIVE_KEEP_MONTHS", "conversations=0,audit_logs=0")
+ARCHIVE_BLOCK_ROWS = int(os.getenv("ARCHIVE_BLOCK_ROWS", "1000"))
+ARCHIVE_PAGE_ROWS = int(os.getenv("ARCHIVE_PAGE_ROWS", "1000"))
+
+ARCHIVED_TABLES = ("conversations", "audit_logs")
+
+
+def parse_months(spec: str) -> Dict[str, int]:
+    """"conversations=3,audit_logs=6" -> {"conversations": 3, "audit_logs": 6}."""
+    months = {}
+    for item in spec.split(","):
+        if item.strip():
+            table, _, count = item.partition("=")
+            months[table.strip()] = int(count)
+    return months
+
+
+def month_key(year: int, month: int) -> str:
+    return f"{year:04d}-{month:02d}"
+
+
+def add_months(key: str, delta: int) -> str:
+    year, month = int(key[:4]), int(key[5:7])
+    index = year * 12 + (month - 1) + delta
+    return month_key(index // 12, index % 12 + 1)
+
+
+def month_bounds(key: str) -> Tuple[str, str]:
+    """created_at range [start, end) of a month, as ISO dates."""
+    return f"{key}-01", f"{add_months(key, 1)}-01"
+
+
+def _table_dir(table: str, root: str) -> str:
+    if table not in ARCHIVED_TABLES:
+        raise ValueError(f"{table} is not an archived table")
+    return os.path.join(root, table)
+
+
+def _paths(table: str, month: str, root: str) -> Tuple[str, str]:
+    base = os.path.join(_table_dir(table, root), month)
+    return base + ".ndjson.gz", base + ".index.json"
+
+
+def archived_months(table: str, root: str = ARCHIVE_DIR) -> List[str]:
+    directory = _table_dir(table, root)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(f[:-len(".index.json")] for f in os.listdir(directory) if f.endswith(".index.json"))
+
+
+def _fsync_write(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class _ArchiveWriter:
+    """Writes rows (in id order) as gzip blocks to a temporary file and builds the index."""
+
+    def __init__(self, data_path: str, block_rows: int):
+        self.data_path = data_path
+        self.block_rows = block_rows
+        self._file = open(data_path + ".tmp", "wb")
+        self._block: List[bytes] = []
+        self._first_id: Optional[str] = None
+        self.blocks: List[Dict[str, Any]] = []
+        self.rows = 0
+
+    def add(self, row: Dict[str, Any]):
+        if self._first_id is None:
+            self._first_id = str(row["id"])
+        self._block.append((dumps(row) + "\n").encode("utf-8"))
+        self.rows += 1
+        if len(self._block) >= self.block_rows:
+            self._flush_block()
+
+    def _flush_block(self):
+        if not self._block:
+            return
+        data = gzip.compress(b"".join(self._block))
+        self.blocks.append({"first_id": self._first_id, "offset": self._file.tell(),
+                            "length": len(data), "rows": len(self._block)})
+        self._file.write(data)
+        self._block, self._first_id = [], None
+
+    def commit(self, index_path: str, table: str, month: str):
+        """fsync and move the data file, then the index, into place."""
+        self._flush_block()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        index = {"table": table, "month": month, "rows": self.rows, "blocks": self.blocks}
+        _fsync_write(index_path + ".tmp", json.dumps(index).encode("utf-8"))
+        os.replace(self.data_path + ".tmp", self.data_path)
+        os.replace(index_path + ".tmp", index_path)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self.data_path + ".tmp")
+
+
+def _read_index(index_path: str) -> Dict[str, Any]:
+    with open(index_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _read_block(f, block: Dict[str, Any]) -> List[Dict[str, Any]]:
+    f.seek(block["offset"])
+    text = zlib.decompress(f.read(block["length"]), zlib.MAX_WBITS | 16)
+    return [json.loads(line) for line in text.splitlines() if line]
+
+
+def iter_archive(table: str, month: str, root: str = ARCHIVE_DIR) -> Iterator[Dict[str, Any]]:
+    """All rows of an archived month, in id order, one block in memory at a time."""
+    data_path, index_path = _paths(table, month, root)
+    if not os.path.exists(index_path):
+        return
+    index = _read_index(index_path)
+    with open(data_path, "rb") as f:
+        for block in index["blocks"]:
+            yield from _read_block(f, block)
+
+
+_index_cache: Dict[str, Tuple[float, List[str], List[Dict[str, Any]]]] = {}
+
+
+def _cached_index(index_path: str) -> Tuple[List[str], List[Dict[str, Any]]]:
+    mtime = os.path.getmtime(index_path)
+    cached = _index_cache.get(index_path)
+    if cached is None or cached[0] != mtime:
+        blocks = _read_index(index_path)["blocks"]
+        cached = _index_cache[index_path] = (mtime, [b["first_id"] for b in blocks], blocks)
+    return cached[1], cached[2]
+
+
+def find_archived(table: str, record_id: str, root: str = ARCHIVE_DIR) -> Optional[Dict[str, Any]]:
+    """Point lookup of an archived row by id (newest month first), or None."""
+    record_id = str(record_id)
+    for month in reversed(archived_months(table, root)):
+        data_path, index_path = _paths(table, month, root)
+        try:
+            first_ids, blocks = _cached_index(index_path)
+            i = bisect.bisect_right(first_ids, record_id) - 1
+            if i < 0:
+                continue
+            with open(data_path, "rb") as f:
+                for row in _read_block(f, blocks[i]):
+                    if str(row["id"]) == record_id:
+                        return row
+        except FileNotFoundError:
+            # Removed by retention while we were looking
+            continue
+    return None
+
+
+def _hot_rows(table: str, month: str, page_rows: int) -> Iterator[Dict[str, Any]]:
+    """Database rows created in `month`, in id order, page by page."""
+    start, end = month_bounds(month)
+    after_id = None
+    while True:
+        page = db.get_rows_page(table, start, end, after_id, page_rows)
+        yield from page
+        if len(page) < page_rows:
+            return
+        after_id = page[-1]["id"]
+
+
+def _merged(archived: Iterator[Dict[str, Any]], hot: Iterator[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Merge two id-ordered row streams; the database copy wins when an id is in both."""
+    last = None
+    # Hot rows sort before archived rows with the same id, so they are the ones kept
+    tagged = heapq.merge(((str(r["id"]), 0, r) for r in hot), ((str(r["id"]), 1, r) for r in archived))
+    for row_id, _, row in tagged:
+        if row_id != last:
+            last = row_id
+            yield row
+
+
+def archive_month(table: str, month: str, root: str = ARCHIVE_DIR, block_rows: int = ARCHIVE_BLOCK_ROWS,
+                  page_rows: int = ARCHIVE_PAGE_ROWS) -> Dict[str, int]:
+    """Move one month of `table` into its archive file; returns row counts."""
+    data_path, index_path = _paths(table, month, root)
+    os.makedirs(os.path.dirname(data_path), exist_ok=True)
+    hot = 0
+
+    def counted(rows):
+        nonlocal hot
+        for row in rows:
+            hot += 1
+            yield row
+
+    writer = _ArchiveWriter(data_path, block_rows)
+    try:
+        for row in _merged(iter_archive(table, month, root), counted(_hot_rows(table, month, page_rows))):
+            writer.add(row)
+        if not hot:
+            writer.abort()
+            return {"archived": 0, "deleted": 0}
+        writer.commit(index_path, table, month)
+    except BaseException:
+        if not writer._file.closed:
+            writer.abort()
+        raise
+
+    # The archive is durable; now remove its rows from the database
+    deleted, ids = 0, []
+    for row in iter_archive(table, month, root):
+        ids.append(str(row["id"]))
+        if len(ids) >= page_rows:
+            deleted += db.delete_rows(table, ids)
+            ids = []
+    if ids:
+        deleted += db.delete_rows(table, ids)
+    return {"archived": hot, "deleted": deleted}
+
+
+def _current_month() -> str:
+    now = datetime.now(timezone.utc)
+    return month_key(now.year, now.month)
+
+
+def cold_months(table: str, hot_months: int, current: Optional[str] = None) -> List[str]:
+    """Months with rows in the database that are older than the hot window."""
+    oldest = db.get_oldest_created_at(table)
+    if not oldest:
+        return []
+    cutoff = add_months(current or _current_month(), -hot_months)
+    months, month = [], oldest[:7]
+    while month < cutoff:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def expire_archives(table: str, keep_months: int, root: str = ARCHIVE_DIR, current: Optional[str] = None,
+                    dry_run: bool = False) -> List[str]:
+    """Delete archived months older than `keep_months` (0 keeps everything)."""
+    if keep_months <= 0:
+        return []
+    cutoff = add_months(current or _current_month(), -keep_months)
+    expired = [m for m in archived_months(table, root) if m < cutoff]
+    for month in expired if not dry_run else []:
+        data_path, index_path = _paths(table, month, root)
+        # Index first, so a lookup never finds an index without its data
+        for path in (index_path, data_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    return expired
+
+
+def run(dry_run: bool = False, root: str = ARCHIVE_DIR, current: Optional[str] = None) -> Dict[str, Any]:
+    hot_months = parse_months(ARCHIVE_HOT_MONTHS)
+    keep_months = parse_months(ARCHIVE_KEEP_MONTHS)
+    summary = {}
+    for table in ARCHIVED_TABLES:
+        months = cold_months(table, hot_months.get(table, 3), current)
+        result = {"months": months, "archived": 0, "deleted": 0}
+        for month in months if not dry_run else []:
+            counts = archive_month(table, month, root)
+            result["archived"] += counts["archived"]
+            result["deleted"] += counts["deleted"]
+            if counts["archived"]:
+                log.info(f"Archived {counts['archived']} {table} rows from {month}")
+        result["expired"] = expire_archives(table, keep_months.get(table, 0), root, current, dry_run)
+        summary[table] = result
+    return summary
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[:1] == ["--find"] and len(args) == 3:
+        row = find_archived(args[1], args[2])
+        print(json.dumps(row, indent=2, default=str) if row else "not found")
+        sys.exit(0 if row else 1)
+    print(json.dumps(run(dry_run="--dry-run" in args), indent=2))
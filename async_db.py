@@ -0,0 +1,145 @@
+"""
+async_db.py
+Async interface to the data-access functions in db.py.
+
+The supabase client is synchronous, so calling db.py directly from an `async def` handler
+blocks the event loop for a full HTTP round trip. These wrappers run the sync calls on a
+bounded worker pool (DB_POOL_SIZE threads sharing the client's keep-alive HTTP/2 session)
+with a per-call timeout (DB_TIMEOUT_SECONDS). The in-memory FakeSupabase never blocks, so
+when it is active the calls run inline on the loop.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Callable
+
+import db
+
+_executor = ThreadPoolExecutor(max_workers=db.DB_POOL_SIZE, thread_name_prefix="db")
+
+
+async def run_db(fn: Callable, *args, timeout: Optional[float] = None, **kwargs):
+    """Run a blocking db call on the worker pool and await its result."""
+    if isinstance(db.supabase, db.FakeSupabase):
+        return fn(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    fut = loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+    return await asyncio.wait_for(fut, timeout or db.DB_TIMEOUT_SECONDS)
+
+
+async def execute(query, timeout: Optional[float] = None):
+    """Execute a table query (e.g. `db.supabase.table("x").select("*")...`) without blocking."""
+    aexecute = getattr(query, "aexecute", None)
+    if aexecute:
+        return await aexecute()
+    return await run_db(query.execute, timeout=timeout)
+
+
+async def upsert_user(name: str, phone: str) -> Dict[str, Any]:
+    return await run_db(db.upsert_user, name, phone)
+
+
+async def save_conversation(user_id: Optional[str], role: str, message: str, meta: dict = None):
+    return await run_db(db.save_conversation, user_id, role, message, meta)
+
+
+async def save_conversation_rows(rows: list):
+    return await run_db(db.save_conversation_rows, rows)
+
+
+async def create_booking(user_id: Optional[str], hotel_id: str, hotel_name: str, checkin_date: str,
+                         nights: int, total_price: float, visitors: int = 1):
+    return await run_db(db.create_booking, user_id, hotel_id, hotel_name, checkin_date, nights, total_price, visitors)
+
+
+async def book_hotel(name: str, phone: str, hotel_id: str, hotel_name: str, checkin_date: str, nights: int,
+                     total_price: float, visitors: int = 1, audit_details: Optional[Dict[str, Any]] = None):
+    return await run_db(db.book_hotel, name, phone, hotel_id, hotel_name, checkin_date, nights,
+                        total_price, visitors, audit_details)
+
+
+async def bulk_book(entries: list):
+    return await run_db(db.bulk_book, entries)
+
+
+async def get_booking(booking_id: str):
+    return await run_db(db.get_booking, booking_id)
+
+
+async def get_bookings_by_ids(booking_ids: list):
+    return await run_db(db.get_bookings_by_ids, booking_ids)
+
+
+async def get_bookings_page(checkin_from: str, checkin_to: str, after_id: Optional[str] = None, limit: int = 1000,
+                            columns: str = "*"):
+    return await run_db(db.get_bookings_page, checkin_from, checkin_to, after_id, limit, columns)
+
+
+async def get_conversations_page(limit: int, cursor: Optional[tuple] = None, user_id: Optional[str] = None,
+                                 created_from: Optional[str] = None, created_to: Optional[str] = None,
+                                 columns: str = "*"):
+    return await run_db(db.get_conversations_page, limit, cursor, user_id, created_from, created_to, columns)
+
+
+async def search_conversations(query: str, limit: int = 20, offset: int = 0):
+    return await run_db(db.search_conversations, query, limit, offset)
+
+
+async def get_users_by_ids(user_ids: list):
+    return await run_db(db.get_users_by_ids, user_ids)
+
+
+async def get_rows_page(table: str, created_from: Optional[str], created_to: Optional[str],
+                        after_id: Optional[str] = None, limit: int = 1000, columns: str = "*"):
+    return await run_db(db.get_rows_page, table, created_from, created_to, after_id, limit, columns)
+
+
+async def get_invoice(booking_id: str):
+    return await run_db(db.get_invoice, booking_id)
+
+
+async def get_invoices_for_bookings(booking_ids: list):
+    return await run_db(db.get_invoices_for_bookings, booking_ids)
+
+
+async def save_invoices(invoices: list):
+    return await run_db(db.save_invoices, invoices)
+
+
+async def create_payment_intent(intent: dict):
+    return await run_db(db.create_payment_intent, intent)
+
+
+async def get_payment_intent(payment_id: str):
+    return await run_db(db.get_payment_intent, payment_id)
+
+
+async def get_user_bookings(user_id: str):
+    return await run_db(db.get_user_bookings, user_id)
+
+
+async def get_user_conversations(user_id: str):
+    return await run_db(db.get_user_conversations, user_id)
+
+
+async def create_audit_log(action: str, user_id: Optional[str], resource_type: str, resource_id: str,
+                           details: Optional[Dict[str, Any]] = None):
+    # Only a local append (shipped in the background), so no worker-pool hop
+    return db.create_audit_log(action, user_id, resource_type, resource_id, details)
+
+
+async def expand_conversations(rows: list) -> list:
+    return await run_db(db.expand_conversations, rows)
+
+
+async def conversation_previews(rows: list) -> list:
+    return await run_db(db.conversation_previews, rows)
+
+
+async def test_supabase_connection() -> Dict[str, Any]:
+    return await run_db(db.test_supabase_connection)
+
+
+def shutdown():
+    """Stop the worker pool; queued calls are allowed to finish."""
+    _executor.shutdown(wait=True)
@@ -2,12 +2,18 @@ from typing import Tuple, List, Optional, Dict
 import re
 from datetime import datetime
 from hotels_data import HOTELS
+from message_templates import render
+from inventory import inventory
+from pricing import quote, totals, to_paise, rupees, format_inr, GST_PERCENT
 import os
 import google.generativeai as genai
 from dotenv import load_dotenv
+from log_pipeline import get_logger
 
 load_dotenv()
 
+log = get_logger("chatbot")
+
 # Initialize Gemini API
 GEMINI_KEY = os.getenv("GEMINIE_KEY")  # Note: key is spelled GEMINIE in .env
 if GEMINI_KEY:
@@ -20,6 +26,31 @@ user_preferences = {}
 booking_in_progress = {}
 booking_state = {}
 
+# Bot reply templates. Replies rendered from these are stored by template hash + params
+# (see message_templates.py) instead of repeating the full text in every conversation row.
+WELCOME_TEMPLATE = "🏨 Welcome to Nagpur Hotel Booking Assistant!\n\nTo help you find the perfect hotel, please tell me:\n1️⃣ Your budget per night (e.g., '₹3000')\n2️⃣ Number of nights (e.g., '3 nights')\n3️⃣ Preferred location (optional, e.g., 'Sitabuldi')"
+BUDGET_NOTED_TEMPLATE = "✅ Budget ₹{budget}/night noted.\n\nHow many nights would you like to stay? (e.g., '3 nights')"
+NIGHTS_NOTED_TEMPLATE = "✅ {nights} nights noted.\n\nWhat's your budget per night? (e.g., '₹2500')"
+HOTEL_DETAILS_TEMPLATE = "📍 *{name}*\n\n⭐ {rating} | 💰 ₹{price_per_night}/night | 📍 {area}\n\nAmenities: {amenities}\n\nWould you like to book this hotel?"
+HOTEL_ID_NOT_FOUND_TEMPLATE = "❌ I couldn't find that hotel id. Please use the id shown in the list (e.g., 'h1', 'h2')."
+POPULAR_HOTELS_TEMPLATE = "📋 Here are popular hotels in Nagpur. Click on a hotel or reply with the hotel id (e.g., 'h1') to view details or book."
+NO_HOTELS_TEMPLATE = "😔 Sorry, no hotels found under ₹{budget}/night. Would you like me to show options up to ₹{next_budget}?"
+HOTELS_FOUND_TEMPLATE = "🎉 Found {count} hotels for {nights} nights within ₹{budget}/night. Here are the top options:\n\nSelect a hotel to proceed or ask for details."
+BOOKING_CONFIRMED_TEMPLATE = "✅ Perfect! Your booking is confirmed. Redirecting to payment. Your booking will be completed once payment is processed."
+BOOKING_CANCELLED_TEMPLATE = "❌ Booking cancelled. No charges will be made. Let me help you search for different hotels. What's your budget per night?"
+CONFIRM_PROMPT_TEMPLATE = "Please confirm by typing 'yes' to proceed with the booking, or 'no' to cancel."
+NAME_NOTED_TEMPLATE = "✅ Thank you, {name}. Now please provide your phone number (10 digits, e.g., 9876543210)."
+INVALID_NAME_TEMPLATE = "Please provide a valid name (at least 2 characters)."
+PHONE_NOTED_TEMPLATE = "✅ Thank you. Now please provide your check-in date in YYYY-MM-DD format (e.g., 2025-12-25)."
+INVALID_PHONE_TEMPLATE = "Please provide a valid 10-digit phone number."
+INVALID_DATE_TEMPLATE = "Please provide a valid date in YYYY-MM-DD format (e.g., 2025-12-25)."
+SELECT_HOTEL_FIRST_TEMPLATE = "📋 Please first select a hotel from the list before booking."
+ASK_NIGHTS_TEMPLATE = "How many nights would you like to stay?"
+COLLECT_DETAILS_TEMPLATE = "📝 To complete your booking, I'll need some details.\n\nFirst, please provide your full name."
+SEARCH_OFFER_TEMPLATE = "You're looking for a hotel under ₹{budget}/night for {nights} nights. Would you like me to show you the available hotels?"
+SOLD_OUT_TEMPLATE = "😔 Sorry, {hotel_name} has no rooms left for {nights} nights from {checkin_date}. Please try another check-in date in YYYY-MM-DD format."
+FALLBACK_TEMPLATE = "Sorry, I'm having trouble generating a reply right now. Please try again shortly."
+
 def parse_budget(message: str) -> Optional[int]:
     m = re.search(r"₹\s*(\d{3,6})|(\d{3,6})", message.replace(",", ""))
     if m:
@@ -115,7 +146,13 @@ def prepare_booking_confirmation(user_id: str, name: str, phone: str, hotel_id:
     if not hotel:
         return ("❌ Hotel not found", None)
     
-    total_price = hotel["price_per_night"] * nights
+    # Hold a room while the user decides; replaces any hold from an earlier summary
+    release_booking_hold(user_id)
+    hold = inventory.hold(hotel_id, checkin_date, nights, owner=user_id)
+    if not hold:
+        return (render(SOLD_OUT_TEMPLATE, hotel_name=hotel["name"], nights=nights, checkin_date=checkin_date), None)
+    
+    total_price = rupees(quote(hotel, nights, checkin_date)["subtotal_paise"])
     
     summary = format_booking_summary(hotel, nights, total_price, name, checkin_date)
     confirmation_text = summary + "\n\n🔐 **Confirm booking? Please reply 'yes' to confirm or 'no' to cancel.**"
@@ -127,18 +164,24 @@ def prepare_booking_confirmation(user_id: str, name: str, phone: str, hotel_id:
         "hotel_id": hotel_id,
         "checkin_date": checkin_date,
         "nights": nights,
-        "visitors": 1
+        "visitors": 1,
+        "hold_id": hold.id
     }
     
     booking_in_progress[user_id] = booking_data
     
     return (confirmation_text, booking_data)
 
-def generate_bill(hotel: dict, nights: int, guest_name: str, booking_id: str) -> str:
+def release_booking_hold(user_id: str):
+    """Release the inventory hold of the user's pending booking, if any."""
+    booking_data = booking_in_progress.pop(user_id, None)
+    if booking_data:
+        inventory.release(booking_data.get("hold_id"))
+
+def generate_bill(hotel: dict, nights: int, guest_name: str, booking_id: str, checkin_date: str = None) -> str:
     price_per_night = hotel["price_per_night"]
-    subtotal = price_per_night * nights
-    tax = subtotal * 0.18
-    total = subtotal + tax
+    q = quote(hotel, nights, checkin_date)
+    subtotal, tax, total = rupees(q["subtotal_paise"]), rupees(q["gst_paise"]), rupees(q["total_paise"])
     
     bill = f"""
 ╔════════════════════════════════════════╗
@@ -153,7 +196,7 @@ def generate_bill(hotel: dict, nights: int, guest_name: str, booking_id: str) ->
 ║ Price/Night: ₹{price_per_night:<28} ║
 ║ Number of Nights: {nights:<20} ║
 ║ Subtotal: ₹{subtotal:<30.2f} ║
-║ Tax (18% GST): ₹{tax:<25.2f} ║
+║ Tax ({GST_PERCENT}% GST): ₹{tax:<25.2f} ║
 ╠════════════════════════════════════════╣
 ║ TOTAL AMOUNT: ₹{total:<27.2f} ║
 ╚════════════════════════════════════════╝
@@ -163,9 +206,9 @@ def generate_bill(hotel: dict, nights: int, guest_name: str, booking_id: str) ->
 def format_booking_summary(hotel: dict, nights: int, total_price: float, name: str = None, checkin_date: str = None) -> str:
     """Format booking details summary for user confirmation per spec."""
     price_per_night = hotel["price_per_night"]
-    subtotal = total_price
-    tax = subtotal * 0.18
-    total_with_tax = subtotal + tax
+    t = totals(to_paise(total_price))
+    # Seasonal/weekend rate rules make the stay differ from base rate x nights
+    rate_note = "" if t["subtotal_paise"] == to_paise(price_per_night) * nights else "\n  • Date-based rates applied"
     
     summary = f"""
 📋 **BOOKING SUMMARY**
@@ -183,16 +226,16 @@ def format_booking_summary(hotel: dict, nights: int, total_price: float, name: s
     
     summary += f"""
 💰 Pricing Breakdown:
-  • Price per night: ₹{price_per_night:,.2f}
-  • Number of nights: {nights}
+  • Price per night: ₹{format_inr(to_paise(price_per_night))}
+  • Number of nights: {nights}{rate_note}
   ┌─────────────────────────────────┐
-  • Subtotal (Before Taxes): ₹{subtotal:,.2f}
+  • Subtotal (Before Taxes): ₹{format_inr(t['subtotal_paise'])}
   
 📊 Taxes & Total:
-  • GST (18%): ₹{tax:,.2f}
+  • GST ({GST_PERCENT}%): ₹{format_inr(t['gst_paise'])}
   
 💳 Final Amount:
-  ✅ TOTAL AMOUNT DUE: ₹{total_with_tax:,.2f}
+  ✅ TOTAL AMOUNT DUE: ₹{format_inr(t['total_paise'])}
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 """
     
@@ -225,7 +268,7 @@ Respond naturally and helpfully. Keep responses concise (1-2 sentences)."""
     except Exception as e:
         # Return a helpful fallback string so callers get a usable response
         err_msg = f"⚠️ AI temporarily unavailable: {str(e)}"
-        print(f"Gemini API Error: {e}")
+        log.error(f"Gemini API Error: {e}")
         return err_msg
 
 def bot_reply(user_msg: str, user_id: str = None) -> Tuple[str, Optional[List[dict]], dict]:
@@ -235,11 +278,10 @@ def bot_reply(user_msg: str, user_id: str = None) -> Tuple[str, Optional[List[di
     if any(w in lower for w in ["hi", "hello", "hey", "namaste", "start", "begin"]):
         if user_id not in user_preferences:
             user_preferences[user_id] = {"budget": None, "nights": None, "location": None, "selected_hotel": None}
-        if user_id in booking_in_progress:
-            del booking_in_progress[user_id]
+        release_booking_hold(user_id)
         if user_id in booking_state:
             del booking_state[user_id]
-        reply = "🏨 Welcome to Nagpur Hotel Booking Assistant!\n\nTo help you find the perfect hotel, please tell me:\n1️⃣ Your budget per night (e.g., '₹3000')\n2️⃣ Number of nights (e.g., '3 nights')\n3️⃣ Preferred location (optional, e.g., 'Sitabuldi')"
+        reply = render(WELCOME_TEMPLATE)
         return reply, None, meta
 
     if user_id not in user_preferences:
@@ -274,11 +316,11 @@ def bot_reply(user_msg: str, user_id: str = None) -> Tuple[str, Optional[List[di
         meta["location"] = location
     
     if budget and not pref["nights"]:
-        reply = f"✅ Budget ₹{budget}/night noted.\n\nHow many nights would you like to stay? (e.g., '3 nights')"
+        reply = render(BUDGET_NOTED_TEMPLATE, budget=budget)
         return reply, None, meta
     
     if nights and not pref["budget"]:
-        reply = f"✅ {nights} nights noted.\n\nWhat's your budget per night? (e.g., '₹2500')"
+        reply = render(NIGHTS_NOTED_TEMPLATE, nights=nights)
         return reply, None, meta
     
     m_id = re.search(r"\b(h\d{1,2})\b", user_msg.lower())
@@ -289,11 +331,14 @@ def bot_reply(user_msg: str, user_id: str = None) -> Tuple[str, Optional[List[di
             pref["selected_hotel"] = hotel
             pref["awaiting_booking_decision"] = True
             meta["selected_hotel"] = hotel
-            details = f"⭐ {hotel['rating']} | 💰 ₹{hotel['price_per_night']}/night | 📍 {hotel['area']}\n\nAmenities: {hotel.get('amenities', 'N/A')}"
-            reply = f"📍 *{hotel['name']}*\n\n{details}\n\nWould you like to book this hotel?"
+            reply = render(
+                HOTEL_DETAILS_TEMPLATE,
+                name=hotel["name"], rating=hotel["rating"], price_per_night=hotel["price_per_night"],
+                area=hotel["area"], amenities=hotel.get("amenities", "N/A")
+            )
             return reply, [hotel], meta
         else:
-            return "❌ I couldn't find that hotel id. Please use the id shown in the list (e.g., 'h1', 'h2').", None, meta
+            return render(HOTEL_ID_NOT_FOUND_TEMPLATE), None, meta
 
     if any(w in lower for w in ["show hotels", "list hotels", "hotels in nagpur", "show me hotels", "find hotels"]):
         hotels = sorted(HOTELS, key=lambda x: (-x["rating"], x["price_per_night"]))[:6]
@@ -301,7 +346,7 @@ def bot_reply(user_msg: str, user_id: str = None) -> Tuple[str, Optional[List[di
             {"id": h["id"], "name": h["name"], "price_per_night": h["price_per_night"], "rating": h["rating"], "area": h["area"]}
             for h in hotels
         ]
-        reply = "📋 Here are popular hotels in Nagpur. Click on a hotel or reply with the hotel id (e.g., 'h1') to view details or book."
+        reply = render(POPULAR_HOTELS_TEMPLATE)
         return reply, suggestions, meta
 
     if pref["budget"] and pref["nights"] and not pref.get("selected_hotel"):
@@ -312,7 +357,7 @@ def bot_reply(user_msg: str, user_id: str = None) -> Tuple[str, Optional[List[di
         )
         
         if not hotels:
-            reply = f"😔 Sorry, no hotels found under ₹{pref['budget']}/night. Would you like me to show options up to ₹{pref['budget'] + 1000}?"
+            reply = render(NO_HOTELS_TEMPLATE, budget=pref["budget"], next_budget=pref["budget"] + 1000)
             return reply, None, meta
         
         suggestions = [
@@ -326,7 +371,7 @@ def bot_reply(user_msg: str, user_id: str = None) -> Tuple[str, Optional[List[di
             for h in hotels
         ]
         
-        reply = f"🎉 Found {len(hotels)} hotels for {pref['nights']} nights within ₹{pref['budget']}/night. Here are the top options:\n\nSelect a hotel to proceed or ask for details."
+        reply = render(HOTELS_FOUND_TEMPLATE, count=len(hotels), nights=pref["nights"], budget=pref["budget"])
         meta["hotels"] = suggestions
         return reply, suggestions, meta
 
@@ -341,21 +386,35 @@ def bot_reply(user_msg: str, user_id: str = None) -> Tuple[str, Optional[List[di
             matches_no = any(w in lower for w in no_keywords)
             
             if matches_yes and not matches_no:
-                reply = "✅ Perfect! Your booking is confirmed. Redirecting to payment. Your booking will be completed once payment is processed."
+                booking_data = state["booking_data"]
+                # Keep the room while the user pays; take a new hold if this one expired
+                if not inventory.refresh(booking_data.get("hold_id")):
+                    summary, booking_data = prepare_booking_confirmation(
+                        user_id, state["name"], state["phone"], state["hotel_id"], state["checkin_date"], state["nights"]
+                    )
+                    if not booking_data:
+                        state["step"] = "collect_date"
+                        return summary, None, meta
+                    state["booking_data"] = booking_data
+                meta["hold_expires_in"] = int(inventory.hold_seconds)
+                reply = render(BOOKING_CONFIRMED_TEMPLATE)
                 meta["action"] = "proceed_to_payment"
                 meta["booking"] = state["booking_data"]
+                # /book commits this hold instead of taking a second one
+                meta["hold_id"] = state["booking_data"]["hold_id"]
                 meta["booking_confirmed"] = True
                 del booking_state[user_id]
                 return reply, None, meta
             
             elif matches_no and not matches_yes:
+                release_booking_hold(user_id)
                 del booking_state[user_id]
-                reply = "❌ Booking cancelled. No charges will be made. Let me help you search for different hotels. What's your budget per night?"
+                reply = render(BOOKING_CANCELLED_TEMPLATE)
                 user_preferences[user_id]["selected_hotel"] = None
                 return reply, None, meta
             
             else:
-                reply = "Please confirm by typing 'yes' to proceed with the booking, or 'no' to cancel."
+                reply = render(CONFIRM_PROMPT_TEMPLATE)
                 return reply, None, meta
         
         elif state["step"] == "collect_name":
@@ -363,10 +422,10 @@ def bot_reply(user_msg: str, user_id: str = None) -> Tuple[str, Optional[List[di
             if name:
                 state["name"] = name
                 state["step"] = "collect_phone"
-                reply = f"✅ Thank you, {name}. Now please provide your phone number (10 digits, e.g., 9876543210)."
+                reply = render(NAME_NOTED_TEMPLATE, name=name)
                 return reply, None, meta
             else:
-                reply = "Please provide a valid name (at least 2 characters)."
+                reply = render(INVALID_NAME_TEMPLATE)
                 return reply, None, meta
         
         elif state["step"] == "collect_phone":
@@ -374,25 +433,28 @@ def bot_reply(user_msg: str, user_id: str = None) -> Tuple[str, Optional[List[di
             if phone:
                 state["phone"] = phone
                 state["step"] = "collect_date"
-                reply = f"✅ Thank you. Now please provide your check-in date in YYYY-MM-DD format (e.g., 2025-12-25)."
+                reply = render(PHONE_NOTED_TEMPLATE)
                 return reply, None, meta
             else:
-                reply = "Please provide a valid 10-digit phone number."
+                reply = render(INVALID_PHONE_TEMPLATE)
                 return reply, None, meta
         
         elif state["step"] == "collect_date":
             date = parse_checkin_date(user_msg)
             if date:
-                state["checkin_date"] = date
-                state["step"] = "confirm_summary"
-                
                 summary, booking_data = prepare_booking_confirmation(
-                    user_id, state["name"], state["phone"], state["hotel_id"], state["checkin_date"], state["nights"]
+                    user_id, state["name"], state["phone"], state["hotel_id"], date, state["nights"]
                 )
+                if not booking_data:
+                    # Sold out for these dates: stay on this step and ask for another date
+                    return summary, None, meta
+                state["checkin_date"] = date
+                state["step"] = "confirm_summary"
                 state["booking_data"] = booking_data
+                meta["hold_expires_in"] = int(inventory.hold_seconds)
                 return summary, None, meta
             else:
-                reply = "Please provide a valid date in YYYY-MM-DD format (e.g., 2025-12-25)."
+                reply = render(INVALID_DATE_TEMPLATE)
                 return reply, None, meta
     
     booking_keywords = ["book", "booking", "i want to book", "reserve", "proceed", "register", "registration"]
@@ -410,12 +472,12 @@ def bot_reply(user_msg: str, user_id: str = None) -> Tuple[str, Optional[List[di
         selected_hotel = pref.get("selected_hotel")
         
         if not selected_hotel:
-            reply = "📋 Please first select a hotel from the list before booking."
+            reply = render(SELECT_HOTEL_FIRST_TEMPLATE)
             return reply, None, meta
         
         nights_val = pref.get("nights")
         if not nights_val:
-            reply = "How many nights would you like to stay?"
+            reply = render(ASK_NIGHTS_TEMPLATE)
             return reply, None, meta
         
         booking_state[user_id] = {
@@ -428,12 +490,12 @@ def bot_reply(user_msg: str, user_id: str = None) -> Tuple[str, Optional[List[di
             "booking_data": None
         }
         
-        reply = "📝 To complete your booking, I'll need some details.\n\nFirst, please provide your full name."
+        reply = render(COLLECT_DETAILS_TEMPLATE)
         meta["action"] = "collect_booking_details"
         return reply, None, meta
 
     if pref.get("budget") and pref.get("nights"):
-        reply = f"You're looking for a hotel under ₹{pref['budget']}/night for {pref['nights']} nights. Would you like me to show you the available hotels?"
+        reply = render(SEARCH_OFFER_TEMPLATE, budget=pref["budget"], nights=pref["nights"])
         return reply, None, meta
     
     # Try Gemini for general questions not related to hotel booking
@@ -445,6 +507,7 @@ def bot_reply(user_msg: str, user_id: str = None) -> Tuple[str, Optional[List[di
 
     # Fallback: if no specialized handler matched and Gemini didn't produce a response,
     # return a safe generic reply so callers always receive a 3-tuple.
-    fallback = "Sorry, I'm having trouble generating a reply right now. Please try again shortly."
+    fallback = render(FALLBACK_TEMPLATE)
+    meta["fallback"] = True
     return fallback, None, meta
     
@@ -1,44 +1,94 @@
 # db.py
 import os
-from typing import Optional, Dict, Any
-from uuid import uuid4
+import heapq
+import operator
+import threading
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Optional, Dict, Any, List
+from uuid import UUID, uuid4
 from dotenv import load_dotenv
+from message_templates import compact, expand_message
+from write_behind import WriteBehindQueue
+from sqlite_backend import SQLiteSupabase
+from resilient_backend import ResilientSupabase, is_outage_error
+from segment_log import SegmentLog
+from analytics import StatsCounters
+from local_rpc import LocalRPC
+from text_search import InvertedIndex, conversation_text, query_tokens
+from log_pipeline import get_logger
 
 # Load environment variables from .env file
 load_dotenv()
 
+log = get_logger("db")
+
 # Try to import supabase client if available and configured; if not, use an in-memory FakeSupabase
 try:
     from supabase import create_client, Client
+    from supabase.lib.client_options import ClientOptions
 except Exception as e:
     create_client = None
     Client = None
+    ClientOptions = None
 
 # Default to the project URL you provided (can be overridden with SUPABASE_URL env var)
 DEFAULT_SUPABASE_URL = "https://dehuipkdltaiumsifyka.supabase.co"
 SUPABASE_URL = os.getenv("SUPABASE_URL", DEFAULT_SUPABASE_URL)
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
+# Connection pool / timeout settings shared by the sync client and async_db's worker pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_TIMEOUT_SECONDS = float(os.getenv("DB_TIMEOUT_SECONDS", "10"))
+
 class FakeResponse:
     def __init__(self, data):
         self.data = data
 
+# Columns FakeSupabase keeps hash indexes for (equality filters and upsert conflict lookups)
+FAKE_INDEXED_COLUMNS = ("id", "phone", "user_id", "hash", "booking_id")
+
+# Range filters compare as strings, like the ISO dates/timestamps and uuids they are used on
+FAKE_RANGE_OPS = {"gt": operator.gt, "gte": operator.ge, "lt": operator.lt, "lte": operator.le}
+
 class FakeTable:
-    def __init__(self, storage, name):
-        self._storage = storage
+    def __init__(self, db, name):
+        self._db = db
         self._name = name
         self._select_cols = None
         self._filters = []
         self._limit = None
         self._order_by = None
         self._order_desc = False
+        self._order_more = []  # secondary sort keys: (col, desc)
 
     def select(self, *cols):
-        self._select_cols = cols
+        cols = [c.strip() for c in ",".join(cols).split(",") if c.strip()]
+        self._select_cols = cols if cols and cols != ["*"] else None
         return self
 
     def eq(self, col, val):
-        self._filters.append((col, val))
+        self._filters.append((col, "eq", val))
+        return self
+
+    def in_(self, col, values):
+        self._filters.append((col, "in", set(values)))
+        return self
+
+    def gt(self, col, val):
+        self._filters.append((col, "gt", val))
+        return self
+
+    def gte(self, col, val):
+        self._filters.append((col, "gte", val))
+        return self
+
+    def lt(self, col, val):
+        self._filters.append((col, "lt", val))
+        return self
+
+    def lte(self, col, val):
+        self._filters.append((col, "lte", val))
         return self
 
     def limit(self, n):
@@ -48,57 +98,163 @@ class FakeTable:
     def order(self, col, desc=False, ascending=None):
         if not col:
             raise ValueError("order() column cannot be empty")
-        self._order_by = col
-        if ascending is not None:
-            self._order_desc = not ascending
+        desc = (not ascending) if ascending is not None else desc
+        if self._order_by:
+            # Further order() calls break ties, like the supabase client
+            self._order_more.append((col, desc))
         else:
-            self._order_desc = desc
+            self._order_by, self._order_desc = col, desc
         return self
 
     def insert(self, payload):
-        self._insert_payload = payload if isinstance(payload, dict) else (payload[0] if payload else {})
+        # Accept a single row or a list of rows (bulk insert), like the supabase client
+        self._insert_payload = payload
         return self
 
+    def upsert(self, payload, on_conflict="id", ignore_duplicates=False):
+        # ignore_duplicates keeps existing rows and returns only the inserted ones, like the supabase client
+        self._upsert_payload = payload
+        self._on_conflict = on_conflict
+        self._ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, changes):
+        # Applied to every row matching the filters, like the supabase client
+        self._update_payload = changes
+        return self
+
+    def delete(self):
+        self._delete = True
+        return self
+
+    def _prepare_row(self, payload):
+        if not isinstance(payload, dict):
+            raise ValueError("Insert payload must be a dictionary")
+        payload = dict(payload)
+        if "id" not in payload:
+            payload["id"] = str(uuid4())
+        if "created_at" not in payload:
+            payload["created_at"] = datetime.now(timezone.utc).isoformat()
+        return payload
+
+    async def aexecute(self):
+        """Async counterpart of execute(); in-memory queries never block, so they run inline."""
+        return self.execute()
+
+    def _candidates(self):
+        """Return (rows, remaining_filters, in_insertion_order), using a hash index for the
+        first eq()/in_() filter on an indexed column. An in_() lookup merges several index buckets, so its rows are
+        no longer in insertion order."""
+        filters = list(self._filters)
+        for i, (col, op, val) in enumerate(filters):
+            if col in FAKE_INDEXED_COLUMNS and op in ("eq", "in"):
+                del filters[i]
+                if op == "eq":
+                    return self._db._lookup(self._name, col, val), filters, True
+                rows = [r for v in val for r in self._db._lookup(self._name, col, v)]
+                return rows, filters, len(val) <= 1
+        return self._db._rows(self._name), filters, True
+
+    def _sorted(self, rows):
+        """Rows sorted by every order() key (stable sorts, last key first)."""
+        rows = list(rows)
+        for col, desc in reversed([(self._order_by, self._order_desc)] + self._order_more):
+            rows.sort(key=lambda x: (x.get(col) is None, x.get(col, '')), reverse=desc)
+        return rows
+
+    @staticmethod
+    def _matches(row, filters):
+        for col, op, val in filters:
+            v = row.get(col)
+            if op == "eq":
+                if v != val:
+                    return False
+            elif op == "in":
+                if v not in val:
+                    return False
+            elif v is None or not FAKE_RANGE_OPS[op](str(v), str(val)):
+                return False
+        return True
+
     def execute(self):
         try:
-            if hasattr(self, '_insert_payload') and self._insert_payload is not None:
-                payload = self._insert_payload
-                if not isinstance(payload, dict):
-                    raise ValueError("Insert payload must be a dictionary")
-                if "id" not in payload:
-                    payload = {**payload, "id": str(uuid4())}
-                if "created_at" not in payload:
-                    from datetime import datetime
-                    payload["created_at"] = datetime.now().isoformat()
-                self._storage.setdefault(self._name, []).append(payload)
+            if getattr(self, '_upsert_payload', None) is not None:
+                payloads = self._upsert_payload if isinstance(self._upsert_payload, list) else [self._upsert_payload]
+                self._upsert_payload = None
+                result = []
+                for payload in payloads:
+                    matches = self._db._lookup(self._name, self._on_conflict, payload.get(self._on_conflict))
+                    if matches:
+                        if not self._ignore_duplicates:
+                            result.append(self._db._update_row(self._name, matches[0], payload))
+                    else:
+                        result.append(self._db._insert_row(self._name, self._prepare_row(payload)))
+                return FakeResponse(result)
+
+            if getattr(self, '_insert_payload', None) is not None:
+                payloads = self._insert_payload if isinstance(self._insert_payload, list) else [self._insert_payload]
                 self._insert_payload = None
-                return FakeResponse([payload])
-            
-            table = list(self._storage.get(self._name, []))
-            if not isinstance(table, list):
-                raise ValueError(f"Table '{self._name}' data is corrupted")
-            
-            for col, val in self._filters:
+                result = [self._prepare_row(payload) for payload in payloads]
+                for row in result:
+                    self._db._insert_row(self._name, row)
+                return FakeResponse(result)
+
+            for col, _, _ in self._filters:
                 if not col:
                     raise ValueError("Filter column name cannot be empty")
-                table = [r for r in table if r.get(col) == val]
-            
+
+            if getattr(self, '_update_payload', None) is not None:
+                changes, self._update_payload = dict(self._update_payload), None
+                if not self._filters:
+                    raise ValueError("update() requires at least one filter")
+                rows, filters, _ = self._candidates()
+                matched = [r for r in rows if self._matches(r, filters)]
+                with self._db._lock:
+                    return FakeResponse([self._db._update_row(self._name, r, changes) for r in matched])
+            if getattr(self, '_delete', False):
+                self._delete = False
+                if not self._filters:
+                    raise ValueError("delete() requires at least one filter")
+                rows, filters, _ = self._candidates()
+                matched = [r for r in rows if self._matches(r, filters)]
+                self._db._delete_rows(self._name, matched)
+                return FakeResponse(matched)
+            if self._limit and self._limit < 0:
+                raise ValueError("Limit must be non-negative")
+
+            rows, filters, in_order = self._candidates()
+            if filters:
+                matched = (r for r in rows if self._matches(r, filters))
+            else:
+                matched = rows
+
             if self._order_by:
-                valid_cols = set()
-                if table:
-                    valid_cols = set(table[0].keys())
-                    if self._order_by not in valid_cols:
-                        raise ValueError(f"Column '{self._order_by}' does not exist in table '{self._name}'. Available columns: {', '.join(valid_cols)}")
+                if rows and self._order_by not in rows[0]:
+                    valid_cols = set(rows[0].keys())
+                    raise ValueError(f"Column '{self._order_by}' does not exist in table '{self._name}'. Available columns: {', '.join(valid_cols)}")
+                key = lambda x: (x.get(self._order_by) is None, x.get(self._order_by, ''))
                 try:
-                    table.sort(key=lambda x: (x.get(self._order_by) is None, x.get(self._order_by, '')), reverse=self._order_desc)
+                    if self._order_more:
+                        table = self._sorted(matched)
+                        table = table[:self._limit] if self._limit else table
+                    elif self._order_by == "created_at" and in_order and self._db._created_at_ordered(self._name):
+                        # Rows (and index buckets) are kept in insertion order, which is created_at order
+                        if self._order_desc:
+                            matched = reversed(rows) if not filters else (r for r in reversed(rows) if self._matches(r, filters))
+                        table = list(islice(matched, self._limit)) if self._limit else list(matched)
+                    elif self._limit:
+                        # Top-k selection instead of sorting the whole table
+                        select = heapq.nlargest if self._order_desc else heapq.nsmallest
+                        table = select(self._limit, matched, key=key)
+                    else:
+                        table = sorted(matched, key=key, reverse=self._order_desc)
                 except Exception as e:
                     raise ValueError(f"Error ordering by column '{self._order_by}': {str(e)}")
-            
-            if self._limit:
-                if self._limit < 0:
-                    raise ValueError("Limit must be non-negative")
-                table = table[: self._limit]
-            
+            else:
+                table = list(islice(matched, self._limit)) if self._limit else list(matched)
+
+            if self._select_cols:
+                table = [{c: r.get(c) for c in self._select_cols} for r in table]
             return FakeResponse(table)
         except ValueError as e:
             raise ValueError(f"Query error in table '{self._name}': {str(e)}")
@@ -107,30 +263,188 @@ class FakeTable:
 
 class FakeSupabase:
     def __init__(self):
-        self._storage = {"users": [], "bookings": [], "conversations": [], "audit_logs": []}
+        self._storage = {"users": [], "bookings": [], "conversations": [], "audit_logs": [], "message_templates": [], "invoices": [], "payment_intents": [], "daily_stats": []}
+        # table -> column -> value -> rows (in insertion order)
+        self._indexes = {}
+        # tables whose rows were appended with non-decreasing created_at
+        self._unordered = set()
+        self._lock = threading.RLock()
+        # rows inserted by the transaction in progress (rolled back if it fails)
+        self._tx_rows = None
+        # full-text index over conversations, kept in step with the hash indexes
+        self._search = InvertedIndex()
 
     def table(self, name):
-        return FakeTable(self._storage, name)
+        return FakeTable(self, name)
+
+    def rpc(self, fn, params=None):
+        return LocalRPC(self, fn, params)
+
+    def transaction(self):
+        return _FakeTransaction(self)
+
+    def _rows(self, name):
+        rows = self._storage.setdefault(name, [])
+        if not isinstance(rows, list):
+            raise ValueError(f"Table '{name}' data is corrupted")
+        return rows
+
+    def _lookup(self, name, col, val):
+        if col not in FAKE_INDEXED_COLUMNS:
+            return [r for r in self._rows(name) if r.get(col) == val]
+        return self._indexes.get(name, {}).get(col, {}).get(val, [])
+
+    def _created_at_ordered(self, name):
+        return name not in self._unordered
+
+    def search_conversations(self, query: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        """Ranked full-text search (see text_search.py); best first, ties newest first."""
+        with self._lock:
+            scores = self._search.search(query_tokens(query))
+            hits = [(score, row) for doc_id, score in scores.items() for row in self._lookup("conversations", "id", doc_id)]
+        hits.sort(key=lambda h: (h[0], str(h[1].get("created_at")), str(h[1].get("id"))), reverse=True)
+        return [{**row, "rank": score} for score, row in hits[offset:offset + limit]]
+
+    def _index_add(self, name, row):
+        if name == "conversations":
+            self._search.add(row.get("id"), conversation_text(row))
+        table_idx = self._indexes.setdefault(name, {})
+        for col in FAKE_INDEXED_COLUMNS:
+            if row.get(col) is not None:
+                table_idx.setdefault(col, {}).setdefault(row[col], []).append(row)
+
+    def _index_remove(self, name, row):
+        if name == "conversations":
+            self._search.remove(row.get("id"))
+        table_idx = self._indexes.get(name, {})
+        for col in FAKE_INDEXED_COLUMNS:
+            bucket = table_idx.get(col, {}).get(row.get(col))
+            if bucket:
+                bucket[:] = [r for r in bucket if r is not row]
+                if not bucket:
+                    del table_idx[col][row.get(col)]
+
+    def _insert_row(self, name, row):
+        with self._lock:
+            rows = self._rows(name)
+            if rows and name not in self._unordered and str(row.get("created_at")) < str(rows[-1].get("created_at")):
+                self._unordered.add(name)
+            rows.append(row)
+            self._index_add(name, row)
+            if self._tx_rows is not None:
+                self._tx_rows.append((name, row))
+        return row
+
+    def _delete_row(self, name, row):
+        with self._lock:
+            rows = self._rows(name)
+            for i in range(len(rows) - 1, -1, -1):
+                if rows[i] is row:
+                    del rows[i]
+                    break
+            self._index_remove(name, row)
+
+    def _delete_rows(self, name, rows):
+        """Remove many rows with one pass over the table."""
+        doomed = {id(r) for r in rows}
+        if not doomed:
+            return
+        with self._lock:
+            table = self._rows(name)
+            table[:] = [r for r in table if id(r) not in doomed]
+            for row in rows:
+                self._index_remove(name, row)
+
+    def _update_row(self, name, row, changes):
+        with self._lock:
+            self._index_remove(name, row)
+            if "created_at" in changes and changes["created_at"] != row.get("created_at"):
+                self._unordered.add(name)
+            row.update(changes)
+            self._index_add(name, row)
+        return row
+
+class _FakeTransaction:
+    """Holds the storage lock for the block; rows inserted inside are removed again if it raises."""
+
+    def __init__(self, db):
+        self._db = db
+        self._owner = False
+
+    def __enter__(self):
+        self._db._lock.acquire()
+        self._owner = self._db._tx_rows is None
+        if self._owner:
+            self._db._tx_rows = []
+        return self._db
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if self._owner:
+                inserted, self._db._tx_rows = self._db._tx_rows, None
+                if exc_type:
+                    for name, row in reversed(inserted):
+                        self._db._delete_row(name, row)
+        finally:
+            self._db._lock.release()
+        return False
+
+# Local backend used when Supabase is not configured or unreachable:
+# "sqlite" keeps data durable in LOCAL_DB_PATH, "memory" uses the in-process FakeSupabase
+DB_FALLBACK = os.getenv("DB_FALLBACK", "sqlite").lower()
+LOCAL_DB_PATH = os.getenv("LOCAL_DB_PATH", "local_data.db")
+
+def _local_backend():
+    if DB_FALLBACK == "sqlite":
+        try:
+            backend = SQLiteSupabase(LOCAL_DB_PATH)
+            log.info(f'Using local SQLite storage at {LOCAL_DB_PATH}')
+            return backend, "sqlite"
+        except Exception as e:
+            log.error(f"Error initializing SQLite storage; using in-memory FakeSupabase: {e}")
+    return FakeSupabase(), "memory"
+
+# Resilient mode (default when Supabase is configured): writes made during an outage go to
+# the local SQLite store and are replayed to Supabase in bulk when it is reachable again
+DB_RESILIENT = os.getenv("DB_RESILIENT", "true").lower() in ("1", "true", "yes")
+SYNC_PROBE_SECONDS = float(os.getenv("SYNC_PROBE_SECONDS", "10"))
+SYNC_BATCH_ROWS = int(os.getenv("SYNC_BATCH_ROWS", "200"))
+SYNC_CONCURRENCY = int(os.getenv("SYNC_CONCURRENCY", "4"))
 
 USE_FAKE = True
+BACKEND = "memory"
 if create_client and SUPABASE_URL and SUPABASE_KEY:
     try:
-        supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+        # The PostgREST session is a single keep-alive HTTP/2 httpx client shared by all threads
+        remote_client: Client = create_client(
+            SUPABASE_URL, SUPABASE_KEY,
+            options=ClientOptions(postgrest_client_timeout=DB_TIMEOUT_SECONDS)
+        )
         # Quick connection test (non-failing call)
         try:
-            supabase.table('users').select('*').limit(1).execute()
-            print('Supabase client initialized: using remote DB')
+            remote_client.table('users').select('*').limit(1).execute()
+            log.info('Supabase client initialized: using remote DB')
             USE_FAKE = False
         except Exception as e:
-            print('Warning: Supabase client created but call failed; falling back to local fake DB')
-            print('Error when calling supabase:', e)
-            supabase = FakeSupabase()
+            log.warning('Supabase client created but call failed; falling back to local DB')
+            log.error(f"Error when calling supabase: {e}")
+        if DB_RESILIENT:
+            supabase = ResilientSupabase(
+                remote_client, SQLiteSupabase(LOCAL_DB_PATH), online=not USE_FAKE,
+                probe_interval=SYNC_PROBE_SECONDS, batch_size=SYNC_BATCH_ROWS, concurrency=SYNC_CONCURRENCY
+            )
+            BACKEND = "resilient"
+        elif not USE_FAKE:
+            supabase = remote_client
+            BACKEND = "supabase"
+        else:
+            supabase, BACKEND = _local_backend()
     except Exception as e:
-        print('Error initializing supabase client:', e)
-        supabase = FakeSupabase()
+        log.error(f"Error initializing supabase client: {e}")
+        supabase, BACKEND = _local_backend()
 else:
-    print('SUPABASE_KEY not set; using local FakeSupabase storage')
-    supabase = FakeSupabase()
+    log.info('SUPABASE_KEY not set; using local storage')
+    supabase, BACKEND = _local_backend()
 
 def upsert_user(name: str, phone: str) -> Dict[str, Any]:
     try:
@@ -145,50 +459,180 @@ def upsert_user(name: str, phone: str) -> Dict[str, Any]:
     except Exception as e:
         raise Exception(f"Error upserting user: {str(e)}")
 
+# Length of the message_preview stored with each conversation row
+MESSAGE_PREVIEW_CHARS = 100
+
+# Template bodies by content hash, and the hashes already stored in message_templates
+_template_bodies: Dict[str, str] = {}
+_stored_templates: set = set()
+
+def _store_templates(rows: list, client=None):
+    """Upsert the templates referenced by `rows` before the rows themselves (the FK needs
+    them). Runs in the writer that saves the rows, so /chat never waits on it. Known hashes
+    are skipped, except when writing to an explicit client (outbox replay)."""
+    hashes = {r["template_hash"] for r in rows if r.get("template_hash")}
+    if client is None:
+        hashes -= _stored_templates
+    if not hashes:
+        return
+    (client or supabase).table("message_templates").upsert(
+        [{"hash": h, "body": _template_bodies[h]} for h in sorted(hashes)], on_conflict="hash"
+    ).execute()
+    if client is None:
+        _stored_templates.update(hashes)
+
+def _conversation_payload(user_id: Optional[str], role: str, message: str, meta: dict = None) -> Dict[str, Any]:
+    # Every row carries the same keys, so bulk upserts of user and bot rows stay uniform
+    payload = {"user_id": user_id, "role": role, "message": message, "meta": meta or {},
+               "message_preview": message[:MESSAGE_PREVIEW_CHARS], "template_hash": None, "template_params": None}
+    templated = compact(message) if role == "bot" else None
+    if templated:
+        template_hash, body, params = templated
+        _template_bodies[template_hash] = body
+        payload["message"] = ""
+        payload["message_preview"] = None  # rebuilt from the template like the message
+        payload["template_hash"] = template_hash
+        payload["template_params"] = params or None
+    return payload
+
+def expand_conversations(rows: list) -> list:
+    """Return conversation rows with the text of template-backed rows rebuilt."""
+    missing = {r["template_hash"] for r in rows if r.get("template_hash") and r["template_hash"] not in _template_bodies}
+    for template_hash in missing:
+        try:
+            r = supabase.table("message_templates").select("*").eq("hash", template_hash).limit(1).execute()
+            if r.data:
+                _template_bodies[template_hash] = r.data[0]["body"]
+        except Exception as e:
+            log.warning(f"Failed to load message template {template_hash}: {e}")
+    expanded = []
+    for row in rows:
+        body = _template_bodies.get(row.get("template_hash"))
+        if body is not None:
+            row = {**row, "message": expand_message(body, row.get("template_params"))}
+        expanded.append(row)
+    return expanded
+
+def _is_conversation_fk_error(e: Exception) -> bool:
+    # Postgres foreign key error code 23503 may be surfaced inside the exception message
+    err_str = str(e)
+    return "23503" in err_str or "conversations_user_id_fkey" in err_str or "Key (user_id)" in err_str
+
+def _ensure_placeholder_user(user_id: str, client=None):
+    """Create a minimal placeholder user so the conversations FK constraint is satisfied."""
+    client = client or supabase
+    existing = client.table("users").select("*").eq("id", user_id).limit(1).execute()
+    if existing.data:
+        return
+    # Use a generated phone to avoid unique constraint violation
+    unique_phone = f"chat_{user_id[:8]}"
+    placeholder = {"id": user_id, "name": "guest", "phone": unique_phone}
+    try:
+        client.table("users").insert(placeholder).execute()
+        log.info(f"Created placeholder user for id {user_id} to satisfy FK")
+    except Exception as ins_e:
+        # If creation fails, just continue - conversation might still insert
+        log.warning(f"Failed to create placeholder user: {ins_e}")
+
 def save_conversation(user_id: Optional[str], role: str, message: str, meta: dict = None):
-    payload = {"user_id": user_id, "role": role, "message": message, "meta": meta or {}}
+    payload = _conversation_payload(user_id, role, message, meta)
+    if payload.get("template_hash"):
+        try:
+            _store_templates([payload])
+        except Exception as e:
+            # Fall back to storing the full text if the template could not be registered
+            log.warning(f"Failed to register message template: {e}")
+            payload = {"user_id": user_id, "role": role, "message": str(message), "meta": meta or {},
+                       "message_preview": str(message)[:MESSAGE_PREVIEW_CHARS]}
     try:
         r = supabase.table("conversations").insert(payload).execute()
-        print(f"✅ Conversation saved: {user_id} - {role} - {r.data}")
+        log.debug("Conversation saved: %s - %s - %s", user_id, role, r.data)
         return r
     except Exception as e:
         # Handle foreign-key constraint failures: ensure the referenced user exists, then retry once
-        err_str = str(e)
-        fk_issue = False
-        try:
-            # Postgres foreign key error code 23503 may be surfaced inside the exception message
-            if "23503" in err_str or "conversations_user_id_fkey" in err_str or "Key (user_id)" in err_str:
-                fk_issue = True
-        except Exception:
-            fk_issue = False
-
-        if fk_issue and user_id:
+        if _is_conversation_fk_error(e) and user_id:
             try:
-                # Check if user exists by id
-                existing = supabase.table("users").select("*").eq("id", user_id).limit(1).execute()
-                if not existing.data:
-                    # Create a minimal placeholder user so FK constraint is satisfied
-                    # Use a generated phone to avoid unique constraint violation
-                    unique_phone = f"chat_{user_id[:8]}"
-                    placeholder = {"id": user_id, "name": "guest", "phone": unique_phone}
-                    try:
-                        supabase.table("users").insert(placeholder).execute()
-                        print(f"ℹ️  Created placeholder user for id {user_id} to satisfy FK")
-                    except Exception as ins_e:
-                        print(f"⚠️  Failed to create placeholder user: {ins_e}")
-                        # If creation fails, just continue - conversation might still insert
+                _ensure_placeholder_user(user_id)
                 # Retry inserting the conversation once
                 r2 = supabase.table("conversations").insert(payload).execute()
-                print(f"✅ Conversation saved after creating user: {user_id} - {role} - {r2.data}")
+                log.debug("Conversation saved after creating user: %s - %s - %s", user_id, role, r2.data)
                 return r2
             except Exception as retry_e:
-                print(f"❌ Error saving conversation after retry: {retry_e}")
+                log.error(f"Error saving conversation after retry: {retry_e}")
                 raise
 
         # Not a FK issue or no user_id provided - re-raise
-        print(f"❌ Error saving conversation: {e}")
+        log.error(f"Error saving conversation: {e}")
         raise
 
+def save_conversations_bulk(rows: list, client=None):
+    """Upsert many conversation rows in one round trip (idempotent: rows carry their own ids)."""
+    _store_templates(rows, client)
+    client = client or supabase
+    try:
+        r = client.table("conversations").upsert(rows).execute()
+    except Exception as e:
+        if not _is_conversation_fk_error(e):
+            raise
+        for user_id in {row["user_id"] for row in rows if row.get("user_id")}:
+            _ensure_placeholder_user(user_id, client)
+        r = client.table("conversations").upsert(rows).execute()
+    log.debug("Conversations saved: %d rows", len(rows))
+    return r
+
+if isinstance(supabase, ResilientSupabase):
+    # Replayed conversations may reference chat-only users that need placeholders remotely
+    supabase.replay_writers["conversations"] = save_conversations_bulk
+
+# Write-behind queue for chat turns: /chat only pays for a local journal append
+CONVERSATION_FLUSH_MS = int(os.getenv("CONVERSATION_FLUSH_MS", "200"))
+CONVERSATION_BATCH_ROWS = int(os.getenv("CONVERSATION_BATCH_ROWS", "100"))
+CONVERSATION_MAX_PENDING = int(os.getenv("CONVERSATION_MAX_PENDING", "10000"))
+CONVERSATION_SPILL_PATH = os.getenv("CONVERSATION_SPILL_PATH", "conversations.spill.ndjson")
+
+conversation_writer = WriteBehindQueue(
+    save_conversations_bulk,
+    name="conversation-writer",
+    max_batch=CONVERSATION_BATCH_ROWS,
+    flush_interval_ms=CONVERSATION_FLUSH_MS,
+    max_pending=CONVERSATION_MAX_PENDING,
+    spill_path=CONVERSATION_SPILL_PATH or None,
+)
+_conversation_writer_lock = threading.Lock()
+
+def new_conversation_row(user_id: Optional[str], role: str, message: str, meta: dict = None) -> Dict[str, Any]:
+    """A conversation row ready to store, with its own id and timestamp."""
+    payload = _conversation_payload(user_id, role, message, meta)
+    payload["id"] = str(uuid4())
+    payload["created_at"] = datetime.now(timezone.utc).isoformat()
+    return payload
+
+def _start_conversation_writer():
+    if conversation_writer._thread is None:
+        with _conversation_writer_lock:
+            conversation_writer.start()
+
+def enqueue_conversation(user_id: Optional[str], role: str, message: str, meta: dict = None) -> Dict[str, Any]:
+    """Queue a conversation row for batched persistence and return the row that will be stored."""
+    payload = new_conversation_row(user_id, role, message, meta)
+    _start_conversation_writer()
+    conversation_writer.submit(payload)
+    return payload
+
+def save_conversation_rows(rows: List[Dict[str, Any]]):
+    """Store rows from new_conversation_row in one bulk upsert; if that fails they go to the
+    write-behind queue (journaled, retried) instead of being lost."""
+    try:
+        save_conversations_bulk(rows)
+    except Exception as e:
+        log.warning(f"Bulk conversation insert failed, queueing {len(rows)} row(s): {e}")
+        _start_conversation_writer()
+        conversation_writer.submit_many(rows)
+
+def close_conversation_writer(timeout: float = 5.0):
+    """Flush queued conversation rows; call on shutdown."""
+    conversation_writer.close(timeout)
+
 def create_booking(user_id: Optional[str], hotel_id: str, hotel_name: str, checkin_date: str, nights: int, total_price: float, visitors: int = 1):
     payload = {
         "user_id": user_id,
@@ -206,56 +650,418 @@ def create_booking(user_id: Optional[str], hotel_id: str, hotel_name: str, check
         if not r.data:
             raise Exception("Failed to insert booking")
         booking = r.data[0]
-        print(f"✅ Booking created: {booking['id']} for user {user_id}")
+        log.info(f"Booking created: {booking['id']} for user {user_id}")
+        stats.record_booking(booking)
         return booking
     except Exception as e:
-        print(f"❌ Error creating booking: {e}")
+        log.error(f"Error creating booking: {e}")
+        raise Exception(f"Booking creation failed: {str(e)}")
+
+def book_hotel(name: str, phone: str, hotel_id: str, hotel_name: str, checkin_date: str, nights: int,
+               total_price: float, visitors: int = 1, audit_details: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Upsert the user by phone, create the booking and its BOOKING_CREATED audit log atomically.
+
+    One round trip: the `book_hotel` Postgres function on Supabase, one transaction locally.
+    Returns {"booking": {...}, "user": {...}, "audit_log": {...}}.
+    """
+    params = {
+        "p_name": name,
+        "p_phone": phone,
+        "p_hotel_id": hotel_id,
+        "p_hotel_name": hotel_name,
+        "p_checkin_date": checkin_date,
+        "p_nights": nights,
+        "p_visitors": visitors,
+        "p_total_price": total_price,
+        "p_audit_details": audit_details or {},
+    }
+    try:
+        if not hotel_id or not hotel_name or not checkin_date or nights < 1:
+            raise ValueError("Invalid booking parameters")
+        r = supabase.rpc("book_hotel", params).execute()
+        if not r.data or not r.data.get("booking"):
+            raise Exception("Failed to insert booking")
+        log.info(f"Booking created: {r.data['booking']['id']} for user {r.data['user']['id']}")
+        stats.record_booking(r.data["booking"])
+        return r.data
+    except Exception as e:
+        log.error(f"Error creating booking: {e}")
         raise Exception(f"Booking creation failed: {str(e)}")
 
+# Rows per .in_() lookup when resolving users for a bulk booking (keeps URLs short on PostgREST)
+BULK_LOOKUP_CHUNK = 200
+
+def bulk_book(entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Create many bookings with one bulk write per table.
+
+    Each entry has name, phone, hotel_id, hotel_name, checkin_date, nights, visitors,
+    total_price and optional audit_details. Users are deduplicated by phone: existing users
+    are looked up with .in_(), the missing ones upserted in one call. Bookings are then
+    inserted in bulk and their BOOKING_CREATED entries appended to the audit log (shipped in
+    the background). Returns the booking rows, in order.
+    """
+    try:
+        users_by_phone = {}
+        phones = list(dict.fromkeys(e["phone"] for e in entries))
+        for i in range(0, len(phones), BULK_LOOKUP_CHUNK):
+            chunk = phones[i:i + BULK_LOOKUP_CHUNK]
+            for user in supabase.table("users").select("*").in_("phone", chunk).execute().data:
+                users_by_phone[user["phone"]] = user
+        new_users = {}
+        for e in entries:
+            if e["phone"] not in users_by_phone and e["phone"] not in new_users:
+                new_users[e["phone"]] = {"name": e["name"], "phone": e["phone"]}
+        if new_users:
+            # upsert: a user created concurrently with the same phone is reused, not a conflict
+            created = supabase.table("users").upsert(list(new_users.values()), on_conflict="phone").execute().data
+            users_by_phone.update((u["phone"], u) for u in created)
+
+        bookings = [{
+            "id": str(uuid4()),
+            "user_id": users_by_phone[e["phone"]]["id"],
+            "hotel_id": e["hotel_id"],
+            "hotel_name": e["hotel_name"],
+            "checkin_date": e["checkin_date"],
+            "nights": e["nights"],
+            "visitors": e.get("visitors", 1),
+            "total_price": e["total_price"],
+        } for e in entries]
+        r = supabase.table("bookings").insert(bookings).execute()
+        if len(r.data) != len(bookings):
+            raise Exception(f"Inserted {len(r.data)} of {len(bookings)} bookings")
+        try:
+            # Through the local audit log: once the bookings are saved nothing may fail the call
+            create_audit_logs([{
+                "action": "BOOKING_CREATED",
+                "user_id": b["user_id"],
+                "resource_type": "booking",
+                "resource_id": b["id"],
+                "details": e.get("audit_details") or {},
+            } for b, e in zip(bookings, entries)])
+        except Exception as e:
+            log.error(f"Failed to append audit logs for {len(bookings)} bulk bookings: {e}")
+        log.info(f"Bulk booking: {len(bookings)} bookings for {len(phones)} users")
+        for b in bookings:
+            stats.record_booking(b)
+        stored = {b["id"]: b for b in r.data}
+        return [stored.get(b["id"], b) for b in bookings]
+    except Exception as e:
+        log.error(f"Error creating bulk bookings: {e}")
+        raise Exception(f"Bulk booking failed: {str(e)}")
+
+def get_booking(booking_id: str) -> Optional[Dict[str, Any]]:
+    r = supabase.table("bookings").select("*").eq("id", booking_id).limit(1).execute()
+    return r.data[0] if r.data else None
+
+def get_bookings_by_ids(booking_ids: List[str]) -> List[Dict[str, Any]]:
+    bookings = []
+    for i in range(0, len(booking_ids), BULK_LOOKUP_CHUNK):
+        chunk = booking_ids[i:i + BULK_LOOKUP_CHUNK]
+        bookings.extend(supabase.table("bookings").select("*").in_("id", chunk).execute().data)
+    return bookings
+
+def get_users_by_ids(user_ids: List[str]) -> List[Dict[str, Any]]:
+    users = []
+    for i in range(0, len(user_ids), BULK_LOOKUP_CHUNK):
+        chunk = user_ids[i:i + BULK_LOOKUP_CHUNK]
+        users.extend(supabase.table("users").select("*").in_("id", chunk).execute().data)
+    return users
+
+def get_bookings_page(checkin_from: str, checkin_to: str, after_id: Optional[str] = None,
+                      limit: int = 1000, columns: str = "*") -> List[Dict[str, Any]]:
+    """Bookings with checkin_from <= checkin_date < checkin_to, one keyset page ordered by id.
+    Pass the last id of a page as `after_id` to get the next one."""
+    q = supabase.table("bookings").select(columns).gte("checkin_date", checkin_from).lt("checkin_date", checkin_to)
+    if after_id:
+        q = q.gt("id", after_id)
+    return q.order("id").limit(limit).execute().data
+
+# List views read the stored preview instead of the full message
+CONVERSATION_PREVIEW_COLUMNS = "id, user_id, role, message_preview, template_hash, template_params, created_at"
+
+def get_conversations_page(limit: int, cursor: Optional[tuple] = None, user_id: Optional[str] = None,
+                           created_from: Optional[str] = None, created_to: Optional[str] = None,
+                           columns: str = "*") -> List[Dict[str, Any]]:
+    """Newest-first conversations, one keyset page on (created_at, id).
+
+    `cursor` is the (created_at, id) of the last row of the previous page. The page is read
+    with two index range scans instead of an OR: the rest of the cursor's timestamp (id below
+    the cursor's), then strictly older rows."""
+    def query():
+        q = supabase.table("conversations").select(columns)
+        if user_id:
+            q = q.eq("user_id", user_id)
+        if created_from:
+            q = q.gte("created_at", created_from)
+        if created_to:
+            q = q.lt("created_at", created_to)
+        return q
+
+    rows = []
+    q = query()
+    if cursor:
+        created_at, last_id = cursor
+        rows = query().eq("created_at", created_at).lt("id", last_id).order("id", desc=True).limit(limit).execute().data
+        if len(rows) >= limit:
+            return rows
+        q = q.lt("created_at", created_at)
+    return rows + q.order("created_at", desc=True).order("id", desc=True).limit(limit - len(rows)).execute().data
+
+def conversation_previews(rows: list) -> list:
+    """Give rows read with CONVERSATION_PREVIEW_COLUMNS their message_preview: rebuilt from
+    the template for templated rows, and from the full message, loaded for just those rows,
+    for rows stored before message_preview existed."""
+    rows = expand_conversations(rows)
+    legacy = [r["id"] for r in rows if r.get("message_preview") is None and "message" not in r]
+    messages = {}
+    for i in range(0, len(legacy), BULK_LOOKUP_CHUNK):
+        chunk = legacy[i:i + BULK_LOOKUP_CHUNK]
+        for r in supabase.table("conversations").select("id, message").in_("id", chunk).execute().data:
+            messages[r["id"]] = r["message"]
+    previews = []
+    for row in rows:
+        text = row["message"] if "message" in row else row.get("message_preview")
+        if text is None:
+            text = messages.get(row["id"])
+        previews.append({**row, "message_preview": (text or "")[:MESSAGE_PREVIEW_CHARS]})
+    return previews
+
+def search_conversations(query: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+    """Ranked full-text search over conversations (see text_search.py); rows carry a "rank"."""
+    r = supabase.rpc("search_conversations", {"p_query": query, "p_limit": limit, "p_offset": offset}).execute()
+    return r.data or []
+
+def get_oldest_created_at(table: str) -> Optional[str]:
+    r = supabase.table(table).select("created_at").order("created_at").limit(1).execute()
+    return str(r.data[0]["created_at"]) if r.data and r.data[0].get("created_at") else None
+
+def get_rows_page(table: str, created_from: Optional[str], created_to: Optional[str], after_id: Optional[str] = None,
+                  limit: int = 1000, columns: str = "*") -> List[Dict[str, Any]]:
+    """Rows with created_from <= created_at < created_to (either bound optional), one keyset
+    page ordered by id."""
+    q = supabase.table(table).select(columns)
+    if created_from:
+        q = q.gte("created_at", created_from)
+    if created_to:
+        q = q.lt("created_at", created_to)
+    if after_id:
+        q = q.gt("id", after_id)
+    return q.order("id").limit(limit).execute().data
+
+def delete_rows(table: str, ids: List[str]) -> int:
+    deleted = 0
+    for i in range(0, len(ids), BULK_LOOKUP_CHUNK):
+        chunk = ids[i:i + BULK_LOOKUP_CHUNK]
+        deleted += len(supabase.table(table).delete().in_("id", chunk).execute().data)
+    return deleted
+
+def get_invoice(booking_id: str) -> Optional[Dict[str, Any]]:
+    r = supabase.table("invoices").select("*").eq("booking_id", booking_id).limit(1).execute()
+    return r.data[0] if r.data else None
+
+def get_invoices_for_bookings(booking_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    invoices = {}
+    for i in range(0, len(booking_ids), BULK_LOOKUP_CHUNK):
+        chunk = booking_ids[i:i + BULK_LOOKUP_CHUNK]
+        for inv in supabase.table("invoices").select("*").in_("booking_id", chunk).execute().data:
+            invoices[str(inv["booking_id"])] = inv
+    return invoices
+
+def save_invoices(invoices: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Persist invoices that are not stored yet and return those inserted. Ids are derived from
+    booking ids, so an invoice issued concurrently for the same booking is kept (first one wins)."""
+    if not invoices:
+        return []
+    inserted = supabase.table("invoices").upsert(invoices, on_conflict="id", ignore_duplicates=True).execute().data
+    log.info(f"Saved {len(inserted)} of {len(invoices)} invoice(s)")
+    return inserted
+
+def create_payment_intent(intent: Dict[str, Any]) -> Dict[str, Any]:
+    r = supabase.table("payment_intents").insert(intent).execute()
+    log.debug("Payment intent stored: %s", intent["id"])
+    return r.data[0] if r.data else intent
+
+def get_payment_intent(payment_id: str) -> Optional[Dict[str, Any]]:
+    r = supabase.table("payment_intents").select("*").eq("id", payment_id).limit(1).execute()
+    return r.data[0] if r.data else None
+
+def get_payment_intents(payment_ids: List[str]) -> List[Dict[str, Any]]:
+    intents = []
+    for i in range(0, len(payment_ids), BULK_LOOKUP_CHUNK):
+        chunk = payment_ids[i:i + BULK_LOOKUP_CHUNK]
+        intents.extend(supabase.table("payment_intents").select("*").in_("id", chunk).execute().data)
+    return intents
+
+def update_payment_intents(payment_ids: List[str], changes: Dict[str, Any]) -> int:
+    """Apply the same changes to many intents (one UPDATE per chunk). Returns rows updated."""
+    updated = 0
+    for i in range(0, len(payment_ids), BULK_LOOKUP_CHUNK):
+        chunk = payment_ids[i:i + BULK_LOOKUP_CHUNK]
+        updated += len(supabase.table("payment_intents").update(changes).in_("id", chunk).execute().data)
+    return updated
+
+def mark_bookings_paid(booking_ids: List[str], paid_at: str) -> int:
+    updated = 0
+    for i in range(0, len(booking_ids), BULK_LOOKUP_CHUNK):
+        chunk = booking_ids[i:i + BULK_LOOKUP_CHUNK]
+        r = supabase.table("bookings").update({"payment_status": "paid", "paid_at": paid_at}).in_("id", chunk).execute()
+        updated += len(r.data)
+    if updated:
+        log.info(f"Marked {updated} booking(s) paid")
+    return updated
+
 def get_user_bookings(user_id: str) -> Dict[str, Any]:
     try:
         r = supabase.table("bookings").select("*").eq("user_id", user_id).execute()
-        print(f"✅ Retrieved {len(r.data)} bookings for user {user_id}")
+        log.debug("Retrieved %d bookings for user %s", len(r.data), user_id)
         return r.data
     except Exception as e:
-        print(f"❌ Error retrieving bookings: {e}")
+        log.error(f"Error retrieving bookings: {e}")
         return []
 
 def get_user_conversations(user_id: str) -> Dict[str, Any]:
     try:
         r = supabase.table("conversations").select("*").eq("user_id", user_id).order("created_at", desc=False).execute()
-        print(f"✅ Retrieved {len(r.data)} conversations for user {user_id}")
-        return r.data
+        log.debug("Retrieved %d conversations for user %s", len(r.data), user_id)
+        return expand_conversations(r.data)
     except Exception as e:
-        print(f"❌ Error retrieving conversations: {e}")
+        log.error(f"Error retrieving conversations: {e}")
         return []
 
 
+# Audit events: appended to a local segment log (fsync'd in groups) and shipped in bulk
+AUDIT_LOG_DIR = os.getenv("AUDIT_LOG_DIR", "audit_log")
+AUDIT_SEGMENT_BYTES = int(os.getenv("AUDIT_SEGMENT_BYTES", str(8 * 1024 * 1024)))
+AUDIT_FSYNC_MS = int(os.getenv("AUDIT_FSYNC_MS", "50"))
+AUDIT_SHIP_BATCH = int(os.getenv("AUDIT_SHIP_BATCH", "500"))
+AUDIT_SHIP_MS = int(os.getenv("AUDIT_SHIP_MS", "500"))
+
+def _upsert_audit_rows(rows: List[Dict[str, Any]]):
+    supabase.table("audit_logs").upsert(rows, on_conflict="id").execute()
+
+def ship_audit_logs(rows: List[Dict[str, Any]]):
+    """Upload audit rows; ids are assigned on append, so re-shipping after a crash is idempotent."""
+    try:
+        _upsert_audit_rows(rows)
+    except Exception as e:
+        if len(rows) == 1 or is_outage_error(e):
+            raise
+        # One bad row (e.g. a user that no longer exists) must not hold back the whole batch
+        for row in rows:
+            try:
+                _upsert_audit_rows([row])
+            except Exception as row_e:
+                if is_outage_error(row_e):
+                    raise
+                log.warning(f"Audit row {row['id']} rejected ({row_e}); storing it without user_id")
+                _upsert_audit_rows([{**row, "user_id": None, "details": {**row["details"], "user_id": row["user_id"]}}])
+
+audit_log = SegmentLog(
+    AUDIT_LOG_DIR,
+    ship_audit_logs,
+    name="audit-shipper",
+    segment_bytes=AUDIT_SEGMENT_BYTES,
+    fsync_ms=AUDIT_FSYNC_MS,
+    max_batch=AUDIT_SHIP_BATCH,
+    ship_interval_ms=AUDIT_SHIP_MS,
+)
+_audit_log_lock = threading.Lock()
+
+def _audit_row(action: str, user_id: Optional[str], resource_type: Optional[str], resource_id: Optional[str],
+               details: Optional[Dict[str, Any]], timestamp: str) -> Dict[str, Any]:
+    details = details or {}
+    if user_id is not None:
+        try:
+            UUID(str(user_id))
+        except ValueError:
+            # audit_logs.user_id references users; other actors (e.g. admin usernames) go in details
+            details = {**details, "actor": user_id}
+            user_id = None
+    return {
+        "id": str(uuid4()),
+        "timestamp": timestamp,
+        "action": action,
+        "user_id": user_id,
+        "resource_type": resource_type,
+        "resource_id": resource_id,
+        "details": details,
+    }
+
+def _append_audit_rows(rows: List[Dict[str, Any]]):
+    if audit_log._file is None:
+        with _audit_log_lock:
+            audit_log.start()
+    audit_log.append_many(rows)
+
 def create_audit_log(action: str, user_id: Optional[str], resource_type: str, resource_id: str, details: Optional[Dict[str, Any]] = None):
-    """Create an audit log entry for tracking all significant actions."""
+    """Create an audit log entry for tracking all significant actions.
+
+    The entry is appended to the local audit log and uploaded by the shipper; this returns
+    without waiting on the database."""
     try:
-        from datetime import datetime
-        audit_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "action": action,
-            "user_id": user_id,
-            "resource_type": resource_type,
-            "resource_id": resource_id,
-            "details": details or {},
-            "id": str(uuid4())
-        }
-        r = supabase.table("audit_logs").insert(audit_entry).execute()
-        print(f"✅ Audit log created: {action} on {resource_type} {resource_id}")
-        return r.data[0] if r.data else None
+        audit_entry = _audit_row(action, user_id, resource_type, resource_id, details, datetime.now(timezone.utc).isoformat())
+        _append_audit_rows([audit_entry])
+        return audit_entry
     except Exception as e:
-        print(f"⚠️  Warning: Failed to create audit log: {e}")
+        log.error(f"Failed to append audit log {action} on {resource_type} {resource_id}: {e}")
         return None
 
+def create_audit_logs(entries: List[Dict[str, Any]]):
+    """Record many audit entries (action, user_id, resource_type, resource_id, details) at once."""
+    if not entries:
+        return
+    now = datetime.now(timezone.utc).isoformat()
+    _append_audit_rows([_audit_row(e["action"], e.get("user_id"), e.get("resource_type"), e.get("resource_id"),
+                                   e.get("details"), now) for e in entries])
+
+def close_audit_log(timeout: float = 5.0):
+    """Ship what is left of the audit log (best effort); call on shutdown."""
+    audit_log.close(timeout)
+
+# Analytics counters (see analytics.py): increments are buffered in process and flushed in bulk
+def increment_daily_stats(rows: List[Dict[str, Any]]):
+    """Atomically add each row's value to its daily_stats counter."""
+    # Increments are not idempotent, so they go to Supabase directly: during an outage they
+    # stay pending in memory and are retried, instead of landing in the local outbox
+    client = supabase.remote if BACKEND == "resilient" else supabase
+    client.rpc("increment_daily_stats", {"p_rows": rows}).execute()
+
+def get_daily_stats(since_day: str) -> List[Dict[str, Any]]:
+    rows, after_id = [], None
+    while True:
+        q = supabase.table("daily_stats").select("id, day, metric, dimension, value").gte("day", since_day)
+        if after_id:
+            q = q.gt("id", after_id)
+        page = q.order("id").limit(1000).execute().data
+        rows.extend(page)
+        if len(page) < 1000:
+            return rows
+        after_id = page[-1]["id"]
+
+def replace_daily_stats(since_by_metric: Dict[str, str], rows: List[Dict[str, Any]]):
+    """Replace each metric's counters from its since day on with `rows`, in one transaction
+    (used by the rebuild command)."""
+    client = supabase.remote if BACKEND == "resilient" else supabase
+    ranges = [{"metric": metric, "since": since} for metric, since in since_by_metric.items()]
+    client.rpc("replace_daily_stats", {"p_ranges": ranges, "p_rows": rows}).execute()
+
+stats = StatsCounters(increment_daily_stats, get_daily_stats)
+
+def close_stats(timeout: float = 5.0):
+    """Flush pending analytics increments (best effort); call on shutdown."""
+    stats.close(timeout)
+
+def is_offline() -> bool:
+    """True while Supabase is unreachable and reads are served from the local fallback."""
+    return isinstance(supabase, ResilientSupabase) and not supabase.online
+
 def test_supabase_connection() -> Dict[str, Any]:
     """Return connection info and whether a real supabase DB is used.
     This can be used by external code or an admin script to auto-validate connection.
     """
-    info = {"using_fake": USE_FAKE, "supabase_url": SUPABASE_URL}
+    info = {"using_fake": USE_FAKE, "backend": BACKEND, "supabase_url": SUPABASE_URL}
+    if isinstance(supabase, ResilientSupabase):
+        info["sync"] = supabase.sync_status()
     if not USE_FAKE:
         try:
             r = supabase.table('users').select('*').limit(1).execute()
@@ -0,0 +1,148 @@
+"""
+event_bus.py
+In-process publish/subscribe for live admin feeds.
+
+`publish()` never blocks and never waits on a subscriber: each subscriber has its own
+bounded buffer, and when a slow subscriber's buffer is full the oldest event is dropped (and
+counted) to make room. Publishing is safe from any thread; subscribers are consumed from
+the event loop (`await subscription.get()`).
+
+A subscription can follow several topics (`follow()` adds one), e.g. a chat connection
+follows its user's topic and the topics of that user's bookings.
+
+Admin feed subscriptions are capped at EVENT_BUS_MAX_SUBSCRIBERS per process. Chat
+connections following their own user and booking topics subscribe with `limited=False`: they
+are bounded by the connections the server accepts, and must not crowd out the admin feed.
+
+The bus is per process: with several API workers, a subscriber only sees events published
+by the worker it is connected to.
+"""
+import asyncio
+import itertools
+import os
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+EVENT_BUS_BUFFER = int(os.getenv("EVENT_BUS_BUFFER", "256"))
+EVENT_BUS_MAX_SUBSCRIBERS = int(os.getenv("EVENT_BUS_MAX_SUBSCRIBERS", "50"))
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+def user_topic(user_id: str) -> str:
+    return f"user:{user_id}"
+
+
+def booking_topic(booking_id: str) -> str:
+    return f"booking:{booking_id}"
+
+
+class Subscription:
+    def __init__(self, bus: "EventBus", topics: List[str], maxlen: int, loop: asyncio.AbstractEventLoop,
+                 limited: bool = True):
+        self._bus = bus
+        self.topics = set(topics)
+        self.limited = limited
+        self._buffer: deque = deque(maxlen=maxlen)
+        self._loop = loop
+        self._ready = asyncio.Event()
+        self.dropped = 0
+        self.closed = False
+
+    def _push(self, event: Dict[str, Any]):
+        # Called with the bus lock held
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append(event)
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            # Event loop closed; the subscription is dead
+            pass
+
+    async def get(self, timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Everything buffered, waiting up to `timeout` seconds for at least one event
+        (an empty list on timeout)."""
+        while True:
+            with self._bus._lock:
+                if self._buffer:
+                    events = list(self._buffer)
+                    self._buffer.clear()
+                    return events
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+            self._ready.clear()
+
+    def follow(self, topic: str):
+        """Also receive events published to `topic`."""
+        self._bus._follow(self, topic)
+
+    def close(self):
+        self._bus._unsubscribe(self)
+
+
+class EventBus:
+    def __init__(self, buffer_size: int = EVENT_BUS_BUFFER, max_subscribers: int = EVENT_BUS_MAX_SUBSCRIBERS):
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self._subscribers: Dict[str, List[Subscription]] = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.stats = {"published": 0, "dropped": 0}
+
+    def subscribe(self, *topics: str, limited: bool = True) -> Subscription:
+        """Subscribe from a coroutine (the buffer wakes this event loop). Limited subscriptions
+        count against max_subscribers."""
+        sub = Subscription(self, list(topics), self.buffer_size, asyncio.get_running_loop(), limited)
+        with self._lock:
+            if limited:
+                if self._count >= self.max_subscribers:
+                    raise TooManySubscribers(", ".join(topics))
+                self._count += 1
+            for topic in sub.topics:
+                self._subscribers.setdefault(topic, []).append(sub)
+        return sub
+
+    def _follow(self, sub: Subscription, topic: str):
+        with self._lock:
+            if sub.closed or topic in sub.topics:
+                return
+            sub.topics.add(topic)
+            self._subscribers.setdefault(topic, []).append(sub)
+
+    def _unsubscribe(self, sub: Subscription):
+        with self._lock:
+            if sub.closed:
+                return
+            sub.closed = True
+            if sub.limited:
+                self._count -= 1
+            for topic in sub.topics:
+                subs = self._subscribers.get(topic, [])
+                if sub in subs:
+                    subs.remove(sub)
+                if not subs:
+                    self._subscribers.pop(topic, None)
+            self.stats["dropped"] += sub.dropped
+
+    def publish(self, topic: str, data: Dict[str, Any]) -> int:
+        """Deliver an event to every current subscriber of `topic`; returns the event id."""
+        with self._lock:
+            event_id = next(self._ids)
+            self.stats["published"] += 1
+            for sub in self._subscribers.get(topic, ()):
+                sub._push({"id": event_id, "topic": topic, "data": data})
+        return event_id
+
+    def subscriber_count(self, topic: str) -> int:
+        with self._lock:
+            return len(self._subscribers.get(topic, ()))
+
+
+bus = EventBus()
@@ -0,0 +1,94 @@
+"""
+exporter.py
+Row encoding for the streaming admin exports (/admin/export/{table}).
+
+Exports page through the table by id (EXPORT_PAGE_ROWS rows per query) and encode each page
+as it arrives, so memory stays constant whatever the size of the export. Every exported row
+goes through `mask_row`: phone and name fields, at the top level and inside the meta /
+details JSON, are masked with validators.mask_pii. Booking rows carry the booking user's
+masked name and phone.
+"""
+import csv
+import io
+import json
+import os
+import zlib
+from typing import Any, AsyncIterator, Dict, List
+
+from validators import mask_pii
+
+EXPORT_PAGE_ROWS = int(os.getenv("EXPORT_PAGE_ROWS", "1000"))
+
+# Exported columns, in CSV order
+EXPORT_COLUMNS = {
+    "conversations": ["id", "user_id", "role", "message", "meta", "created_at"],
+    "bookings": ["id", "user_id", "name", "phone", "hotel_id", "hotel_name", "checkin_date", "nights", "visitors",
+                 "total_price", "payment_status", "paid_at", "created_at"],
+    "audit_logs": ["id", "timestamp", "action", "user_id", "resource_type", "resource_id", "details", "created_at"],
+}
+
+# Columns read from the database (conversations need the template columns to rebuild messages)
+SELECT_COLUMNS = {
+    "conversations": "id, user_id, role, message, template_hash, template_params, meta, created_at",
+    "bookings": "*",
+    "audit_logs": "*",
+}
+
+_PII_FIELDS = ("phone", "name")
+_NESTED_FIELDS = ("meta", "details")
+
+
+def _mask_fields(data: Dict[str, Any]) -> Dict[str, Any]:
+    if not any(f in data for f in _PII_FIELDS):
+        return data
+    masked = mask_pii(data.get("phone") or "", data.get("name"))
+    return {**data, **{f: masked[f] for f in _PII_FIELDS if f in data}}
+
+
+def mask_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    row = _mask_fields(row)
+    for field in _NESTED_FIELDS:
+        if isinstance(row.get(field), dict):
+            row = {**row, field: _mask_fields(row[field])}
+    return row
+
+
+def ndjson_chunk(rows: List[Dict[str, Any]], columns: List[str]) -> str:
+    return "".join(json.dumps({c: row.get(c) for c in columns}, default=str) + "\n" for row in rows)
+
+
+class CsvEncoder:
+    """Encodes pages of rows as CSV text; JSON columns are written as JSON strings."""
+
+    def __init__(self, columns: List[str]):
+        self.columns = columns
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+
+    def _take(self) -> str:
+        text = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return text
+
+    def header(self) -> str:
+        self._writer.writerow(self.columns)
+        return self._take()
+
+    def chunk(self, rows: List[Dict[str, Any]]) -> str:
+        for row in rows:
+            self._writer.writerow([
+                json.dumps(v, default=str) if isinstance(v, (dict, list)) else ("" if v is None else v)
+                for v in (row.get(c) for c in self.columns)
+            ])
+        return self._take()
+
+
+async def gzip_stream(chunks: AsyncIterator[str]) -> AsyncIterator[bytes]:
+    """gzip-compress a stream of text chunks on the fly."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    async for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
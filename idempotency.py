@@ -0,0 +1,111 @@
+"""
+idempotency.py
+Idempotency keys for endpoints that clients retry (chat turns, bookings, payment intents).
+
+The first request with a given key runs the handler; its response is cached for
+`ttl_seconds` and returned as-is for any retry with the same key. A retry that arrives while
+the original is still running waits for it instead of executing the handler a second time.
+If the original fails, the key is released so the next retry runs again. Reusing a key with a
+different request body is rejected.
+
+The store is in-process and bounded (`max_entries` completed responses, oldest evicted first);
+with several API workers, route retries to the same worker or keep TTLs short.
+"""
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyKeyError(ValueError):
+    """The idempotency key is not usable (e.g. too long)."""
+
+
+class IdempotencyKeyConflict(IdempotencyKeyError):
+    """The key was already used for a request with a different body."""
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "future", "expires_at")
+
+    def __init__(self, fingerprint: str, future: asyncio.Future):
+        self.fingerprint = fingerprint
+        self.future = future
+        self.expires_at = None
+
+
+def fingerprint(payload: Any) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, ttl_seconds: float = 86400, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._in_flight: Dict[str, _Entry] = {}
+        self._done: "OrderedDict[str, _Entry]" = OrderedDict()  # ordered by completion time
+        self.stats = {"executed": 0, "replayed": 0, "waited": 0, "conflicts": 0}
+
+    def __len__(self):
+        return len(self._in_flight) + len(self._done)
+
+    def _evict(self, now: float):
+        while self._done:
+            key, entry = next(iter(self._done.items()))
+            if entry.expires_at > now and len(self._done) <= self.max_entries:
+                break
+            del self._done[key]
+
+    async def run(self, scope: str, key: Optional[str], payload: Any,
+                  fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Run `fn` at most once per (scope, key). Returns (result, replayed).
+
+        Without a key the call is not deduplicated.
+        """
+        if not key:
+            return await fn(), False
+        if len(key) > MAX_KEY_LENGTH:
+            raise IdempotencyKeyError(f"Idempotency key must be at most {MAX_KEY_LENGTH} characters")
+        full_key = f"{scope}:{key}"
+        fp = fingerprint(payload)
+
+        while True:
+            self._evict(time.monotonic())
+            entry = self._in_flight.get(full_key) or self._done.get(full_key)
+            if entry is None:
+                break
+            if entry.fingerprint != fp:
+                self.stats["conflicts"] += 1
+                raise IdempotencyKeyConflict("Idempotency key was already used with a different request")
+            if entry.future.done():
+                self.stats["replayed"] += 1
+                return entry.future.result(), True
+            self.stats["waited"] += 1
+            try:
+                # shield: a waiter giving up must not cancel the original request
+                return await asyncio.shield(entry.future), True
+            except Exception:
+                # The original failed and released the key; try to run it ourselves
+                continue
+
+        entry = _Entry(fp, asyncio.get_running_loop().create_future())
+        self._in_flight[full_key] = entry
+        try:
+            result = await fn()
+        except BaseException as e:
+            del self._in_flight[full_key]
+            entry.future.set_exception(e if isinstance(e, Exception) else RuntimeError("request cancelled"))
+            # Mark the exception as retrieved when nobody was waiting on it
+            entry.future.exception()
+            raise
+        del self._in_flight[full_key]
+        entry.future.set_result(result)
+        entry.expires_at = time.monotonic() + self.ttl_seconds
+        self._done[full_key] = entry
+        self.stats["executed"] += 1
+        self._evict(time.monotonic())
+        return result, False
@@ -0,0 +1,172 @@
+"""
+inventory.py
+Room inventory with short-lived holds for the booking confirmation step.
+
+When the booking summary is shown, a hold reserves one room at the hotel for each night of
+the stay. The hold is released when the user declines, committed when the booking is saved,
+and otherwise expires after INVENTORY_HOLD_SECONDS. Expiry runs off a min-heap keyed by
+expiry time, so only holds that are actually due are touched (no periodic full scans).
+Refreshing a hold pushes a new heap entry; stale entries are skipped when popped.
+
+Capacity per hotel and night is `hotel["rooms"]` when set, otherwise INVENTORY_ROOMS_PER_HOTEL.
+Held and booked rooms both count against it. The ledger is per process: committed bookings
+are loaded from the database at startup with `load_bookings`, and nights before today are
+dropped from it on the first sweep of each day.
+"""
+import heapq
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+from uuid import uuid4
+
+from hotels_data import HOTELS
+
+HOLD_SECONDS = float(os.getenv("INVENTORY_HOLD_SECONDS", "600"))
+ROOMS_PER_HOTEL = int(os.getenv("INVENTORY_ROOMS_PER_HOTEL", "10"))
+
+
+def stay_nights(checkin_date: str, nights: int) -> List[str]:
+    """ISO dates of every night of a stay."""
+    start = datetime.strptime(checkin_date, "%Y-%m-%d").date()
+    return [(start + timedelta(days=i)).isoformat() for i in range(nights)]
+
+
+class Hold:
+    __slots__ = ("id", "hotel_id", "checkin_date", "nights", "owner", "dates", "expires_at")
+
+    def __init__(self, hotel_id: str, checkin_date: str, nights: int, owner: Optional[str], expires_at: float):
+        self.id = f"hold_{uuid4().hex[:16]}"
+        self.hotel_id = hotel_id
+        self.checkin_date = checkin_date
+        self.nights = nights
+        self.owner = owner
+        self.dates = stay_nights(checkin_date, nights)
+        self.expires_at = expires_at
+
+    def matches(self, hotel_id: str, checkin_date: str, nights: int) -> bool:
+        return (self.hotel_id, self.checkin_date, self.nights) == (hotel_id, checkin_date, nights)
+
+
+class Inventory:
+    def __init__(self, hold_seconds: float = HOLD_SECONDS, rooms_per_hotel: int = ROOMS_PER_HOTEL,
+                 capacities: Optional[Dict[str, int]] = None, clock=time.monotonic):
+        self.hold_seconds = hold_seconds
+        self.rooms_per_hotel = rooms_per_hotel
+        self.capacities = capacities or {}
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._holds: Dict[str, Hold] = {}
+        self._expiry_heap = []  # (expires_at, hold_id)
+        self._held = defaultdict(int)    # (hotel_id, date) -> rooms on hold
+        self._booked = defaultdict(int)  # (hotel_id, date) -> rooms booked
+        self._pruned_on = None  # day the booked nights were last pruned
+        self.stats = {"holds": 0, "rejected": 0, "expired": 0, "released": 0, "committed": 0}
+
+    def capacity(self, hotel_id: str) -> int:
+        return self.capacities.get(hotel_id, self.rooms_per_hotel)
+
+    def available(self, hotel_id: str, checkin_date: str, nights: int) -> int:
+        with self._lock:
+            self._expire()
+            return self._available(hotel_id, stay_nights(checkin_date, nights))
+
+    def _available(self, hotel_id: str, dates: Iterable[str]) -> int:
+        cap = self.capacity(hotel_id)
+        # .get: a lookup must not add an entry for every night ever queried
+        return min(cap - self._held.get((hotel_id, d), 0) - self._booked.get((hotel_id, d), 0) for d in dates)
+
+    def hold(self, hotel_id: str, checkin_date: str, nights: int, owner: Optional[str] = None) -> Optional[Hold]:
+        """Reserve one room for the stay. Returns None when any night is sold out."""
+        with self._lock:
+            self._expire()
+            hold = Hold(hotel_id, checkin_date, nights, owner, self._clock() + self.hold_seconds)
+            if self._available(hotel_id, hold.dates) <= 0:
+                self.stats["rejected"] += 1
+                return None
+            for d in hold.dates:
+                self._held[(hotel_id, d)] += 1
+            self._holds[hold.id] = hold
+            heapq.heappush(self._expiry_heap, (hold.expires_at, hold.id))
+            self.stats["holds"] += 1
+            return hold
+
+    def get(self, hold_id: Optional[str]) -> Optional[Hold]:
+        """The hold if it is still active."""
+        with self._lock:
+            self._expire()
+            return self._holds.get(hold_id) if hold_id else None
+
+    def refresh(self, hold_id: str) -> Optional[Hold]:
+        """Extend an active hold by another hold period (e.g. while the user pays)."""
+        with self._lock:
+            self._expire()
+            hold = self._holds.get(hold_id)
+            if hold:
+                hold.expires_at = self._clock() + self.hold_seconds
+                heapq.heappush(self._expiry_heap, (hold.expires_at, hold.id))
+            return hold
+
+    def release(self, hold_id: Optional[str]) -> bool:
+        with self._lock:
+            hold = self._holds.pop(hold_id, None) if hold_id else None
+            if not hold:
+                return False
+            self._drop(hold)
+            self.stats["released"] += 1
+            return True
+
+    def commit(self, hold_id: str) -> bool:
+        """Turn an active hold into a booked room. False if it expired or was released."""
+        with self._lock:
+            self._expire()
+            hold = self._holds.pop(hold_id, None)
+            if not hold:
+                return False
+            self._drop(hold)
+            for d in hold.dates:
+                self._booked[(hold.hotel_id, d)] += 1
+            self.stats["committed"] += 1
+            return True
+
+    def load_bookings(self, bookings: Iterable[Dict]):
+        """Count existing bookings (rows with hotel_id, checkin_date, nights) against capacity."""
+        today = date.today().isoformat()
+        with self._lock:
+            for b in bookings:
+                try:
+                    dates = stay_nights(str(b["checkin_date"])[:10], int(b.get("nights") or 1))
+                except (KeyError, TypeError, ValueError):
+                    continue
+                for d in dates:
+                    if d >= today:
+                        self._booked[(b["hotel_id"], d)] += 1
+
+    def _drop(self, hold: Hold):
+        for d in hold.dates:
+            key = (hold.hotel_id, d)
+            self._held[key] -= 1
+            if not self._held[key]:
+                del self._held[key]
+
+    def _expire(self):
+        """Release holds that are due; stale heap entries (refreshed/removed holds) are skipped."""
+        now = self._clock()
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            expires_at, hold_id = heapq.heappop(heap)
+            hold = self._holds.get(hold_id)
+            if hold and hold.expires_at == expires_at:
+                del self._holds[hold_id]
+                self._drop(hold)
+                self.stats["expired"] += 1
+        today = date.today().isoformat()
+        if today != self._pruned_on:
+            self._pruned_on = today
+            for key in [k for k in self._booked if k[1] < today]:
+                del self._booked[key]
+
+
+inventory = Inventory(capacities={h["id"]: h["rooms"] for h in HOTELS if h.get("rooms")})
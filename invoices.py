@@ -0,0 +1,95 @@
+"""
+invoices.py
+Invoice rendering and caching.
+
+An invoice is created once per booking and persisted (invoices table); its id is derived from
+the booking id, so concurrent or repeated requests always produce the same invoice. The HTML
+is rendered from a template compiled once at import, and finished invoices are kept in a
+bounded in-process LRU keyed by booking id. Each invoice carries an ETag (hash of its HTML) so
+clients can revalidate with If-None-Match instead of downloading it again.
+"""
+import hashlib
+import html
+import os
+import threading
+from collections import OrderedDict
+from string import Template
+from typing import Dict, Optional
+
+from pricing import totals, to_paise, rupees, format_inr
+
+INVOICE_CACHE_SIZE = int(os.getenv("INVOICE_CACHE_SIZE", "2048"))
+
+INVOICE_TEMPLATE = Template("""
+        <html>
+        <body>
+        <h1>Invoice</h1>
+        <p>Invoice ID: $invoice_id</p>
+        <p>Booking ID: $booking_id</p>
+        <p>Hotel: $hotel_name</p>
+        <p>Check-in: $checkin_date ($nights nights)</p>
+        <p>Subtotal: ₹$subtotal</p>
+        <p>GST ($gst_percent%): ₹$gst</p>
+        <p><b>Total: ₹$total</b></p>
+        </body>
+        </html>
+        """)
+
+
+def invoice_id_for(booking_id: str) -> str:
+    return "inv_" + hashlib.sha256(str(booking_id).encode("utf-8")).hexdigest()[:10]
+
+
+def build_invoice(booking: Dict, hotel: Dict, gst_percent: float) -> Dict:
+    """Invoice row (ready to persist) for a booking, with rendered HTML and ETag."""
+    invoice_id = invoice_id_for(booking["id"])
+    t = totals(to_paise(booking["total_price"]), gst_percent)
+    body = INVOICE_TEMPLATE.substitute(
+        invoice_id=invoice_id,
+        booking_id=html.escape(str(booking["id"])),
+        hotel_name=html.escape(hotel["name"]),
+        checkin_date=html.escape(str(booking.get("checkin_date", ""))),
+        nights=booking.get("nights", ""),
+        subtotal=format_inr(t["subtotal_paise"]),
+        gst_percent=f"{gst_percent:g}",
+        gst=format_inr(t["gst_paise"]),
+        total=format_inr(t["total_paise"]),
+    )
+    return {
+        "id": invoice_id,
+        "booking_id": booking["id"],
+        "user_id": booking.get("user_id"),
+        "hotel_id": booking["hotel_id"],
+        "subtotal": rupees(t["subtotal_paise"]),
+        "gst_percent": float(gst_percent),
+        "gst": rupees(t["gst_paise"]),
+        "total": rupees(t["total_paise"]),
+        "html": body,
+        "etag": '"' + hashlib.sha256(body.encode("utf-8")).hexdigest()[:32] + '"',
+    }
+
+
+class InvoiceCache:
+    """Bounded LRU of persisted invoices keyed by booking id."""
+
+    def __init__(self, max_entries: int = INVOICE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, booking_id: str) -> Optional[Dict]:
+        with self._lock:
+            invoice = self._entries.get(booking_id)
+            if invoice is not None:
+                self._entries.move_to_end(booking_id)
+            return invoice
+
+    def put(self, invoice: Dict):
+        with self._lock:
+            self._entries[invoice["booking_id"]] = invoice
+            self._entries.move_to_end(invoice["booking_id"])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+invoice_cache = InvoiceCache()
@@ -5,6 +5,8 @@
 
 let adminToken = null;
 let adminChats = {}; // Store chats grouped by user_id
+let adminOpenChatId = null;
+let adminFeed = null; // AbortController of the live chat feed
 
 /**
  * Show admin login modal
@@ -30,8 +32,17 @@ function resetAdminLoginInputs() {
 function closeAdminDashboard() {
     const dashboard = document.getElementById('admin-dashboard');
     dashboard.style.display = 'none';
+    stopAdminFeed();
+    if (adminToken) {
+        // Revoke the token server-side; it would expire on its own anyway
+        fetch(`${BASE}/admin/logout`, {
+            method: 'POST',
+            headers: { 'Authorization': `Bearer ${adminToken}` }
+        }).catch(() => {});
+    }
     adminToken = null;
     adminChats = {};
+    adminOpenChatId = null;
 }
 
 /**
@@ -84,6 +95,7 @@ async function showAdminDashboard() {
     const dashboard = document.getElementById('admin-dashboard');
     dashboard.style.display = 'flex'; // Changed to flex for layout
     await loadAdminData();
+    startAdminFeed();
 }
 
 /**
@@ -91,7 +103,8 @@ async function showAdminDashboard() {
  */
 async function loadAdminData() {
     try {
-        const res = await fetch(`${BASE}/admin/chats?limit=100`, {
+        // List view only needs previews; full messages are loaded when a chat is opened
+        const res = await fetch(`${BASE}/admin/chats?limit=100&fields=preview`, {
             headers: { 'Authorization': `Bearer ${adminToken}` }
         });
         
@@ -108,17 +121,7 @@ async function loadAdminData() {
             // Sort by date ascending first to ensure order
             data.conversations.sort((a, b) => new Date(a.created_at) - new Date(b.created_at));
             
-            data.conversations.forEach(msg => {
-                if (!adminChats[msg.user_id]) {
-                    adminChats[msg.user_id] = {
-                        messages: [],
-                        lastMessage: msg,
-                        userId: msg.user_id
-                    };
-                }
-                adminChats[msg.user_id].messages.push(msg);
-                adminChats[msg.user_id].lastMessage = msg; // Update last message
-            });
+            data.conversations.forEach(addAdminMessage);
         }
         
         renderChatList();
@@ -128,6 +131,91 @@ async function loadAdminData() {
     }
 }
 
+/**
+ * Add a message to its user's chat (ignores messages already shown)
+ */
+function addAdminMessage(msg) {
+    if (!adminChats[msg.user_id]) {
+        adminChats[msg.user_id] = {
+            messages: [],
+            lastMessage: msg,
+            userId: msg.user_id
+        };
+    }
+    const chat = adminChats[msg.user_id];
+    if (chat.messages.some(m => m.id === msg.id)) return;
+    chat.messages.push(msg);
+    chat.lastMessage = msg; // Update last message
+}
+
+/**
+ * Follow /admin/chats/stream (server-sent events) and add new messages as they arrive.
+ * EventSource cannot send the Authorization header, so the stream is read with fetch.
+ */
+async function startAdminFeed() {
+    stopAdminFeed();
+    const controller = new AbortController();
+    adminFeed = controller;
+    try {
+        const res = await fetch(`${BASE}/admin/chats/stream`, {
+            headers: { 'Authorization': `Bearer ${adminToken}` },
+            signal: controller.signal
+        });
+        if (!res.ok) throw new Error(`HTTP ${res.status}`);
+        const reader = res.body.pipeThrough(new TextDecoderStream()).getReader();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += value;
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+            events.forEach(handleAdminFeedEvent);
+        }
+    } catch (err) {
+        if (controller.signal.aborted) return;
+        console.warn('Live chat feed interrupted:', err.message);
+    }
+    // Server closed the stream or the network dropped: reconnect while the dashboard is open
+    if (adminFeed === controller) {
+        setTimeout(() => {
+            if (adminFeed === controller) {
+                loadAdminData().then(startAdminFeed);
+            }
+        }, 3000);
+    }
+}
+
+function stopAdminFeed() {
+    if (adminFeed) {
+        adminFeed.abort();
+        adminFeed = null;
+    }
+}
+
+/**
+ * Handle one server-sent event block ("event: ...\ndata: ...")
+ */
+function handleAdminFeedEvent(block) {
+    let type = 'message';
+    const data = [];
+    block.split('\n').forEach(line => {
+        if (line.startsWith('event:')) type = line.slice(6).trim();
+        else if (line.startsWith('data:')) data.push(line.slice(5).trim());
+    });
+    if (type === 'dropped') {
+        // We fell behind and missed messages; re-sync from the list endpoint
+        loadAdminData();
+        return;
+    }
+    if (type !== 'conversation' || !data.length) return;
+    JSON.parse(data.join('\n')).conversations.forEach(addAdminMessage);
+    renderChatList();
+    if (adminOpenChatId !== null) {
+        openAdminChat(adminOpenChatId);
+    }
+}
+
 /**
  * Render the list of chats in the sidebar
  */
@@ -167,7 +255,7 @@ function renderChatList() {
                 <div class="chat-name">User ${userId.substring(0, 8)}...</div>
                 <div class="chat-preview">
                     ${lastMsg.role === 'assistant' ? '<i class="fas fa-check-double" style="font-size: 0.7rem; color: #53bdeb;"></i> ' : ''}
-                    ${escapeHtml(lastMsg.message)}
+                    ${escapeHtml(lastMsg.message_preview)}
                 </div>
             </div>
             <div class="chat-meta">${time}</div>
@@ -180,9 +268,21 @@ function renderChatList() {
 /**
  * Open a specific chat
  */
-function openAdminChat(userId) {
+async function openAdminChat(userId) {
     const chatData = adminChats[userId];
     if (!chatData) return;
+    adminOpenChatId = userId;
+    
+    // Anonymous messages (no user_id) cannot be filtered server-side; show their previews
+    if (!chatData.loaded && userId !== 'null') {
+        try {
+            chatData.messages = await fetchUserMessages(userId);
+            chatData.loaded = true;
+        } catch (err) {
+            showNotification('Error loading chat: ' + err.message, true);
+            return;
+        }
+    }
     
     // Update active state in sidebar
     document.querySelectorAll('.chat-list-item').forEach(el => el.classList.remove('active'));
@@ -204,7 +304,7 @@ function openAdminChat(userId) {
         const time = new Date(msg.created_at).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
         
         msgDiv.innerHTML = `
-            <div class="message-content">${escapeHtml(msg.message)}</div>
+            <div class="message-content">${escapeHtml(msg.message ?? msg.message_preview)}</div>
             <div class="message-time">${time}</div>
         `;
         
@@ -215,6 +315,27 @@ function openAdminChat(userId) {
     messagesContainer.scrollTop = messagesContainer.scrollHeight;
 }
 
+/**
+ * Fetch a user's full conversation history, following the page cursors
+ */
+async function fetchUserMessages(userId) {
+    const messages = [];
+    let cursor = null;
+    do {
+        let url = `${BASE}/admin/chats?limit=200&user_id=${encodeURIComponent(userId)}`;
+        if (cursor) url += `&cursor=${encodeURIComponent(cursor)}`;
+        const res = await fetch(url, {
+            headers: { 'Authorization': `Bearer ${adminToken}` }
+        });
+        if (!res.ok) throw new Error(`HTTP ${res.status}`);
+        const data = await res.json();
+        messages.push(...data.conversations);
+        cursor = data.next_cursor;
+    } while (cursor);
+    // Pages are newest first; show oldest first
+    return messages.reverse();
+}
+
 /**
  * Helper to escape HTML
  */
@@ -4,6 +4,9 @@
  */
 
 let pendingHotel = null;
+// Idempotency-Key of the booking being made; kept until the server gives a definite answer,
+// so retrying after a timeout or network error cannot create a second booking
+let bookingAttempt = null;
 
 /**
  * Open booking modal for a hotel
@@ -18,6 +21,9 @@ function openBookingModal(hotel) {
     const bVisitors = document.getElementById('b-visitors');
     
     pendingHotel = hotel;
+    if (!bookingAttempt || bookingAttempt.hotelId !== hotel.id) {
+        bookingAttempt = { key: generateUUID(), hotelId: hotel.id, body: null };
+    }
     document.getElementById('book-title').textContent = `Complete Booking: ${hotel.name}`;
     bDate.value = '';
     bName.value = '';
@@ -44,8 +50,9 @@ function closeBookingModal() {
  * @param {string} checkinDate - Check-in date
  * @param {number} nights - Number of nights
  * @param {number} visitors - Number of visitors
+ * @param {string} [holdId] - Inventory hold taken when the booking was confirmed in chat
  */
-async function performBook(name, phone, hotelId, checkinDate, nights, visitors) {
+async function performBook(name, phone, hotelId, checkinDate, nights, visitors, holdId = null) {
     const payload = {
         name,
         phone,
@@ -53,15 +60,27 @@ async function performBook(name, phone, hotelId, checkinDate, nights, visitors)
         checkin_date: checkinDate,
         nights,
         visitors,
-        user_id: getUserId()
+        user_id: getUserId(),
+        hold_id: holdId
     };
+    const body = JSON.stringify(payload);
+    const attempt = bookingAttempt || { key: generateUUID(), hotelId, body: null };
+    if (attempt.body !== null && attempt.body !== body) {
+        // Details were changed after a failed try: that is a different booking
+        attempt.key = generateUUID();
+    }
+    attempt.body = body;
     
     try {
         const res = await fetch(`${BASE}/book`, {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(payload)
+            headers: { 'Content-Type': 'application/json', 'Idempotency-Key': attempt.key },
+            body
         });
+        if (res.status < 500 && bookingAttempt === attempt) {
+            // Booked or rejected: the next booking gets a new key
+            bookingAttempt = null;
+        }
         
         if (!res.ok) {
             const text = await res.text();
@@ -112,8 +131,9 @@ function initBookingListeners() {
         
         userPreferences.nights = nights;
         userPreferences.visitors = visitors;
+        const hotel = pendingHotel;
         closeBookingModal();
-        addMessage(`🔄 Confirming your booking for ${pendingHotel.name}...`, 'bot');
-        performBook(name, phone, pendingHotel.id, date, nights, visitors);
+        addMessage(`🔄 Confirming your booking for ${hotel.name}...`, 'bot');
+        performBook(name, phone, hotel.id, date, nights, visitors);
     };
 }
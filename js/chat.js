@@ -7,6 +7,68 @@ const BASE = 'http://127.0.0.1:8000';
 let userPreferences = { nights: null, budget: null, visitors: null };
 let hotelSuggestions = {};
 
+const WS_BASE = BASE.replace(/^http/, 'ws');
+let chatSocket = null;
+let chatSocketRetry = 1000;
+let queuedChats = []; // sent while the socket was connecting
+
+/**
+ * Open the chat WebSocket (one per page) and reconnect with backoff when it drops.
+ * Replies arrive in order on the socket; the server also pushes booking/payment updates.
+ */
+function connectChatSocket() {
+    if (chatSocket || !window.WebSocket) return;
+    const socket = new WebSocket(`${WS_BASE}/ws/chat?user_id=${encodeURIComponent(getUserId())}`);
+    chatSocket = socket;
+    
+    socket.onopen = () => {
+        chatSocketRetry = 1000;
+        const queued = queuedChats;
+        queuedChats = [];
+        queued.forEach(payload => socket.send(JSON.stringify(payload)));
+    };
+    
+    socket.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        switch (data.type) {
+            case 'ready':
+                // The server issues a new id if ours was rejected
+                if (data.user_id !== getUserId()) localStorage.setItem('ai_user_id', data.user_id);
+                break;
+            case 'ping':
+                socket.send(JSON.stringify({ type: 'pong' }));
+                break;
+            case 'reply':
+                showChatReply(data);
+                break;
+            case 'booking_status':
+                showNotification(`Booking at ${data.hotel_name} created, awaiting payment`);
+                break;
+            case 'payment_status':
+                showNotification(data.status === 'succeeded'
+                    ? '✅ Payment received, your booking is confirmed'
+                    : `Payment ${data.status}`, data.status === 'succeeded' ? 'success' : 'error');
+                break;
+            case 'error':
+                hideTypingIndicator();
+                addMessage(data.code === 'busy'
+                    ? '⚠️ Please wait for my reply before sending more messages.'
+                    : '⚠️ ' + data.detail, 'bot');
+                break;
+        }
+    };
+    
+    socket.onclose = () => {
+        chatSocket = null;
+        // Anything still waiting for the socket goes over plain HTTP instead
+        const queued = queuedChats;
+        queuedChats = [];
+        queued.forEach(postChat);
+        setTimeout(connectChatSocket, chatSocketRetry);
+        chatSocketRetry = Math.min(chatSocketRetry * 2, 30000);
+    };
+}
+
 /**
  * Send a chat message
  * @param {string} message - The message to send
@@ -26,37 +88,28 @@ function sendChat(message) {
     input.value = '';
     
     showTypingIndicator();
-    const payload = { user_id: getUserId(), message };
+    const payload = { user_id: getUserId(), message, client_message_id: generateUUID() };
     
+    if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
+        chatSocket.send(JSON.stringify({ type: 'message', ...payload }));
+    } else if (chatSocket && chatSocket.readyState === WebSocket.CONNECTING) {
+        queuedChats.push({ type: 'message', ...payload });
+    } else {
+        postChat(payload);
+    }
+}
+
+/**
+ * Send a chat message over HTTP (when the WebSocket is unavailable)
+ */
+function postChat(payload) {
     fetch(`${BASE}/chat`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify(payload)
+        body: JSON.stringify({ user_id: payload.user_id, message: payload.message, client_message_id: payload.client_message_id })
     })
         .then(r => r.json())
-        .then(data => {
-            hideTypingIndicator();
-            
-            // Use enhanced message display if available, fallback to regular
-            if (typeof addMessageWithAnimation === 'function') {
-                addMessageWithAnimation(data.reply, 'bot', { suggestions: data.suggestions || [] });
-            } else {
-                addMessage(data.reply, 'bot', { suggestions: data.suggestions || [] });
-            }
-            
-            // Update user preferences
-            if (data.meta) {
-                if (data.meta.nights) userPreferences.nights = data.meta.nights;
-                if (data.meta.visitors) userPreferences.visitors = data.meta.visitors;
-            }
-            
-            // Update budget from suggestions
-            if (data.suggestions && data.suggestions.length > 0) {
-                data.suggestions.forEach(s => {
-                    if (s.price_per_night) userPreferences.budget = s.price_per_night;
-                });
-            }
-        })
+        .then(showChatReply)
         .catch(err => {
             hideTypingIndicator();
             addMessage('⚠️ Error connecting to server: ' + (err.message || err), 'bot');
@@ -64,6 +117,38 @@ function sendChat(message) {
         });
 }
 
+/**
+ * Display a bot reply ({reply, suggestions, meta})
+ */
+function showChatReply(data) {
+    hideTypingIndicator();
+    
+    // Use enhanced message display if available, fallback to regular
+    if (typeof addMessageWithAnimation === 'function') {
+        addMessageWithAnimation(data.reply, 'bot', { suggestions: data.suggestions || [] });
+    } else {
+        addMessage(data.reply, 'bot', { suggestions: data.suggestions || [] });
+    }
+    
+    // Update user preferences
+    if (data.meta) {
+        if (data.meta.nights) userPreferences.nights = data.meta.nights;
+        if (data.meta.visitors) userPreferences.visitors = data.meta.visitors;
+        if (data.meta.action === 'proceed_to_payment' && data.meta.booking) {
+            // Book with the room the chat is already holding
+            const b = data.meta.booking;
+            performBook(b.name, b.phone, b.hotel_id, b.checkin_date, b.nights, b.visitors, data.meta.hold_id);
+        }
+    }
+    
+    // Update budget from suggestions
+    if (data.suggestions && data.suggestions.length > 0) {
+        data.suggestions.forEach(s => {
+            if (s.price_per_night) userPreferences.budget = s.price_per_night;
+        });
+    }
+}
+
 /**
  * Initialize chat event listeners
  */
@@ -126,6 +211,7 @@ function initChatListeners() {
  */
 function initializeChat() {
     initChatListeners();
+    connectChatSocket();
     // Send initial greeting
     sendChat('Hi');
 }
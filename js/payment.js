@@ -44,9 +44,10 @@ async function proceedToPayment(bookingData) {
     try {
         addMessage('💳 Creating payment intent...', 'bot');
         
+        // One payment intent per booking, even if the button is clicked twice
         const paymentRes = await fetch(`${BASE}/internal/payment_intent`, {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: { 'Content-Type': 'application/json', 'Idempotency-Key': `booking-${bookingData.booking_id}` },
             body: JSON.stringify({
                 amount_inr: Math.round(total),
                 currency: 'INR',
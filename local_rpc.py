@@ -0,0 +1,99 @@
+"""
+local_rpc.py
+Local implementations of the Postgres functions in supabase_tables.sql, so the SQLite and
+in-memory backends answer `client.rpc(name, params).execute()` like Supabase does.
+
+Functions that write run inside `backend.transaction()` and use only the table API; search
+uses the backend's own full-text index.
+"""
+from datetime import datetime, timezone
+from typing import Dict, Any, List
+
+
+class RPCResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+def book_hotel(backend, params: Dict[str, Any]) -> Dict[str, Any]:
+    """User upsert by phone + booking insert + audit insert, all or nothing."""
+    with backend.transaction():
+        users = backend.table("users").select("*").eq("phone", params["p_phone"]).limit(1).execute().data
+        if users:
+            user = users[0]
+        else:
+            user = backend.table("users").insert({"name": params["p_name"], "phone": params["p_phone"]}).execute().data[0]
+        booking = backend.table("bookings").insert({
+            "user_id": user["id"],
+            "hotel_id": params["p_hotel_id"],
+            "hotel_name": params["p_hotel_name"],
+            "checkin_date": params["p_checkin_date"],
+            "nights": params["p_nights"],
+            "visitors": params.get("p_visitors", 1),
+            "total_price": params["p_total_price"],
+        }).execute().data[0]
+        audit_log = backend.table("audit_logs").insert({
+            "user_id": user["id"],
+            "action": "BOOKING_CREATED",
+            "resource_type": "booking",
+            "resource_id": booking["id"],
+            "details": params.get("p_audit_details") or {},
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+        }).execute().data[0]
+    return {"booking": booking, "user": user, "audit_log": audit_log}
+
+
+def search_conversations(backend, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Ranked full-text search over conversations; rows carry a "rank"."""
+    return backend.search_conversations(params["p_query"], int(params.get("p_limit", 20)), int(params.get("p_offset", 0)))
+
+
+def increment_daily_stats(backend, params: Dict[str, Any]) -> None:
+    """Add each row's value to its daily_stats counter, creating missing counters."""
+    rows = params["p_rows"]
+    with backend.transaction():
+        existing = {r["id"]: r for r in
+                    backend.table("daily_stats").select("*").in_("id", [r["id"] for r in rows]).execute().data}
+        now = datetime.now(timezone.utc).isoformat()
+        backend.table("daily_stats").upsert([
+            {**r, "value": float(existing[r["id"]]["value"]) + r["value"] if r["id"] in existing else r["value"],
+             "updated_at": now}
+            for r in rows
+        ]).execute()
+    return None
+
+
+def replace_daily_stats(backend, params: Dict[str, Any]) -> None:
+    """Delete each metric's counters from its `since` day on and store the rows instead, in one transaction."""
+    with backend.transaction():
+        for r in params["p_ranges"]:
+            backend.table("daily_stats").delete().eq("metric", r["metric"]).gte("day", r["since"]).execute()
+        if params["p_rows"]:
+            now = datetime.now(timezone.utc).isoformat()
+            backend.table("daily_stats").upsert([{**r, "updated_at": now} for r in params["p_rows"]]).execute()
+    return None
+
+
+LOCAL_RPC_FUNCTIONS = {
+    "book_hotel": book_hotel,
+    "search_conversations": search_conversations,
+    "increment_daily_stats": increment_daily_stats,
+    "replace_daily_stats": replace_daily_stats,
+}
+
+# Which table each key of an RPC result belongs to (used to replay offline RPC writes)
+RPC_RESULT_TABLES = {
+    "book_hotel": {"user": "users", "booking": "bookings", "audit_log": "audit_logs"},
+}
+
+
+class LocalRPC:
+    def __init__(self, backend, fn: str, params: Dict[str, Any]):
+        if fn not in LOCAL_RPC_FUNCTIONS:
+            raise ValueError(f"Function '{fn}' is not available on the local backend")
+        self._backend = backend
+        self._fn = fn
+        self._params = params or {}
+
+    def execute(self):
+        return RPCResponse(LOCAL_RPC_FUNCTIONS[self._fn](self._backend, self._params))
@@ -0,0 +1,178 @@
+"""
+log_pipeline.py
+Non-blocking logging for the API and the data layer.
+
+Every logger hands records to a single QueueHandler on the root logger, so a log call only
+costs an enqueue on the request path. A background writer drains the queue, formats records
+(including JSON serialization of structured events) and writes everything queued so far,
+up to LOG_BATCH_LINES lines, with a single write to stderr or LOG_FILE; under load batches
+grow on their own. Installing the handler replaces any other root handlers, so each line is
+emitted once.
+
+Structured events (`StructuredLogger.log_action` in main.py) are passed as `JsonMessage`,
+which is only serialized in the writer thread, with orjson when it is installed. Successful
+high-volume events can be sampled with LOG_SAMPLE_RATES ("CHAT_MESSAGE=0.1,..."); failures
+and audit-grade actions (admin, booking and payment events) are never sampled.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from typing import Dict, Optional
+
+try:
+    import orjson
+
+    def dumps(obj) -> str:
+        return orjson.dumps(obj, default=str).decode("utf-8")
+except ImportError:
+    def dumps(obj) -> str:
+        return json.dumps(obj, default=str, separators=(",", ":"), ensure_ascii=False)
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Actions whose events are always logged, whatever their sample rate
+NEVER_SAMPLED_PREFIXES = ("ADMIN_", "BOOKING_", "BULK_BOOKING", "PAYMENT_")
+
+
+class JsonMessage:
+    """A structured log payload, serialized only when the record is written."""
+    __slots__ = ("data",)
+
+    def __init__(self, data: Dict):
+        self.data = data
+
+    def __str__(self):
+        return dumps(self.data)
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for item in spec.split(","):
+        if item.strip():
+            action, _, rate = item.partition("=")
+            rates[action.strip()] = float(rate)
+    return rates
+
+
+class Sampler:
+    def __init__(self, rates: Optional[Dict[str, float]] = None):
+        if rates is None:
+            rates = parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", "CHAT_MESSAGE=0.1,HOTEL_SEARCH=0.1"))
+        self.rates = rates
+
+    def rate(self, action: str, status: str) -> float:
+        """Probability of logging this event (1.0 for failures and audit-grade actions)."""
+        if status != "success" or action.startswith(NEVER_SAMPLED_PREFIXES):
+            return 1.0
+        return self.rates.get(action, 1.0)
+
+    def keep(self, rate: float) -> bool:
+        return rate >= 1.0 or random.random() < rate
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue records without formatting them; the writer thread does that."""
+
+    def prepare(self, record):
+        if record.exc_info:
+            # Tracebacks must be rendered now, while the frames are still current
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class BatchWriter:
+    """Background thread that formats queued records and writes them in batches."""
+
+    def __init__(self, q: "queue.SimpleQueue", stream, formatter: logging.Formatter,
+                 batch_lines: int = 200):
+        self._queue = q
+        self._stream = stream
+        self._formatter = formatter
+        self.batch_lines = batch_lines
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self.stats = {"records": 0, "batches": 0, "errors": 0}
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Write everything queued so far and stop."""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _format(self, record) -> str:
+        try:
+            return self._formatter.format(record)
+        except Exception as e:
+            self.stats["errors"] += 1
+            return f"<unformattable log record from {record.name}: {e}>"
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            done = record is None
+            lines = [] if done else [self._format(record)]
+            # Gather whatever else is already queued (up to a batch) into one write
+            while not done and len(lines) < self.batch_lines:
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is None:
+                    done = True
+                    break
+                lines.append(self._format(record))
+            if lines:
+                try:
+                    self._stream.write("\n".join(lines) + "\n")
+                    self._stream.flush()
+                except Exception:
+                    self.stats["errors"] += 1
+                self.stats["records"] += len(lines)
+                self.stats["batches"] += 1
+            if done:
+                return
+
+
+_writer: Optional[BatchWriter] = None
+_configure_lock = threading.Lock()
+
+
+def configure_logging() -> BatchWriter:
+    """Route all logging through the queue and background writer (idempotent).
+
+    Settings are read from the environment on first call: LOG_LEVEL (INFO), LOG_FILE
+    (stderr when unset) and LOG_BATCH_LINES (200)."""
+    global _writer
+    with _configure_lock:
+        if _writer is not None:
+            return _writer
+        log_file = os.getenv("LOG_FILE", "")
+        level = os.getenv("LOG_LEVEL", "INFO").upper()
+        q = queue.SimpleQueue()
+        stream = open(log_file, "a", encoding="utf-8") if log_file else sys.stderr
+        _writer = BatchWriter(q, stream, logging.Formatter(LOG_FORMAT), int(os.getenv("LOG_BATCH_LINES", "200")))
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_DeferredQueueHandler(q))
+        root.setLevel(level)
+        _writer.start()
+        atexit.register(_writer.stop)
+        return _writer
+
+
+def get_logger(name: str) -> logging.Logger:
+    configure_logging()
+    return logging.getLogger(name)
@@ -1,48 +1,61 @@
 import os
-import logging
+import asyncio
+import base64
+import csv
+import io
 import json
-from datetime import datetime, timedelta
-from fastapi import FastAPI, HTTPException, Header, Request
-from fastapi.responses import JSONResponse
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Header, Request, Response, Depends, WebSocket
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse, HTMLResponse
 from models import (
-    ChatRequest, ChatResponse, BookingRequest, User,
+    ChatRequest, ChatBatchRequest, ChatResponse, BookingRequest, User,
     InternalSearchHotelsRequest, InternalBookHotelRequest,
     CreatePaymentIntentRequest, GenerateInvoiceRequest,
-    AdminLoginRequest
+    AdminLoginRequest, InvoiceBatchRequest
 )
-from chatbot import bot_reply, get_hotel_by_id, generate_bill, search_hotels_internal, prepare_booking_confirmation
-from validators import validate_booking_input, mask_pii, validate_phone, validate_date
+from chatbot import bot_reply, get_hotel_by_id, generate_bill, search_hotels_internal, prepare_booking_confirmation, booking_in_progress
+from inventory import inventory
+from pricing import quote, price_calendar, rupees, GST_PERCENT
+from invoices import build_invoice, invoice_cache
+from payments import (new_intent, provider, reconciler, verify, well_formed, SIGNATURE_HEADER, EVENT_STATUS,
+                      PAYMENT_MOCK_ENABLED, PAYMENT_WEBHOOK_SECRET)
+from validators import validate_booking_input, validate_booking_rows, mask_pii, validate_phone, validate_date, MAX_NIGHTS
 import db
-from db import create_audit_log
+import async_db
+import archiver
+import exporter
+from idempotency import IdempotencyStore, IdempotencyKeyError, IdempotencyKeyConflict
+from rate_limit import RateLimitMiddleware, limiter_from_env
+from log_pipeline import get_logger, JsonMessage, Sampler
+from admin_auth import AdminTokens, AdminTokenError
+from text_search import query_tokens
+from event_bus import bus, TooManySubscribers, user_topic, booking_topic
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
+import time
 import uuid
+import weakref
 from collections import defaultdict
-import time
 
 load_dotenv()
 
 app = FastAPI(title="Nagpur Hotel AI Agent")
 
 class StructuredLogger:
-    """Enhanced logging with structured JSON support for audit trails."""
-    def __init__(self, name):
-        self.logger = logging.getLogger(name)
-        self.setup_logging()
-    
-    def setup_logging(self):
-        handler = logging.StreamHandler()
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
-        handler.setFormatter(formatter)
-        self.logger.addHandler(handler)
-        self.logger.setLevel(logging.INFO)
+    """Enhanced logging with structured JSON support for audit trails.
+
+    Records go through the queued writer in log_pipeline; JSON is serialized there, off the
+    request path."""
+    def __init__(self, name, sampler=None):
+        self.logger = get_logger(name)
+        self.sampler = sampler or Sampler()
     
     def log_action(self, action, user_id, resource_type, resource_id, status, details=None):
         """Log structured action for audit trail."""
         log_entry = {
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
             "action": action,
             "user_id": user_id,
             "resource_type": resource_type,
@@ -50,7 +63,11 @@ class StructuredLogger:
             "status": status,
             "details": details or {}
         }
-        self.logger.info(json.dumps(log_entry))
+        rate = self.sampler.rate(action, status)
+        if self.sampler.keep(rate):
+            if rate < 1.0:
+                log_entry["sample_rate"] = rate
+            self.logger.info(JsonMessage(log_entry))
         return log_entry
     
     def info(self, msg):
@@ -62,10 +79,6 @@ class StructuredLogger:
     def error(self, msg, exc_info=False):
         self.logger.error(msg, exc_info=exc_info)
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = StructuredLogger(__name__)
 
 ALLOWED_ORIGINS = [
@@ -82,82 +95,369 @@ app.add_middleware(
     allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
     allow_methods=["GET", "POST", "OPTIONS"],
-    allow_headers=["Content-Type", "Authorization"],
+    allow_headers=["Content-Type", "Authorization", "Idempotency-Key"],
+    expose_headers=["Idempotent-Replayed"],
     max_age=3600,
 )
 
-class RateLimitMiddleware:
-    def __init__(self, app, requests_per_minute: int = 100):
-        self.app = app
-        self.requests_per_minute = requests_per_minute
-        self.requests = defaultdict(list)
-    
-    async def __call__(self, request: Request, call_next):
-        client_ip = request.client.host if request.client else "unknown"
-        now = time.time()
-        
-        if client_ip not in self.requests:
-            self.requests[client_ip] = []
-        
-        self.requests[client_ip] = [req_time for req_time in self.requests[client_ip] if now - req_time < 60]
-        
-        if len(self.requests[client_ip]) >= self.requests_per_minute:
-            logger.warning(f"Rate limit exceeded for IP: {client_ip}")
-            return JSONResponse(
-                status_code=429,
-                content={"detail": "Too many requests. Please try again later."}
-            )
-        
-        self.requests[client_ip].append(now)
-        return await call_next(request)
+rate_limit_middleware = RateLimitMiddleware(limiter_from_env(), logger)
+
+@app.middleware("http")
+async def rate_limit(request: Request, call_next):
+    return await rate_limit_middleware(request, call_next)
+
+INVENTORY_PAGE_ROWS = 1000
 
-rate_limit_middleware = RateLimitMiddleware(app, requests_per_minute=100)
-app.middleware("http")(lambda request, call_next: rate_limit_middleware(request, call_next))
+@app.on_event("startup")
+async def load_inventory():
+    """Count existing bookings against room inventory: every stay that may still be running,
+    i.e. checking in at most MAX_NIGHTS days ago (load_bookings skips past nights), paged by id."""
+    try:
+        checkin_from = (date.today() - timedelta(days=MAX_NIGHTS)).isoformat()
+        after_id, loaded = None, 0
+        while True:
+            page = await async_db.get_bookings_page(checkin_from, "9999-12-31", after_id, INVENTORY_PAGE_ROWS,
+                                                    "id, hotel_id, checkin_date, nights")
+            inventory.load_bookings(page)
+            loaded += len(page)
+            if len(page) < INVENTORY_PAGE_ROWS:
+                break
+            after_id = page[-1]["id"]
+        logger.info(f"Inventory loaded from {loaded} booking(s)")
+    except Exception as e:
+        logger.error(f"Failed to load bookings into inventory: {e}")
+
+@app.on_event("startup")
+def start_payment_reconciler():
+    """Replay journaled payment events and start reconciling new ones."""
+    reconciler.start()
+
+@app.on_event("startup")
+def start_analytics():
+    """Load the analytics counters and start flushing increments."""
+    db.stats.start()
+
+@app.on_event("shutdown")
+def flush_pending_writes():
+    db.close_conversation_writer()
+    reconciler.close()
+    db.close_audit_log()
+    db.close_stats()
+    async_db.shutdown()
+
+# Responses cached per Idempotency-Key so client retries never repeat a booking or payment
+idempotency_store = IdempotencyStore(
+    ttl_seconds=float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400")),
+    max_entries=int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+)
+
+async def run_idempotent(scope, key, req, response: Response, fn):
+    """Run fn once per idempotency key; retries get the original response."""
+    try:
+        result, replayed = await idempotency_store.run(scope, key, req.model_dump(), fn)
+    except IdempotencyKeyConflict as e:
+        logger.warning(f"Idempotency key reused with a different request on {scope}")
+        raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyKeyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+def claim_room(req):
+    """Return (hold_id, created) for the booking: the client's hold from the confirmation
+    step if it is still active, otherwise a new one. 409 when the dates are sold out."""
+    hold = inventory.get(req.hold_id)
+    if hold and hold.matches(req.hotel_id, req.checkin_date, req.nights):
+        return hold.id, False
+    hold = inventory.hold(req.hotel_id, req.checkin_date, req.nights, owner=req.user_id)
+    if not hold:
+        logger.warning(f"No rooms left at {req.hotel_id} from {req.checkin_date} for {req.nights} nights")
+        raise HTTPException(status_code=409, detail="No rooms left for the selected dates")
+    return hold.id, True
+
+def commit_room(hold_id, req):
+    """Count the saved booking against inventory (even if its hold expired meanwhile)."""
+    if not inventory.commit(hold_id):
+        inventory.load_bookings([{"hotel_id": req.hotel_id, "checkin_date": req.checkin_date, "nights": req.nights}])
+    pending = booking_in_progress.get(req.user_id)
+    if pending and pending.get("hold_id") == hold_id:
+        del booking_in_progress[req.user_id]
 
 ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin123")
-ADMIN_TOKENS = {}
+admin_tokens = AdminTokens()
+
+ADMIN_AUTH_ERRORS = {
+    "missing_token": "Missing or invalid token",
+    "invalid_token": "Invalid token",
+    "token_expired": "Token expired",
+    "token_revoked": "Token revoked",
+}
+
+async def require_admin(request: Request, authorization: str = Header(None)) -> dict:
+    """Dependency for /admin/* routes: the verified admin token claims, or 401."""
+    if not authorization or not authorization.startswith("Bearer "):
+        reason = "missing_token"
+    else:
+        try:
+            return admin_tokens.verify(authorization[len("Bearer "):])
+        except AdminTokenError as e:
+            reason = e.reason
+    logger.warning(f"Admin request to {request.url.path} rejected: {reason}")
+    logger.log_action(
+        action="ADMIN_AUTH",
+        user_id=None,
+        resource_type="admin",
+        resource_id=request.url.path,
+        status="failed",
+        details={"reason": reason}
+    )
+    raise HTTPException(status_code=401, detail=ADMIN_AUTH_ERRORS[reason])
 
 @app.post("/chat", response_model=ChatResponse)
-async def chat(req: ChatRequest):
-    try:
-        # Use the user_id provided by the browser (from localStorage)
-        # Validate that it's a proper UUID format
-        user_id = req.user_id
-        if user_id:
-            try:
-                uuid.UUID(user_id)
-            except (ValueError, AttributeError, TypeError):
-                # Invalid UUID format, generate a new one
-                user_id = str(uuid.uuid4())
-                logger.info(f"Invalid user_id format received: {req.user_id}, generated new UUID: {user_id}")
-        else:
+async def chat(req: ChatRequest, response: Response, idempotency_key: str = Header(None)):
+    return await run_idempotent("chat", idempotency_key or req.client_message_id, req, response,
+                                lambda: _chat(req))
+
+def chat_user_id(raw: Optional[str]) -> str:
+    """The browser's user_id (from localStorage) if it is a valid UUID, else a new one."""
+    if raw:
+        try:
+            uuid.UUID(raw)
+            return raw
+        except (ValueError, AttributeError, TypeError):
             user_id = str(uuid.uuid4())
-        
-        db.save_conversation(user_id, "user", req.message, meta={})
-        reply, suggestions, meta = bot_reply(req.message, user_id=user_id)
-        db.save_conversation(user_id, "bot", reply, meta=meta)
-        logger.log_action(
-            action="CHAT_MESSAGE",
-            user_id=user_id,
-            resource_type="chat",
-            resource_id=user_id,
-            status="success",
-            details={"message_length": len(req.message), "has_suggestions": len(suggestions or []) > 0}
-        )
+            logger.info(f"Invalid user_id format received: {raw}, generated new UUID: {user_id}")
+            return user_id
+    return str(uuid.uuid4())
+
+def chat_turn(user_id: str, message: str, rows: Optional[list] = None):
+    """One chat turn, shared by /chat, /ws/chat and /chat/batch: run the bot and record both
+    messages. Returns (reply, suggestions, meta).
+
+    The conversation rows are queued for the write-behind writer, or, when `rows` is given,
+    appended to it for the caller to save in bulk."""
+    def record(role, text, meta):
+        if rows is None:
+            # Conversation rows are persisted by the write-behind queue, off the request path
+            return db.enqueue_conversation(user_id, role, text, meta=meta)
+        row = db.new_conversation_row(user_id, role, text, meta=meta)
+        rows.append(row)
+        return row
+
+    user_row = record("user", message, {})
+    reply, suggestions, meta = bot_reply(message, user_id=user_id)
+    bot_row = record("bot", reply, meta)
+    db.stats.record_chat(user_id, meta)
+    publish_chat_turn(user_row, message, bot_row, reply)
+    logger.log_action(
+        action="CHAT_MESSAGE",
+        user_id=user_id,
+        resource_type="chat",
+        resource_id=user_id,
+        status="success",
+        details={"message_length": len(message), "has_suggestions": len(suggestions or []) > 0}
+    )
+    return reply, suggestions, meta
+
+# One lock per user with a turn in flight, so a user's messages are answered in order even
+# when they arrive over several connections; different users run concurrently
+_chat_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+async def run_chat_turn(user_id: str, message: str, rows: Optional[list] = None):
+    lock = _chat_locks.get(user_id)
+    if lock is None:
+        lock = _chat_locks[user_id] = asyncio.Lock()
+    async with lock:
+        # bot_reply may call the LLM; keep it off the event loop
+        return await run_in_threadpool(chat_turn, user_id, message, rows)
+
+def log_chat_error(user_id: Optional[str], e: Exception):
+    logger.error(f"Chat error: {e}", exc_info=True)
+    logger.log_action(
+        action="CHAT_MESSAGE",
+        user_id=user_id or "unknown",
+        resource_type="chat",
+        resource_id="unknown",
+        status="error",
+        details={"error": str(e)}
+    )
+
+async def _chat(req: ChatRequest):
+    try:
+        user_id = chat_user_id(req.user_id)
+        reply, suggestions, meta = await run_chat_turn(user_id, req.message)
         return ChatResponse(reply=reply, suggestions=suggestions, meta=meta)
     except Exception as e:
-        logger.error(f"Chat error: {e}", exc_info=True)
-        logger.log_action(
-            action="CHAT_MESSAGE",
-            user_id=req.user_id or "unknown",
-            resource_type="chat",
-            resource_id="unknown",
-            status="error",
-            details={"error": str(e)}
-        )
+        log_chat_error(req.user_id, e)
         raise HTTPException(status_code=500, detail="Chat processing failed")
 
+CHAT_BATCH_MAX = int(os.getenv("CHAT_BATCH_MAX", "500"))
+CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", "16"))
+
+@app.post("/chat/batch")
+async def chat_batch(req: ChatBatchRequest, request: Request, response: Response, idempotency_key: str = Header(None)):
+    """Answer many chat messages in one call (channel bridges, replays).
+
+    Messages of different users are answered concurrently (up to CHAT_BATCH_CONCURRENCY users
+    at a time); each user's messages are answered in the order given. All conversation rows
+    of the batch are saved with one bulk insert. Results come back in input order; a message
+    that fails gets an `error` instead of a reply without failing the rest.
+
+    Every message counts against the client's /chat rate limit like a POST /chat would; the
+    messages over the limit get the error "rate_limited" (with `retry_after` seconds) and are
+    not answered."""
+    if len(req.messages) > CHAT_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {CHAT_BATCH_MAX} messages per batch")
+    client_ip = request.client.host if request.client else "unknown"
+    return await run_idempotent("chat_batch", idempotency_key, req, response, lambda: _chat_batch(req, client_ip))
+
+async def _chat_batch(req: ChatBatchRequest, client_ip: str):
+    # Each missing/invalid user_id becomes a new user, like /chat
+    user_ids = [chat_user_id(m.user_id) for m in req.messages]
+    results = [None] * len(req.messages)
+    # The middleware counted the batch as one request; charge the messages one by one
+    retry = 0
+    for i, msg in enumerate(req.messages):
+        if not retry:
+            allowed, _, wait = await rate_limit_middleware.limiter.acheck(client_ip, "/chat")
+            retry = 0 if allowed else max(wait, 1)
+        if retry:
+            results[i] = {"user_id": user_ids[i], "client_message_id": msg.client_message_id,
+                          "error": "rate_limited", "retry_after": retry}
+    if retry:
+        logger.warning(f"Rate limit exceeded for IP: {client_ip} on /chat/batch")
+    by_user = defaultdict(list)
+    for i, user_id in enumerate(user_ids):
+        if results[i] is None:
+            by_user[user_id].append(i)
+    rows = []
+    slots = asyncio.Semaphore(CHAT_BATCH_CONCURRENCY)
+
+    async def answer_user(user_id, indexes):
+        async with slots:
+            for i in indexes:
+                msg = req.messages[i]
+                result = {"user_id": user_id, "client_message_id": msg.client_message_id}
+                try:
+                    reply, suggestions, meta = await run_chat_turn(user_id, msg.message, rows)
+                    result.update(reply=reply, suggestions=suggestions, meta=meta)
+                except Exception as e:
+                    log_chat_error(user_id, e)
+                    result["error"] = "Chat processing failed"
+                results[i] = result
+
+    await asyncio.gather(*(answer_user(u, indexes) for u, indexes in by_user.items()))
+    if rows:
+        await async_db.save_conversation_rows(rows)
+    failed = sum(1 for r in results if "error" in r)
+    logger.info(f"Chat batch: {len(results)} message(s) from {len(by_user)} user(s), {failed} failed")
+    return {"count": len(results), "failed": failed, "results": results}
+
+WS_CHAT_PING_SECONDS = float(os.getenv("WS_CHAT_PING_SECONDS", "20"))
+WS_CHAT_MAX_QUEUED = int(os.getenv("WS_CHAT_MAX_QUEUED", "8"))
+
+@app.websocket("/ws/chat")
+async def ws_chat(websocket: WebSocket, user_id: Optional[str] = None):
+    """Chat over one persistent connection per browser session.
+
+    The user_id is bound once, from the query string (a new one is issued if it is missing or
+    invalid, and sent back in the `ready` frame). Client frames are JSON:
+        {"type": "message", "message": "...", "client_message_id": "..."}
+        {"type": "pong"}
+    Messages are answered in the order they were sent, each with a `reply` frame
+    ({"type": "reply", "client_message_id", "reply", "suggestions", "meta"}); at most
+    WS_CHAT_MAX_QUEUED wait behind the one being answered, and further messages are refused
+    with an `error` frame (code "busy") rather than buffered. Each message frame counts against
+    the client's /chat rate limit like a POST /chat would; over the limit it is refused with an
+    `error` frame (code "rate_limited", with `retry_after` seconds). The server also pushes
+    `booking_status` frames for bookings made with this user_id, then `payment_status` frames
+    as their payments settle.
+
+    Heartbeat: after WS_CHAT_PING_SECONDS without anything to send, the server sends
+    {"type": "ping"}; a connection that has sent nothing for three intervals is closed
+    (code 4408)."""
+    user_id = chat_user_id(user_id)
+    client_ip = websocket.client.host if websocket.client else "unknown"
+    # Not counted against EVENT_BUS_MAX_SUBSCRIBERS, which is reserved for the admin feed
+    updates = bus.subscribe(user_topic(user_id), limited=False)
+    await websocket.accept()
+    send_lock = asyncio.Lock()
+    inbox: asyncio.Queue = asyncio.Queue(WS_CHAT_MAX_QUEUED)
+    last_seen = time.monotonic()
+
+    async def send(frame: dict):
+        async with send_lock:
+            await websocket.send_text(json.dumps(frame, default=str))
+
+    async def receive():
+        nonlocal last_seen
+        while True:
+            text = await websocket.receive_text()
+            last_seen = time.monotonic()
+            try:
+                frame = json.loads(text)
+                kind = frame.get("type", "message")
+            except (ValueError, AttributeError):
+                await send({"type": "error", "code": "bad_frame", "detail": "Frames must be JSON objects"})
+                continue
+            if kind == "pong":
+                continue
+            # The HTTP rate limit middleware never sees WebSocket frames
+            allowed, _, retry = await rate_limit_middleware.limiter.acheck(client_ip, "/chat")
+            if not allowed:
+                logger.warning(f"Rate limit exceeded for IP: {client_ip} on /ws/chat")
+                await send({"type": "error", "code": "rate_limited", "detail": "Too many requests. Please try again later.",
+                            "retry_after": retry, "client_message_id": frame.get("client_message_id")})
+                continue
+            if kind != "message" or not isinstance(frame.get("message"), str) or not frame["message"].strip():
+                await send({"type": "error", "code": "bad_frame", "detail": "Expected a non-empty message",
+                            "client_message_id": frame.get("client_message_id")})
+                continue
+            try:
+                inbox.put_nowait(frame)
+            except asyncio.QueueFull:
+                await send({"type": "error", "code": "busy", "detail": "Too many messages waiting for a reply",
+                            "client_message_id": frame.get("client_message_id")})
+
+    async def answer():
+        while True:
+            frame = await inbox.get()
+            try:
+                reply, suggestions, meta = await run_chat_turn(user_id, frame["message"])
+            except Exception as e:
+                log_chat_error(user_id, e)
+                await send({"type": "error", "code": "chat_failed", "detail": "Chat processing failed",
+                            "client_message_id": frame.get("client_message_id")})
+                continue
+            await send({"type": "reply", "client_message_id": frame.get("client_message_id"),
+                        "reply": reply, "suggestions": suggestions, "meta": meta})
+
+    async def push():
+        while True:
+            events = await updates.get(timeout=WS_CHAT_PING_SECONDS)
+            if not events:
+                if time.monotonic() - last_seen > 3 * WS_CHAT_PING_SECONDS:
+                    await websocket.close(code=4408)
+                    return
+                await send({"type": "ping"})
+                continue
+            for event in events:
+                if event["data"].get("type") == "booking_status":
+                    updates.follow(booking_topic(event["data"]["booking_id"]))
+                await send(event["data"])
+
+    tasks = [asyncio.ensure_future(t()) for t in (receive, answer, push)]
+    try:
+        await send({"type": "ready", "user_id": user_id})
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        updates.close()
+
 @app.post("/internal/search_hotels")
 async def search_hotels(req: InternalSearchHotelsRequest):
     try:
@@ -208,22 +508,27 @@ async def confirm_booking(req: InternalBookHotelRequest):
         summary, booking_data = prepare_booking_confirmation(
             req.user_id, req.name, req.phone, req.hotel_id, req.checkin_date, req.nights
         )
+        if not booking_data:
+            logger.warning(f"No rooms left for confirmation: {req.hotel_id} {req.checkin_date}")
+            raise HTTPException(status_code=409, detail="No rooms left for the selected dates")
         
-        total_price = hotel["price_per_night"] * req.nights
-        tax = total_price * 0.18
+        q = quote(hotel, req.nights, req.checkin_date)
         
         logger.info(f"Booking confirmation generated for user {req.user_id}")
         
         return {
             "status": "confirmation_pending",
             "summary": summary,
+            "hold_id": booking_data["hold_id"],
+            "hold_expires_in": int(inventory.hold_seconds),
             "booking_details": {
                 "hotel_name": hotel["name"],
                 "price_per_night": hotel["price_per_night"],
                 "nights": req.nights,
-                "subtotal": total_price,
-                "gst": tax,
-                "total": total_price + tax
+                "nightly_rates": [rupees(p) for p in q["nightly_paise"]],
+                "subtotal": rupees(q["subtotal_paise"]),
+                "gst": rupees(q["gst_paise"]),
+                "total": rupees(q["total_paise"])
             }
         }
     except HTTPException:
@@ -233,7 +538,12 @@ async def confirm_booking(req: InternalBookHotelRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/internal/book_hotel")
-async def book_hotel_internal(req: InternalBookHotelRequest):
+async def book_hotel_internal(req: InternalBookHotelRequest, response: Response,
+                              idempotency_key: str = Header(None)):
+    return await run_idempotent("book_hotel", idempotency_key, req, response,
+                                lambda: _book_hotel_internal(req))
+
+async def _book_hotel_internal(req: InternalBookHotelRequest):
     try:
         is_valid, error = validate_booking_input(
             req.name, req.phone, req.checkin_date, req.nights, req.visitors
@@ -255,31 +565,32 @@ async def book_hotel_internal(req: InternalBookHotelRequest):
             logger.warning(f"Hotel not found: {req.hotel_id}")
             raise HTTPException(status_code=404, detail="Hotel not found")
         
-        user = db.upsert_user(req.name, req.phone)
-        user_id = user.get("id")
-        total_price = hotel["price_per_night"] * req.nights
-        
-        booking = db.create_booking(
-            user_id, req.hotel_id, hotel["name"],
-            req.checkin_date, req.nights, total_price, req.visitors
-        )
+        total_price = rupees(quote(hotel, req.nights, req.checkin_date)["subtotal_paise"])
         
+        hold_id, hold_created = claim_room(req)
+        try:
+            # User upsert + booking + audit log in one atomic round trip
+            result = await async_db.book_hotel(
+                req.name, req.phone, req.hotel_id, hotel["name"],
+                req.checkin_date, req.nights, total_price, req.visitors,
+                audit_details={
+                    "hotel_name": hotel["name"],
+                    "checkin_date": req.checkin_date,
+                    "nights": req.nights,
+                    "visitors": req.visitors,
+                    "total_price": total_price,
+                    "hold_id": hold_id
+                }
+            )
+        except Exception:
+            if hold_created:
+                inventory.release(hold_id)
+            raise
+        commit_room(hold_id, req)
+        booking = result["booking"]
+        user_id = result["user"]["id"]
         booking_id = booking["id"]
         
-        create_audit_log(
-            action="BOOKING_CREATED",
-            user_id=user_id,
-            resource_type="booking",
-            resource_id=booking_id,
-            details={
-                "hotel_name": hotel["name"],
-                "checkin_date": req.checkin_date,
-                "nights": req.nights,
-                "visitors": req.visitors,
-                "total_price": total_price
-            }
-        )
-        
         logger.log_action(
             action="BOOKING_CREATED",
             user_id=user_id,
@@ -297,6 +608,7 @@ async def book_hotel_internal(req: InternalBookHotelRequest):
         return {
             "status": "success",
             "booking_id": booking_id,
+            "booking": booking,
             "total_price": total_price,
             "hotel": hotel
         }
@@ -314,18 +626,136 @@ async def book_hotel_internal(req: InternalBookHotelRequest):
         )
         raise HTTPException(status_code=500, detail=str(e))
 
+BULK_BOOK_MAX_ROWS = int(os.getenv("BULK_BOOK_MAX_ROWS", "1000"))
+BULK_BOOK_CHUNK_ROWS = int(os.getenv("BULK_BOOK_CHUNK_ROWS", "100"))
+
+def parse_bulk_rows(body: bytes, content_type: str) -> list:
+    """Rows from a CSV upload (with a header row) or a JSON list / {"rows": [...]}."""
+    text = body.decode("utf-8-sig")
+    if "csv" in content_type:
+        rows = [dict(r) for r in csv.DictReader(io.StringIO(text))]
+    else:
+        data = json.loads(text)
+        rows = data.get("rows") if isinstance(data, dict) else data
+        if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+            raise ValueError('expected a JSON list of rows or {"rows": [...]}')
+    for row in rows:
+        for field, value in list(row.items()):
+            if isinstance(value, str):
+                row[field] = value = value.strip()
+                if field in ("nights", "visitors") and value.isdigit():
+                    row[field] = int(value)
+        if row.get("visitors") in (None, ""):
+            row["visitors"] = 1
+    return rows
+
+@app.post("/internal/bulk_book")
+async def bulk_book(request: Request):
+    """Book many rooms at once from CSV (Content-Type: text/csv) or JSON rows with the
+    /book fields. Streams one NDJSON status line per row (1-based), then a summary line."""
+    try:
+        rows = parse_bulk_rows(await request.body(), request.headers.get("content-type", ""))
+    except (ValueError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid bulk booking payload: {e}")
+    if not rows:
+        raise HTTPException(status_code=400, detail="No rows to book")
+    if len(rows) > BULK_BOOK_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_BOOK_MAX_ROWS} rows per request")
+    batch_id = f"bulk_{uuid.uuid4().hex[:12]}"
+    logger.info(f"Bulk booking {batch_id}: {len(rows)} rows")
+    return StreamingResponse(bulk_book_report(rows, batch_id), media_type="application/x-ndjson")
+
+async def bulk_book_report(rows: list, batch_id: str):
+    from hotels_data import HOTELS
+    hotels = {h["id"]: h for h in HOTELS}
+    checks = validate_booking_rows(rows)
+    counts = defaultdict(int)
+    for start in range(0, len(rows), BULK_BOOK_CHUNK_ROWS):
+        report = {}
+        entries, holds, indexes = [], [], []
+        for i in range(start, min(start + BULK_BOOK_CHUNK_ROWS, len(rows))):
+            row = rows[i]
+            is_valid, error = checks[i]
+            hotel = hotels.get(row["hotel_id"]) if is_valid else None
+            if is_valid and not hotel:
+                is_valid, error = False, "Hotel not found"
+            if not is_valid:
+                report[i] = {"row": i + 1, "status": "invalid", "error": error}
+                continue
+            hold = inventory.hold(hotel["id"], row["checkin_date"], row["nights"], owner=batch_id)
+            if not hold:
+                report[i] = {"row": i + 1, "status": "sold_out", "error": "No rooms left for the selected dates"}
+                continue
+            total_price = rupees(quote(hotel, row["nights"], row["checkin_date"])["subtotal_paise"])
+            entries.append({
+                "name": row["name"],
+                "phone": str(row["phone"]),
+                "hotel_id": hotel["id"],
+                "hotel_name": hotel["name"],
+                "checkin_date": row["checkin_date"],
+                "nights": row["nights"],
+                "visitors": row.get("visitors", 1),
+                "total_price": total_price,
+                "audit_details": {
+                    "hotel_name": hotel["name"],
+                    "checkin_date": row["checkin_date"],
+                    "nights": row["nights"],
+                    "visitors": row.get("visitors", 1),
+                    "total_price": total_price,
+                    "batch_id": batch_id
+                }
+            })
+            holds.append(hold.id)
+            indexes.append(i)
+        
+        if entries:
+            try:
+                bookings = await async_db.bulk_book(entries)
+            except Exception as e:
+                logger.error(f"Bulk booking {batch_id} failed for rows {indexes[0] + 1}-{indexes[-1] + 1}: {e}")
+                for hold_id in holds:
+                    inventory.release(hold_id)
+                for i in indexes:
+                    report[i] = {"row": i + 1, "status": "error", "error": "Booking could not be saved"}
+            else:
+                for i, hold_id, booking in zip(indexes, holds, bookings):
+                    inventory.commit(hold_id)
+                    report[i] = {"row": i + 1, "status": "booked", "booking_id": booking["id"],
+                                 "total_price": booking["total_price"]}
+        
+        for i in sorted(report):
+            counts[report[i]["status"]] += 1
+            yield json.dumps(report[i]) + "\n"
+    
+    logger.log_action(
+        action="BULK_BOOKING",
+        user_id=None,
+        resource_type="booking",
+        resource_id=batch_id,
+        status="success" if counts["booked"] == len(rows) else "partial",
+        details={"rows": len(rows), **counts}
+    )
+    yield json.dumps({"summary": {"batch_id": batch_id, "rows": len(rows), **counts}}) + "\n"
+
 @app.post("/internal/payment_intent")
-async def create_payment_intent(req: CreatePaymentIntentRequest):
+async def create_payment_intent(req: CreatePaymentIntentRequest, response: Response,
+                                idempotency_key: str = Header(None)):
+    return await run_idempotent("payment_intent", idempotency_key, req, response,
+                                lambda: _create_payment_intent(req))
+
+async def _create_payment_intent(req: CreatePaymentIntentRequest):
     try:
         if req.amount_inr <= 0:
             logger.warning(f"Invalid payment amount: {req.amount_inr}")
             raise HTTPException(status_code=400, detail="Amount must be positive")
         
-        payment_id = f"pi_{uuid.uuid4().hex[:12]}"
-        payment_url = f"https://payment.example.com/{payment_id}"
-        client_secret = f"sk_{uuid.uuid4().hex[:20]}"
+        intent = await async_db.create_payment_intent(
+            new_intent(req.amount_inr, req.currency, req.description, req.booking_id)
+        )
+        payment_id = intent["id"]
+        payment_url = provider.checkout_url(payment_id)
         
-        create_audit_log(
+        await async_db.create_audit_log(
             action="PAYMENT_INTENT_CREATED",
             user_id=None,
             resource_type="payment",
@@ -344,8 +774,8 @@ async def create_payment_intent(req: CreatePaymentIntentRequest):
             "amount_inr": req.amount_inr,
             "currency": req.currency,
             "payment_url": payment_url,
-            "client_secret": client_secret,
-            "status": "pending"
+            "client_secret": intent["client_secret"],
+            "status": intent["status"]
         }
     except HTTPException:
         raise
@@ -353,70 +783,258 @@ async def create_payment_intent(req: CreatePaymentIntentRequest):
         logger.error(f"Payment intent error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/internal/generate_invoice")
-async def generate_invoice_internal(req: GenerateInvoiceRequest):
+@app.get("/internal/payment_intent/{payment_id}")
+async def get_payment_intent(payment_id: str):
+    intent = await async_db.get_payment_intent(payment_id)
+    if not intent:
+        raise HTTPException(status_code=404, detail="Payment intent not found")
+    intent.pop("client_secret", None)
+    return intent
+
+def accept_payment_event(body: bytes, signature: Optional[str]) -> dict:
+    """Verify a provider event and queue it for reconciliation (no database work here)."""
+    if not PAYMENT_WEBHOOK_SECRET:
+        raise HTTPException(status_code=503, detail="Payment webhooks are not configured")
+    if not verify(body, signature):
+        logger.warning("Payment webhook with invalid signature rejected")
+        raise HTTPException(status_code=401, detail="Invalid signature")
     try:
-        bookings = db.supabase.table("bookings").select("*").eq("id", req.booking_id).execute()
-        if not bookings.data:
-            logger.warning(f"Booking not found for invoice: {req.booking_id}")
+        event = json.loads(body)
+    except ValueError:
+        event = None
+    if not well_formed(event):
+        raise HTTPException(status_code=400, detail="Malformed payment event")
+    queued = reconciler.accept(event)
+    # Unhandled types and redeliveries are acknowledged so the provider stops retrying them
+    return {"received": True, "queued": queued, "event_id": event["id"]}
+
+@app.post("/webhooks/payments")
+async def payment_webhook(request: Request):
+    return accept_payment_event(await request.body(), request.headers.get(SIGNATURE_HEADER))
+
+# Local stand-in for the provider's hosted checkout; it can mark any intent paid, so it is
+# only mounted when PAYMENT_MOCK_ENABLED is set (development)
+if PAYMENT_MOCK_ENABLED:
+    @app.get("/payments/mock/{payment_id}", response_class=HTMLResponse)
+    async def mock_checkout(payment_id: str):
+        """Checkout page of the local payment-provider stand-in."""
+        intent = await async_db.get_payment_intent(payment_id)
+        if not intent:
+            raise HTTPException(status_code=404, detail="Payment intent not found")
+        payment_id = intent["id"]
+        buttons = "".join(
+            f'<form method="post" action="/payments/mock/{payment_id}/complete?outcome={outcome}">'
+            f'<button type="submit">{outcome.capitalize()}</button></form>'
+            for outcome in EVENT_STATUS.values()
+        )
+        return f"""
+            <html>
+            <body>
+            <h1>Test payment</h1>
+            <p>Payment ID: {payment_id}</p>
+            <p>Amount: ₹{intent["amount_inr"]} ({intent["status"]})</p>
+            {buttons}
+            </body>
+            </html>
+            """
+
+    @app.post("/payments/mock/{payment_id}/complete")
+    async def mock_complete_payment(payment_id: str, outcome: str = "succeeded"):
+        """Simulate the provider finishing a checkout: deliver a signed event to the webhook pipeline."""
+        if outcome not in EVENT_STATUS.values():
+            raise HTTPException(status_code=400, detail=f"outcome must be one of: {', '.join(EVENT_STATUS.values())}")
+        intent = await async_db.get_payment_intent(payment_id)
+        if not intent:
+            raise HTTPException(status_code=404, detail="Payment intent not found")
+        body, signature = provider.signed(provider.event(intent, outcome))
+        return accept_payment_event(body, signature)
+
+async def get_or_create_invoice(booking_id: str, gst_percent: Optional[float] = None) -> dict:
+    """The booking's invoice: from cache, else from the invoices table, else rendered and saved once."""
+    invoice = invoice_cache.get(booking_id) or await async_db.get_invoice(booking_id)
+    if not invoice:
+        booking = await async_db.get_booking(booking_id)
+        if not booking:
+            logger.warning(f"Booking not found for invoice: {booking_id}")
             raise HTTPException(status_code=404, detail="Booking not found")
         
-        booking = bookings.data[0]
         hotel = get_hotel_by_id(booking["hotel_id"])
-        
         if not hotel:
             logger.warning(f"Hotel not found for booking: {booking['hotel_id']}")
             raise HTTPException(status_code=404, detail="Hotel not found")
         
-        subtotal = booking["total_price"]
-        gst = subtotal * (req.gst_percent / 100)
-        total = subtotal + gst
-        
-        invoice_id = f"inv_{uuid.uuid4().hex[:10]}"
-        
-        invoice_html = f"""
-        <html>
-        <body>
-        <h1>Invoice</h1>
-        <p>Invoice ID: {invoice_id}</p>
-        <p>Booking ID: {booking['id']}</p>
-        <p>Hotel: {hotel['name']}</p>
-        <p>Subtotal: ₹{subtotal:.2f}</p>
-        <p>GST ({req.gst_percent}%): ₹{gst:.2f}</p>
-        <p><b>Total: ₹{total:.2f}</b></p>
-        </body>
-        </html>
-        """
-        
-        create_audit_log(
+        invoice = build_invoice(booking, hotel, gst_percent if gst_percent is not None else float(GST_PERCENT))
+        if not await async_db.save_invoices([invoice]):
+            # Another request issued it first; serve the stored one
+            stored = await async_db.get_invoice(booking_id)
+            if not stored:
+                raise HTTPException(status_code=503, detail="Invoice could not be saved, please retry")
+            return check_invoice_gst(stored, gst_percent)
+        
+        await async_db.create_audit_log(
             action="INVOICE_GENERATED",
             user_id=booking.get("user_id"),
             resource_type="invoice",
-            resource_id=invoice_id,
+            resource_id=invoice["id"],
             details={
-                "booking_id": req.booking_id,
-                "subtotal": subtotal,
-                "gst": gst,
-                "total": total
+                "booking_id": booking_id,
+                "subtotal": invoice["subtotal"],
+                "gst": invoice["gst"],
+                "total": invoice["total"]
             }
         )
+        logger.info(f"Invoice generated: {invoice['id']} for booking {booking_id}")
+    
+    return check_invoice_gst(invoice, gst_percent)
+
+def check_invoice_gst(invoice: dict, gst_percent: Optional[float]) -> dict:
+    """Cache an issued invoice; a request for a different GST rate than it was issued with is a conflict."""
+    if gst_percent is not None and float(invoice["gst_percent"]) != float(gst_percent):
+        raise HTTPException(status_code=409, detail=f"Invoice already issued with GST {float(invoice['gst_percent']):g}%")
+    invoice_cache.put(invoice)
+    return invoice
+
+def not_modified(request: Request, invoice: dict) -> bool:
+    return request.headers.get("if-none-match") == invoice["etag"]
+
+@app.post("/internal/generate_invoice")
+async def generate_invoice_internal(req: GenerateInvoiceRequest, request: Request):
+    try:
+        invoice = await get_or_create_invoice(req.booking_id, req.gst_percent)
+        headers = {"ETag": invoice["etag"]}
+        if not_modified(request, invoice):
+            return Response(status_code=304, headers=headers)
         
-        logger.info(f"Invoice generated: {invoice_id} for booking {req.booking_id}")
-        
-        return {
-            "invoice_id": invoice_id,
+        return JSONResponse({
+            "invoice_id": invoice["id"],
             "booking_id": req.booking_id,
-            "subtotal": subtotal,
-            "gst": gst,
-            "total": total,
-            "invoice_html": invoice_html
-        }
+            "subtotal": float(invoice["subtotal"]),
+            "gst": float(invoice["gst"]),
+            "total": float(invoice["total"]),
+            "invoice_html": invoice["html"]
+        }, headers=headers)
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Invoice generation error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/invoices/{booking_id}")
+async def get_invoice_html(booking_id: str, request: Request):
+    """The booking's invoice as HTML; supports If-None-Match revalidation."""
+    try:
+        invoice = await get_or_create_invoice(booking_id)
+        headers = {"ETag": invoice["etag"]}
+        if not_modified(request, invoice):
+            return Response(status_code=304, headers=headers)
+        return HTMLResponse(invoice["html"], headers=headers)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Invoice fetch error: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+INVOICE_BATCH_PAGE_ROWS = int(os.getenv("INVOICE_BATCH_PAGE_ROWS", "1000"))
+
+@app.post("/internal/invoices/batch")
+async def generate_invoices_batch(req: InvoiceBatchRequest):
+    """Invoices for every booking checking in during `month` (YYYY-MM) or for `booking_ids`.
+    Streams one NDJSON line per invoice, then a summary line."""
+    if bool(req.month) == bool(req.booking_ids):
+        raise HTTPException(status_code=400, detail="Provide either month or booking_ids")
+    if req.month:
+        try:
+            first = datetime.strptime(req.month, "%Y-%m").date()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="month must be in YYYY-MM format")
+        next_month = (first.replace(day=28) + timedelta(days=4)).replace(day=1)
+        pages = month_booking_pages(first.isoformat(), next_month.isoformat())
+    else:
+        pages = id_booking_pages(req.booking_ids)
+    gst_percent = req.gst_percent if req.gst_percent is not None else float(GST_PERCENT)
+    return StreamingResponse(invoice_batch_report(pages, gst_percent, req.booking_ids),
+                             media_type="application/x-ndjson")
+
+async def month_booking_pages(checkin_from: str, checkin_to: str):
+    after_id = None
+    while True:
+        page = await async_db.get_bookings_page(checkin_from, checkin_to, after_id, INVOICE_BATCH_PAGE_ROWS)
+        if not page:
+            return
+        yield page
+        if len(page) < INVOICE_BATCH_PAGE_ROWS:
+            return
+        after_id = page[-1]["id"]
+
+async def id_booking_pages(booking_ids: list):
+    for i in range(0, len(booking_ids), INVOICE_BATCH_PAGE_ROWS):
+        yield await async_db.get_bookings_by_ids(booking_ids[i:i + INVOICE_BATCH_PAGE_ROWS])
+
+async def invoice_batch_report(pages, gst_percent: float, requested_ids: Optional[list] = None):
+    counts = defaultdict(int)
+    seen = set()
+    try:
+        async for bookings in pages:
+            existing = await async_db.get_invoices_for_bookings([b["id"] for b in bookings])
+            lines, new_invoices = [], []
+            for booking in bookings:
+                seen.add(str(booking["id"]))
+                invoice = existing.get(str(booking["id"]))
+                if invoice:
+                    counts["existing"] += 1
+                else:
+                    hotel = get_hotel_by_id(booking["hotel_id"])
+                    if not hotel:
+                        counts["error"] += 1
+                        lines.append({"booking_id": booking["id"], "status": "error", "error": "Hotel not found"})
+                        continue
+                    invoice = build_invoice(booking, hotel, gst_percent)
+                    new_invoices.append(invoice)
+                    counts["generated"] += 1
+                lines.append({
+                    "booking_id": booking["id"],
+                    "status": "ok",
+                    "invoice_id": invoice["id"],
+                    "total": float(invoice["total"]),
+                    "etag": invoice["etag"],
+                    "invoice_html": invoice["html"]
+                })
+            inserted = {str(inv["booking_id"]) for inv in await async_db.save_invoices(new_invoices)}
+            raced = [str(inv["booking_id"]) for inv in new_invoices if str(inv["booking_id"]) not in inserted]
+            if raced:
+                # Issued concurrently by another request: report the stored invoices instead
+                stored = await async_db.get_invoices_for_bookings(raced)
+                for line in lines:
+                    invoice = stored.get(str(line["booking_id"]))
+                    if invoice:
+                        line.update(invoice_id=invoice["id"], total=float(invoice["total"]), etag=invoice["etag"],
+                                    invoice_html=invoice["html"])
+                counts["generated"] -= len(stored)
+                counts["existing"] += len(stored)
+            for invoice in new_invoices:
+                if str(invoice["booking_id"]) in inserted:
+                    invoice_cache.put(invoice)
+            for line in lines:
+                yield json.dumps(line) + "\n"
+        for booking_id in requested_ids or []:
+            if booking_id not in seen:
+                counts["error"] += 1
+                yield json.dumps({"booking_id": booking_id, "status": "error", "error": "Booking not found"}) + "\n"
+    except Exception as e:
+        logger.error(f"Invoice batch failed: {e}", exc_info=True)
+        counts["error"] += 1
+        yield json.dumps({"status": "error", "error": "Invoice batch failed"}) + "\n"
+    
+    await async_db.create_audit_log(
+        action="INVOICE_BATCH_GENERATED",
+        user_id=None,
+        resource_type="invoice",
+        resource_id="batch",
+        details=dict(counts)
+    )
+    logger.info(f"Invoice batch: {dict(counts)}")
+    yield json.dumps({"summary": dict(counts)}) + "\n"
+
 @app.post("/admin/login")
 async def admin_login(req: AdminLoginRequest):
     try:
@@ -430,20 +1048,16 @@ async def admin_login(req: AdminLoginRequest):
                 status="failed",
                 details={"reason": "invalid_credentials"}
             )
-            create_audit_log(
+            await async_db.create_audit_log(
                 action="ADMIN_LOGIN_FAILED",
                 user_id=None,
                 resource_type="admin",
                 resource_id=req.username,
-                details={"attempt_time": datetime.now().isoformat()}
+                details={"attempt_time": datetime.now(timezone.utc).isoformat()}
             )
             raise HTTPException(status_code=401, detail="Invalid credentials")
         
-        token = f"adm_{uuid.uuid4().hex[:20]}"
-        ADMIN_TOKENS[token] = {
-            "created_at": datetime.now(),
-            "expires_at": datetime.now() + timedelta(hours=2)
-        }
+        token = admin_tokens.issue(req.username)
         
         logger.log_action(
             action="ADMIN_LOGIN",
@@ -451,18 +1065,18 @@ async def admin_login(req: AdminLoginRequest):
             resource_type="admin",
             resource_id=req.username,
             status="success",
-            details={"token_generated": True, "expires_in_hours": 2}
+            details={"token_generated": True, "expires_in_hours": admin_tokens.ttl_seconds / 3600}
         )
         
-        create_audit_log(
+        await async_db.create_audit_log(
             action="ADMIN_LOGIN_SUCCESS",
             user_id=req.username,
             resource_type="admin",
             resource_id=req.username,
-            details={"token_created": datetime.now().isoformat()}
+            details={"token_created": datetime.now(timezone.utc).isoformat()}
         )
         
-        return {"status": "success", "token": token, "expires_in": 7200}
+        return {"status": "success", "token": token, "expires_in": admin_tokens.ttl_seconds}
     except HTTPException:
         raise
     except Exception as e:
@@ -477,81 +1091,162 @@ async def admin_login(req: AdminLoginRequest):
         )
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/admin/logout")
+async def admin_logout(admin: dict = Depends(require_admin)):
+    admin_tokens.revoke(admin)
+    logger.log_action(
+        action="ADMIN_LOGOUT",
+        user_id=admin["sub"],
+        resource_type="admin",
+        resource_id=admin["sub"],
+        status="success"
+    )
+    return {"status": "success"}
+
+CHAT_PAGE_MAX = 200
+CHAT_FEED_TOPIC = "chats"
+CHAT_FEED_KEEPALIVE_SECONDS = 15
+
+def _feed_conversation(row: dict, message: str) -> dict:
+    """A conversation row in the /admin/chats (fields=full) shape, with the full text."""
+    return {
+        "id": row["id"],
+        "user_id": row.get("user_id"),
+        "role": row["role"],
+        "message_preview": message[:100],
+        "created_at": row["created_at"],
+        "message": message,
+        "meta": row.get("meta") or {}
+    }
+
+def publish_chat_turn(user_row: dict, user_message: str, bot_row: dict, reply: str):
+    """Push a saved chat turn to live admin feeds (no-op when nobody is watching)."""
+    if bus.subscriber_count(CHAT_FEED_TOPIC):
+        bus.publish(CHAT_FEED_TOPIC, {"conversations": [_feed_conversation(user_row, user_message),
+                                                        _feed_conversation(bot_row, reply)]})
+
+@app.get("/admin/chats/stream")
+async def stream_chats(request: Request, admin: dict = Depends(require_admin)):
+    """Server-sent events: one `conversation` event per saved chat turn, as it happens.
+
+    Each subscriber has a bounded buffer (EVENT_BUS_BUFFER events); if it falls behind, the
+    oldest events are dropped and a `dropped` event tells the client to re-fetch
+    /admin/chats. A comment line is sent every 15s of silence to keep proxies from closing
+    the connection."""
+    try:
+        sub = bus.subscribe(CHAT_FEED_TOPIC)
+    except TooManySubscribers:
+        raise HTTPException(status_code=503, detail="Too many live feeds open")
+    logger.log_action(
+        action="ADMIN_CHAT_STREAM",
+        user_id=admin["sub"],
+        resource_type="admin",
+        resource_id="chats_stream",
+        status="success"
+    )
+
+    async def events():
+        reported = 0
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                batch = await sub.get(timeout=CHAT_FEED_KEEPALIVE_SECONDS)
+                if not batch:
+                    yield ": keepalive\n\n"
+                    continue
+                if sub.dropped > reported:
+                    yield f"event: dropped\ndata: {json.dumps({'dropped': sub.dropped - reported})}\n\n"
+                    reported = sub.dropped
+                yield "".join(f"id: {e['id']}\nevent: conversation\ndata: {json.dumps(e['data'], default=str)}\n\n"
+                              for e in batch)
+        finally:
+            sub.close()
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def _encode_chat_cursor(row: dict) -> str:
+    raw = json.dumps([str(row["created_at"]), str(row["id"])], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+def _decode_chat_cursor(cursor: str) -> tuple:
+    try:
+        created_at, last_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(created_at), str(last_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _parse_date_bound(name: str, value: Optional[str]) -> Optional[str]:
+    if not value:
+        return None
+    try:
+        datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an ISO date or timestamp")
+    return value
+
 @app.get("/admin/chats")
-async def fetch_chats(limit: int = 50, authorization: str = Header(None)):
+async def fetch_chats(limit: int = 50, cursor: Optional[str] = None, fields: str = "full",
+                      user_id: Optional[str] = None, created_from: Optional[str] = None,
+                      created_to: Optional[str] = None, admin: dict = Depends(require_admin)):
+    """Conversations newest first, a page at a time.
+
+    Pass the returned `next_cursor` back as `cursor` for the next page (null on the last).
+    `fields=preview` returns only id, user_id, role, created_at and message_preview for list
+    views; `fields=full` also returns the message and meta. `user_id`, `created_from`
+    (inclusive) and `created_to` (exclusive) narrow the results."""
+    if fields not in ("full", "preview"):
+        raise HTTPException(status_code=400, detail="fields must be 'full' or 'preview'")
+    limit = max(1, min(limit, CHAT_PAGE_MAX))
+    after = _decode_chat_cursor(cursor) if cursor else None
+    created_from = _parse_date_bound("created_from", created_from)
+    created_to = _parse_date_bound("created_to", created_to)
     try:
-        if not authorization or not authorization.startswith("Bearer "):
-            logger.warning("Fetch chats attempt without valid authorization")
-            logger.log_action(
-                action="ADMIN_FETCH_CHATS",
-                user_id=None,
-                resource_type="admin",
-                resource_id="fetch_chats",
-                status="failed",
-                details={"reason": "missing_token"}
-            )
-            raise HTTPException(status_code=401, detail="Missing or invalid token")
-        
-        token = authorization.split(" ")[1]
-        if token not in ADMIN_TOKENS:
-            logger.warning(f"Fetch chats attempt with invalid token")
-            logger.log_action(
-                action="ADMIN_FETCH_CHATS",
-                user_id=None,
-                resource_type="admin",
-                resource_id="fetch_chats",
-                status="failed",
-                details={"reason": "invalid_token"}
-            )
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        token_data = ADMIN_TOKENS[token]
-        if datetime.now() > token_data["expires_at"]:
-            del ADMIN_TOKENS[token]
-            logger.warning(f"Fetch chats attempt with expired token")
-            logger.log_action(
-                action="ADMIN_FETCH_CHATS",
-                user_id=None,
-                resource_type="admin",
-                resource_id="fetch_chats",
-                status="failed",
-                details={"reason": "token_expired"}
-            )
-            raise HTTPException(status_code=401, detail="Token expired")
-        
-        conversations = db.supabase.table("conversations").select("*").limit(limit).order("created_at", desc=True).execute()
+        rows = await async_db.get_conversations_page(
+            limit, after, user_id, created_from, created_to,
+            db.CONVERSATION_PREVIEW_COLUMNS if fields == "preview" else "*"
+        )
         
         safe_conversations = []
-        for conv in conversations.data:
+        if fields == "preview":
+            rows = await async_db.conversation_previews(rows)
+        else:
+            rows = await async_db.expand_conversations(rows)
+        for conv in rows:
+            message = conv.get("message") or ""
             safe_conv = {
                 "id": conv.get("id"),
                 "user_id": conv.get("user_id"),
                 "role": conv.get("role"),
-                "message": conv.get("message", ""),
-                "message_preview": conv.get("message", "")[:100],
-                "created_at": conv.get("created_at"),
-                "meta": conv.get("meta", {})
+                "message_preview": conv["message_preview"] if fields == "preview" else message[:100],
+                "created_at": conv.get("created_at")
             }
+            if fields == "full":
+                safe_conv["message"] = message
+                safe_conv["meta"] = conv.get("meta", {})
             safe_conversations.append(safe_conv)
+        next_cursor = _encode_chat_cursor(rows[-1]) if len(rows) == limit else None
         
+        details = {"admin": admin["sub"], "conversation_count": len(safe_conversations), "limit": limit,
+                   "fields": fields, "user_id": user_id, "paged": bool(cursor)}
         logger.log_action(
             action="ADMIN_FETCH_CHATS",
             user_id=None,
             resource_type="admin",
             resource_id="fetch_chats",
             status="success",
-            details={"conversation_count": len(safe_conversations), "limit": limit}
+            details=details
         )
         
-        create_audit_log(
+        await async_db.create_audit_log(
             action="ADMIN_FETCH_CHATS",
             user_id=None,
             resource_type="admin",
             resource_id="fetch_chats",
-            details={"conversation_count": len(safe_conversations), "limit": limit}
+            details=details
         )
         
-        return {"conversations": safe_conversations, "count": len(safe_conversations)}
+        return {"conversations": safe_conversations, "count": len(safe_conversations), "next_cursor": next_cursor}
     except HTTPException:
         raise
     except Exception as e:
@@ -566,9 +1261,161 @@ async def fetch_chats(limit: int = 50, authorization: str = Header(None)):
         )
         raise HTTPException(status_code=500, detail=str(e))
 
+SEARCH_PAGE_MAX = 100
+
+@app.get("/admin/search_chats")
+async def search_chats(q: str, limit: int = 20, offset: int = 0, admin: dict = Depends(require_admin)):
+    """Ranked full-text search over conversations: every word is a prefix match and all are
+    required. Pass `next_offset` back as `offset` for the next page (null on the last)."""
+    if not query_tokens(q):
+        raise HTTPException(status_code=400, detail="Search query must contain at least one word")
+    limit = max(1, min(limit, SEARCH_PAGE_MAX))
+    offset = max(0, offset)
+    try:
+        rows = await async_db.search_conversations(q, limit, offset)
+        results = []
+        for conv in await async_db.expand_conversations(rows):
+            results.append({
+                "id": conv.get("id"),
+                "user_id": conv.get("user_id"),
+                "role": conv.get("role"),
+                "message_preview": (conv.get("message") or "")[:100],
+                "created_at": conv.get("created_at"),
+                "rank": conv.get("rank")
+            })
+        details = {"admin": admin["sub"], "result_count": len(results), "offset": offset}
+        logger.log_action(
+            action="ADMIN_SEARCH_CHATS",
+            user_id=None,
+            resource_type="admin",
+            resource_id="search_chats",
+            status="success",
+            details=details
+        )
+        await async_db.create_audit_log(
+            action="ADMIN_SEARCH_CHATS",
+            user_id=None,
+            resource_type="admin",
+            resource_id="search_chats",
+            details={**details, "query": q}
+        )
+        return {"results": results, "count": len(results),
+                "next_offset": offset + limit if len(results) == limit else None}
+    except Exception as e:
+        logger.error(f"Search chats error: {e}", exc_info=True)
+        logger.log_action(
+            action="ADMIN_SEARCH_CHATS",
+            user_id=None,
+            resource_type="admin",
+            resource_id="search_chats",
+            status="error",
+            details={"error": str(e)}
+        )
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/admin/export/{table}")
+async def export_table(table: str, format: str = "ndjson", created_from: Optional[str] = None,
+                       created_to: Optional[str] = None, gzip: bool = False, admin: dict = Depends(require_admin)):
+    """Stream every row of conversations, bookings or audit_logs created in
+    [created_from, created_to) as NDJSON or CSV (optionally gzip-compressed), ordered by id,
+    with phone and name fields masked."""
+    if table not in exporter.EXPORT_COLUMNS:
+        raise HTTPException(status_code=404, detail="Unknown export")
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+    created_from = _parse_date_bound("created_from", created_from)
+    created_to = _parse_date_bound("created_to", created_to)
+    filename = f"{table}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{format}"
+    body = export_stream(table, format, created_from, created_to, admin["sub"])
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv"
+    if gzip:
+        body, media_type, filename = exporter.gzip_stream(body), "application/gzip", filename + ".gz"
+    return StreamingResponse(body, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+async def export_pages(table: str, created_from: Optional[str], created_to: Optional[str]):
+    after_id = None
+    while True:
+        page = await async_db.get_rows_page(table, created_from, created_to, after_id,
+                                            exporter.EXPORT_PAGE_ROWS, exporter.SELECT_COLUMNS[table])
+        if not page:
+            return
+        after_id = page[-1]["id"]
+        if table == "conversations":
+            page = await async_db.expand_conversations(page)
+        elif table == "bookings":
+            users = await async_db.get_users_by_ids(list({b["user_id"] for b in page if b.get("user_id")}))
+            by_id = {u["id"]: u for u in users}
+            page = [{**b, "name": by_id.get(b.get("user_id"), {}).get("name"),
+                     "phone": by_id.get(b.get("user_id"), {}).get("phone")} for b in page]
+        yield [exporter.mask_row(row) for row in page]
+        if len(page) < exporter.EXPORT_PAGE_ROWS:
+            return
+
+async def export_stream(table: str, format: str, created_from: Optional[str], created_to: Optional[str], admin: str):
+    columns = exporter.EXPORT_COLUMNS[table]
+    encoder = exporter.CsvEncoder(columns) if format == "csv" else None
+    rows, status = 0, "success"
+    if encoder:
+        yield encoder.header()
+    try:
+        async for page in export_pages(table, created_from, created_to):
+            rows += len(page)
+            yield encoder.chunk(page) if encoder else exporter.ndjson_chunk(page, columns)
+    except Exception as e:
+        # Headers are already sent; end the stream (NDJSON gets a trailing error line)
+        logger.error(f"Export of {table} failed after {rows} rows: {e}", exc_info=True)
+        status = "error"
+        if not encoder:
+            yield json.dumps({"status": "error", "error": "Export failed", "rows": rows}) + "\n"
+    details = {"admin": admin, "format": format, "rows": rows, "created_from": created_from, "created_to": created_to}
+    logger.log_action(
+        action="ADMIN_EXPORT",
+        user_id=None,
+        resource_type=table,
+        resource_id="export",
+        status=status,
+        details=details
+    )
+    await async_db.create_audit_log(
+        action="ADMIN_EXPORT",
+        user_id=None,
+        resource_type=table,
+        resource_id="export",
+        details={**details, "status": status}
+    )
+
+@app.get("/admin/stats")
+async def admin_stats(days: int = 30, admin: dict = Depends(require_admin)):
+    """Bookings and revenue per hotel per day, chat conversion and LLM-fallback rates for the
+    last `days` days, from the in-memory analytics counters (see analytics.py)."""
+    return db.stats.summary(days)
+
+@app.get("/admin/archive/{table}/{record_id}")
+async def fetch_archived(table: str, record_id: str, admin: dict = Depends(require_admin)):
+    """Point lookup of a conversation or audit log row that has been moved to the archive."""
+    if table not in archiver.ARCHIVED_TABLES:
+        raise HTTPException(status_code=404, detail="Unknown archive")
+    row = await async_db.run_db(archiver.find_archived, table, record_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Record not found in archive")
+    if table == "conversations":
+        row = (await async_db.expand_conversations([row]))[0]
+    logger.log_action(
+        action="ADMIN_FETCH_ARCHIVED",
+        user_id=admin["sub"],
+        resource_type=table,
+        resource_id=record_id,
+        status="success"
+    )
+    return {"table": table, "record": row}
+
 @app.post("/book")
-async def book(req: InternalBookHotelRequest):
+async def book(req: InternalBookHotelRequest, response: Response, idempotency_key: str = Header(None)):
     """Legacy /book endpoint for backwards compatibility with frontend."""
+    return await run_idempotent("book", idempotency_key, req, response, lambda: _book(req))
+
+async def _book(req: InternalBookHotelRequest):
     try:
         is_valid, error = validate_booking_input(
             req.name, req.phone, req.checkin_date, req.nights, req.visitors
@@ -582,38 +1429,45 @@ async def book(req: InternalBookHotelRequest):
             logger.warning(f"Hotel not found: {req.hotel_id}")
             raise HTTPException(status_code=404, detail="Hotel not found")
         
-        user = db.upsert_user(req.name, req.phone)
-        user_id = user.get("id")
-        total_price = hotel["price_per_night"] * req.nights
-        
-        booking = db.create_booking(
-            user_id, req.hotel_id, hotel["name"],
-            req.checkin_date, req.nights, total_price, req.visitors
-        )
+        total_price = rupees(quote(hotel, req.nights, req.checkin_date)["subtotal_paise"])
         
+        hold_id, hold_created = claim_room(req)
+        try:
+            # User upsert + booking + audit log in one atomic round trip
+            result = await async_db.book_hotel(
+                req.name, req.phone, req.hotel_id, hotel["name"],
+                req.checkin_date, req.nights, total_price, req.visitors,
+                audit_details={
+                    "hotel_name": hotel["name"],
+                    "checkin_date": req.checkin_date,
+                    "nights": req.nights,
+                    "visitors": req.visitors,
+                    "total_price": total_price,
+                    "hold_id": hold_id
+                }
+            )
+        except Exception:
+            if hold_created:
+                inventory.release(hold_id)
+            raise
+        commit_room(hold_id, req)
+        booking = result["booking"]
+        user_id = result["user"]["id"]
         booking_id = booking["id"]
         
-        create_audit_log(
-            action="BOOKING_CREATED",
-            user_id=user_id,
-            resource_type="booking",
-            resource_id=booking_id,
-            details={
-                "hotel_name": hotel["name"],
-                "checkin_date": req.checkin_date,
-                "nights": req.nights,
-                "visitors": req.visitors,
-                "total_price": total_price
-            }
-        )
-        
-        bill_text = generate_bill(hotel, req.nights, req.name, booking_id)
+        bill_text = generate_bill(hotel, req.nights, req.name, booking_id, req.checkin_date)
+        if req.user_id:
+            # Tell the user's open chat connections; they follow the booking's payment from here
+            bus.publish(user_topic(req.user_id), {"type": "booking_status", "booking_id": booking_id,
+                                                  "status": booking.get("payment_status") or "pending",
+                                                  "hotel_name": hotel["name"], "total_price": total_price})
         
         logger.info(f"Booking created via /book: {booking_id}")
         
         return {
             "status": "success",
             "booking_id": booking_id,
+            "booking": booking,
             "bill": bill_text,
             "total_price": total_price,
             "hotel": hotel
@@ -634,10 +1488,32 @@ async def hotels(max_price: int = None):
     results.sort(key=lambda x: (-x["rating"], x["price_per_night"]))
     return {"count": len(results), "hotels": results}
 
+@app.get("/hotels/{hotel_id}/price_calendar")
+async def hotel_price_calendar(hotel_id: str, response: Response, days: int = 30, nights: int = 1):
+    """Price (incl. GST) and rooms left for checking in on each of the next `days` days."""
+    hotel = get_hotel_by_id(hotel_id)
+    if not hotel:
+        raise HTTPException(status_code=404, detail="Hotel not found")
+    if not 1 <= days <= 365 or not 1 <= nights <= 30:
+        raise HTTPException(status_code=400, detail="days must be 1-365 and nights 1-30")
+    calendar = [
+        {
+            "checkin_date": q["checkin_date"],
+            "nightly_rates": [rupees(p) for p in q["nightly_paise"]],
+            "subtotal": rupees(q["subtotal_paise"]),
+            "gst": rupees(q["gst_paise"]),
+            "total": rupees(q["total_paise"]),
+            "rooms_available": inventory.available(hotel_id, q["checkin_date"], nights)
+        }
+        for q in price_calendar(hotel, days=days, nights=nights)
+    ]
+    response.headers["Cache-Control"] = "public, max-age=60"
+    return {"hotel_id": hotel_id, "hotel_name": hotel["name"], "nights": nights, "calendar": calendar}
+
 @app.get("/supabase_test")
 async def supabase_test():
     try:
-        info = db.test_supabase_connection()
+        info = await async_db.test_supabase_connection()
         return info
     except Exception as e:
         logger.error(f"Supabase test error: {e}")
@@ -0,0 +1,49 @@
+"""
+message_templates.py
+Content-addressed storage helpers for bot reply templates.
+
+Most bot replies are fixed templates (welcome text, validation prompts, booking prompts)
+with at most a couple of parameters. Instead of storing the full text for every bot turn,
+`db.save_conversation` stores the template hash plus the parameters and keeps each template
+body once in the `message_templates` table. Readers call `expand_message` to rebuild the text.
+"""
+import hashlib
+from typing import Optional, Tuple, Dict, Any
+
+
+class TemplatedMessage(str):
+    """A rendered bot reply that remembers the template and parameters it came from.
+
+    It behaves exactly like the rendered string, so callers that only need the text
+    (API responses, the frontend) are unaffected.
+    """
+
+    def __new__(cls, text: str, template: str, params: Dict[str, Any]):
+        obj = super().__new__(cls, text)
+        obj.template = template
+        obj.template_hash = template_hash(template)
+        obj.params = params
+        return obj
+
+
+def template_hash(body: str) -> str:
+    """Return the content address of a template body."""
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()[:32]
+
+
+def render(template: str, **params) -> TemplatedMessage:
+    """Render a template with named `str.format` parameters."""
+    text = template.format(**params) if params else template
+    return TemplatedMessage(text, template, params)
+
+
+def compact(message: str) -> Optional[Tuple[str, str, Dict[str, Any]]]:
+    """Return (hash, body, params) for a templated message, or None for free text."""
+    if isinstance(message, TemplatedMessage):
+        return message.template_hash, message.template, message.params
+    return None
+
+
+def expand_message(body: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """Rebuild the original text from a stored template body and its parameters."""
+    return body.format(**params) if params else body
@@ -5,6 +5,10 @@ class ChatRequest(BaseModel):
     user_id: Optional[str] = None
     message: str
     conversation_id: Optional[str] = None
+    client_message_id: Optional[str] = None  # dedupes client retries of the same message
+
+class ChatBatchRequest(BaseModel):
+    messages: List[ChatRequest] = Field(..., min_length=1)
 
 class ChatResponse(BaseModel):
     reply: str
@@ -38,6 +42,7 @@ class InternalBookHotelRequest(BaseModel):
     nights: int
     visitors: int
     payment_intent_id: Optional[str] = None
+    hold_id: Optional[str] = None  # inventory hold from the confirmation step
 
 class CreatePaymentIntentRequest(BaseModel):
     amount_inr: int = Field(..., gt=0)
@@ -47,7 +52,12 @@ class CreatePaymentIntentRequest(BaseModel):
 
 class GenerateInvoiceRequest(BaseModel):
     booking_id: str
-    gst_percent: float = 18.0
+    gst_percent: Optional[float] = None  # defaults to GST_PERCENT
+
+class InvoiceBatchRequest(BaseModel):
+    month: Optional[str] = None  # YYYY-MM, by check-in date
+    booking_ids: Optional[List[str]] = None
+    gst_percent: Optional[float] = None  # defaults to GST_PERCENT
 
 class AdminLoginRequest(BaseModel):
     username: str
@@ -0,0 +1,277 @@
+"""
+payments.py
+Payment intents, provider webhooks and batched reconciliation.
+
+An intent is stored in payment_intents when checkout starts and moves from `pending` to
+`succeeded`, `failed` or `cancelled` as provider events arrive (a failed payment may still be
+retried and succeed; succeeded and cancelled are final). When an intent succeeds, its booking
+is marked paid.
+
+The webhook does O(1) work per event: check the HMAC signature, drop event ids that were
+already applied, and queue the event. The reconciler drains the queue in batches off the request path:
+one lookup for every intent in the batch, one UPDATE per resulting status, one UPDATE marking
+the paid bookings and one bulk audit insert. Queued events are journaled before the webhook
+answers (see write_behind.py), and reconciling is idempotent: a replayed event finds its
+intent already in the target state and is skipped. Event ids are remembered only once their
+batch has been applied, so a redelivery of an event whose batch failed is queued again.
+
+Webhooks are refused until PAYMENT_WEBHOOK_SECRET is configured (a missing secret must not
+fall back to a guessable default). Events are checked for the fields reconciling needs before
+they are queued; one that is signed but malformed is rejected rather than failing its batch.
+
+While Supabase is unreachable, intents created before the outage exist only remotely. A batch
+referring to an intent the local fallback does not have fails instead of dropping the event as
+unknown, and the queue retries it until Supabase is back.
+
+Without a real provider, MockPaymentProvider stands in: its checkout page is served by this
+API and completing it posts a signed event to the same webhook pipeline. Anyone who knows a
+payment id could complete it that way, so those routes only exist with PAYMENT_MOCK_ENABLED
+set, for local development.
+"""
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+import db
+from event_bus import bus, booking_topic
+from log_pipeline import get_logger
+from write_behind import WriteBehindQueue
+
+log = get_logger("payments")
+
+PAYMENT_WEBHOOK_SECRET = os.getenv("PAYMENT_WEBHOOK_SECRET", "")
+PAYMENT_CHECKOUT_BASE = os.getenv("PAYMENT_CHECKOUT_BASE", "http://127.0.0.1:8000/payments/mock")
+PAYMENT_RECONCILE_MS = int(os.getenv("PAYMENT_RECONCILE_MS", "250"))
+PAYMENT_RECONCILE_BATCH = int(os.getenv("PAYMENT_RECONCILE_BATCH", "500"))
+PAYMENT_EVENTS_SPILL_PATH = os.getenv("PAYMENT_EVENTS_SPILL_PATH", "payment_events.spill.ndjson")
+PAYMENT_SEEN_EVENTS = int(os.getenv("PAYMENT_SEEN_EVENTS", "100000"))
+PAYMENT_MOCK_ENABLED = os.getenv("PAYMENT_MOCK_ENABLED", "false").lower() in ("1", "true", "yes")
+if not PAYMENT_WEBHOOK_SECRET:
+    if PAYMENT_MOCK_ENABLED:
+        # The mock provider signs its own events in this process; nothing else can
+        PAYMENT_WEBHOOK_SECRET = secrets.token_hex(32)
+        log.warning("PAYMENT_WEBHOOK_SECRET not set; only the mock checkout's events are accepted")
+    else:
+        log.warning("PAYMENT_WEBHOOK_SECRET not set; payment webhooks are refused")
+
+SIGNATURE_HEADER = "X-Payment-Signature"
+
+# Provider event type -> intent status
+EVENT_STATUS = {
+    "payment_intent.succeeded": "succeeded",
+    "payment_intent.payment_failed": "failed",
+    "payment_intent.canceled": "cancelled",
+}
+
+TRANSITIONS = {
+    "pending": {"succeeded", "failed", "cancelled"},
+    "failed": {"succeeded", "cancelled"},
+}
+
+AUDIT_ACTIONS = {"succeeded": "PAYMENT_SUCCEEDED", "failed": "PAYMENT_FAILED", "cancelled": "PAYMENT_CANCELLED"}
+
+
+def sign(body: bytes, secret: str = PAYMENT_WEBHOOK_SECRET) -> str:
+    return hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+
+def verify(body: bytes, signature: Optional[str], secret: str = PAYMENT_WEBHOOK_SECRET) -> bool:
+    return bool(secret) and bool(signature) and hmac.compare_digest(sign(body, secret), signature)
+
+
+def well_formed(event: Any) -> bool:
+    """Whether an event carries the fields reconcile() relies on, with usable types."""
+    if not isinstance(event, dict) or not isinstance(event.get("id"), str) or not event["id"]:
+        return False
+    data = event.get("data")
+    if not isinstance(data, dict) or not isinstance(data.get("payment_id"), str) or not data["payment_id"]:
+        return False
+    amount = data.get("amount_inr")
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)) or not float(amount).is_integer():
+        return False
+    created = event.get("created")
+    return created is None or (isinstance(created, (int, float)) and not isinstance(created, bool))
+
+
+def new_intent(amount_inr: int, currency: str = "INR", description: Optional[str] = None,
+               booking_id: Optional[str] = None) -> Dict[str, Any]:
+    now = datetime.now(timezone.utc).isoformat()
+    return {
+        "id": f"pi_{uuid4().hex[:12]}",
+        "booking_id": booking_id,
+        "amount_inr": amount_inr,
+        "currency": currency,
+        "description": description,
+        "status": "pending",
+        "client_secret": f"sk_{uuid4().hex[:20]}",
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+class MockPaymentProvider:
+    """Local stand-in for the payment provider's hosted checkout and event delivery."""
+
+    def __init__(self, checkout_base: str = PAYMENT_CHECKOUT_BASE, secret: str = PAYMENT_WEBHOOK_SECRET):
+        self.checkout_base = checkout_base.rstrip("/")
+        self.secret = secret
+
+    def checkout_url(self, payment_id: str) -> str:
+        return f"{self.checkout_base}/{payment_id}"
+
+    def event(self, intent: Dict[str, Any], outcome: str) -> Dict[str, Any]:
+        """A provider event for the intent; outcome is one of EVENT_STATUS's statuses."""
+        event_type = next(t for t, s in EVENT_STATUS.items() if s == outcome)
+        return {
+            "id": f"evt_{uuid4().hex[:16]}",
+            "type": event_type,
+            "created": time.time(),
+            "data": {"payment_id": intent["id"], "amount_inr": intent["amount_inr"], "currency": intent["currency"]},
+        }
+
+    def signed(self, event: Dict[str, Any]):
+        """(body, signature) exactly as the provider would deliver them."""
+        body = json.dumps(event).encode("utf-8")
+        return body, sign(body, self.secret)
+
+
+class SeenEvents:
+    """Bounded set of recently applied event ids (providers redeliver on timeouts)."""
+
+    def __init__(self, max_entries: int = PAYMENT_SEEN_EVENTS):
+        self.max_entries = max_entries
+        self._ids: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, event_id: str) -> bool:
+        with self._lock:
+            return event_id in self._ids
+
+    def add_many(self, event_ids: List[str]):
+        with self._lock:
+            for event_id in event_ids:
+                self._ids[event_id] = None
+            while len(self._ids) > self.max_entries:
+                self._ids.popitem(last=False)
+
+
+def reconcile(events: List[Dict[str, Any]], stats: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+    """Apply a batch of provider events to payment intents and bookings."""
+    stats = stats if stats is not None else {}
+    for k in ("events", "applied", "unknown", "mismatched", "ignored"):
+        stats.setdefault(k, 0)
+
+    malformed = [e for e in events if not well_formed(e)]
+    if malformed:
+        # Journaled before validation existed, or otherwise bad: retrying would never succeed
+        stats["ignored"] += len(malformed)
+        log.warning(f"Ignored {len(malformed)} malformed payment event(s)")
+        events = [e for e in events if well_formed(e)]
+    events = sorted(events, key=lambda e: e.get("created") or 0)
+    payment_ids = list({e["data"]["payment_id"] for e in events})
+    intents = {i["id"]: i for i in db.get_payment_intents(payment_ids)}
+    if len(intents) < len(payment_ids) and db.is_offline():
+        # The missing intents may exist only remotely; retry the batch once Supabase is back
+        raise RuntimeError(f"{len(payment_ids) - len(intents)} payment intent(s) not available offline")
+    stats["events"] += len(events)
+    # Replay the batch in memory; only each intent's final state is written
+    state = {pid: intent["status"] for pid, intent in intents.items()}
+    last_event = {}
+    for e in events:
+        pid = e["data"]["payment_id"]
+        intent = intents.get(pid)
+        if intent is None:
+            stats["unknown"] += 1
+            continue
+        if int(e["data"]["amount_inr"]) != int(intent["amount_inr"]):
+            stats["mismatched"] += 1
+            log.warning(f"Payment event {e['id']} amount does not match intent {pid}; ignored")
+            continue
+        status = EVENT_STATUS[e["type"]]
+        if status not in TRANSITIONS.get(state[pid], ()):
+            stats["ignored"] += 1
+            continue
+        state[pid] = status
+        last_event[pid] = e["id"]
+
+    changed = {pid: s for pid, s in state.items() if s != intents[pid]["status"]}
+    if not changed:
+        return stats
+    previous = {pid: intents[pid]["status"] for pid in changed}
+    now = datetime.now(timezone.utc).isoformat()
+    by_status = {}
+    for pid, status in changed.items():
+        by_status.setdefault(status, []).append(pid)
+    for status, pids in by_status.items():
+        db.update_payment_intents(pids, {"status": status, "updated_at": now})
+    paid = [intents[pid]["booking_id"] for pid in by_status.get("succeeded", []) if intents[pid].get("booking_id")]
+    if paid:
+        db.mark_bookings_paid(paid, now)
+    db.create_audit_logs([{
+        "action": AUDIT_ACTIONS[status],
+        "resource_type": "payment",
+        "resource_id": pid,
+        "details": {"booking_id": intents[pid].get("booking_id"), "amount_inr": intents[pid]["amount_inr"],
+                    "event_id": last_event[pid], "previous_status": previous[pid]},
+    } for pid, status in changed.items()])
+    stats["applied"] += len(changed)
+    # Live status for open chat connections following these bookings
+    for pid, status in changed.items():
+        booking_id = intents[pid].get("booking_id")
+        if booking_id:
+            bus.publish(booking_topic(booking_id), {"type": "payment_status", "booking_id": booking_id,
+                                                    "payment_id": pid, "status": status,
+                                                    "amount_inr": intents[pid]["amount_inr"]})
+    log.info(f"Reconciled {len(events)} payment event(s): {len(changed)} intent(s) updated, {len(paid)} booking(s) paid")
+    return stats
+
+
+class PaymentReconciler:
+    """Accepts verified webhook events and reconciles them in batches in the background."""
+
+    def __init__(self, flush_interval_ms: int = PAYMENT_RECONCILE_MS, max_batch: int = PAYMENT_RECONCILE_BATCH,
+                 spill_path: Optional[str] = PAYMENT_EVENTS_SPILL_PATH):
+        self.seen = SeenEvents()
+        self.stats = {}
+        self._queue = WriteBehindQueue(
+            self._reconcile,
+            name="payment-reconciler",
+            max_batch=max_batch,
+            flush_interval_ms=flush_interval_ms,
+            spill_path=spill_path or None,
+        )
+
+    def start(self):
+        self._queue.start()
+
+    def _reconcile(self, events: List[Dict[str, Any]]):
+        reconcile(events, self.stats)
+        self.seen.add_many([e["id"] for e in events if well_formed(e)])
+
+    def accept(self, event: Dict[str, Any]) -> bool:
+        """Queue an event for reconciliation. False for applied duplicates and unhandled event types."""
+        if event.get("type") not in EVENT_STATUS or event["id"] in self.seen:
+            return False
+        self._queue.submit(event)
+        return True
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        return self._queue.flush(timeout)
+
+    def close(self, timeout: float = 5.0):
+        self._queue.close(timeout)
+
+    def status(self) -> Dict[str, Any]:
+        return {"pending": self._queue.pending_count(), **self._queue.stats, **self.stats}
+
+
+provider = MockPaymentProvider()
+reconciler = PaymentReconciler()
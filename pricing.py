@@ -0,0 +1,171 @@
+"""
+pricing.py
+Single source of truth for room prices, GST and totals.
+
+All money is integer paise (₹1 = 100 paise), so sums and tax are exact; GST is rounded half
+up to the paise once per quote. `rupees()` converts back for JSON responses and display.
+
+`quote_many` prices many hotels x check-in dates x stay lengths in one call: the nightly rate
+of each (hotel, night) is computed once over the whole date range, and every stay is then a
+difference of two prefix sums, so each extra quote costs O(1).
+
+Optional date-based rate rules (weekend surcharges, festival rates, ...) are read from the
+JSON file in PRICING_RULES_PATH, a list of objects like
+    {"name": "weekend", "weekdays": [4, 5], "adjust_percent": 15}
+    {"name": "diwali", "start": "2025-10-18", "end": "2025-10-23", "hotel_ids": ["h1"], "adjust_percent": 30}
+`weekdays` uses Monday=0, `start`/`end` are inclusive, `hotel_ids` defaults to every hotel.
+Adjustments of all rules matching a night are added together.
+"""
+import json
+import os
+from datetime import date, datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+
+GST_PERCENT = Decimal(os.getenv("GST_PERCENT", "18"))
+PRICING_RULES_PATH = os.getenv("PRICING_RULES_PATH", "")
+
+
+def to_paise(amount) -> int:
+    """Rupees (int, float, str or Decimal) -> integer paise."""
+    return int((Decimal(str(amount)) * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+
+def rupees(paise: int) -> float:
+    return paise / 100
+
+
+def format_inr(paise: int) -> str:
+    """1234567 -> '12,345.67' (exact, no float rounding)."""
+    sign = "-" if paise < 0 else ""
+    whole, frac = divmod(abs(paise), 100)
+    return f"{sign}{whole:,}.{frac:02d}"
+
+
+def _percent_bp(percent) -> int:
+    """Percent -> basis points (18 -> 1800, 12.5 -> 1250)."""
+    return int((Decimal(str(percent)) * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+
+def _apply_bp(paise: int, bp: int) -> int:
+    """paise * bp / 10000, rounded half up."""
+    return (paise * bp + 5000) // 10000
+
+
+def gst_paise(subtotal_paise: int, gst_percent=GST_PERCENT) -> int:
+    return _apply_bp(subtotal_paise, _percent_bp(gst_percent))
+
+
+def totals(subtotal_paise: int, gst_percent=GST_PERCENT) -> Dict:
+    """Subtotal, GST and total (paise) for an already priced stay."""
+    gst = gst_paise(subtotal_paise, gst_percent)
+    return {"subtotal_paise": subtotal_paise, "gst_paise": gst, "total_paise": subtotal_paise + gst,
+            "gst_percent": float(gst_percent)}
+
+
+class RateRule:
+    def __init__(self, adjust_percent, name: str = "", start: Optional[str] = None, end: Optional[str] = None,
+                 weekdays: Optional[Iterable[int]] = None, hotel_ids: Optional[Iterable[str]] = None):
+        self.name = name
+        self.adjust_bp = _percent_bp(adjust_percent)
+        self.start = date.fromisoformat(start) if start else None
+        self.end = date.fromisoformat(end) if end else None
+        self.weekdays = set(weekdays) if weekdays is not None else None
+        self.hotel_ids = set(hotel_ids) if hotel_ids is not None else None
+
+    def applies(self, hotel_id: str, night: date) -> bool:
+        return ((self.hotel_ids is None or hotel_id in self.hotel_ids)
+                and (self.start is None or night >= self.start)
+                and (self.end is None or night <= self.end)
+                and (self.weekdays is None or night.weekday() in self.weekdays))
+
+
+def load_rate_rules(path: str = PRICING_RULES_PATH) -> List[RateRule]:
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [RateRule(**rule) for rule in json.load(f)]
+
+
+RATE_RULES: List[RateRule] = load_rate_rules()
+
+
+def _parse_date(d) -> date:
+    return d if isinstance(d, date) else datetime.strptime(d, "%Y-%m-%d").date()
+
+
+def nightly_rates(hotel: Dict, first_night: date, count: int, rules: Optional[List[RateRule]] = None) -> List[int]:
+    """Rate in paise for `count` consecutive nights starting at `first_night`."""
+    rules = RATE_RULES if rules is None else rules
+    base = to_paise(hotel["price_per_night"])
+    hotel_rules = [r for r in rules if r.hotel_ids is None or hotel["id"] in r.hotel_ids]
+    if not hotel_rules:
+        return [base] * count
+    rates = []
+    for i in range(count):
+        night = first_night + timedelta(days=i)
+        bp = sum(r.adjust_bp for r in hotel_rules if r.applies(hotel["id"], night))
+        rates.append(_apply_bp(base, 10000 + bp) if bp else base)
+    return rates
+
+
+def quote_many(hotels: List[Dict], checkin_dates: Iterable, nights: Iterable[int],
+               gst_percent=GST_PERCENT, rules: Optional[List[RateRule]] = None) -> List[Dict]:
+    """Quote every hotel x check-in date x number of nights.
+
+    Returns one dict per combination (hotel-major, then date, then nights) with the nightly
+    rates and subtotal/GST/total in paise.
+    """
+    dates = [_parse_date(d) for d in checkin_dates]
+    nights = list(nights)
+    if not hotels or not dates or not nights:
+        return []
+    if min(nights) < 1:
+        raise ValueError("Nights must be a positive integer")
+    first = min(dates)
+    span = (max(dates) - first).days + max(nights)
+    gst_bp = _percent_bp(gst_percent)
+    quotes = []
+    for hotel in hotels:
+        rates = nightly_rates(hotel, first, span, rules)
+        prefix = [0]
+        for rate in rates:
+            prefix.append(prefix[-1] + rate)
+        for d in dates:
+            offset = (d - first).days
+            for n in nights:
+                subtotal = prefix[offset + n] - prefix[offset]
+                gst = _apply_bp(subtotal, gst_bp)
+                quotes.append({
+                    "hotel_id": hotel["id"],
+                    "checkin_date": d.isoformat(),
+                    "nights": n,
+                    "nightly_paise": rates[offset:offset + n],
+                    "subtotal_paise": subtotal,
+                    "gst_paise": gst,
+                    "total_paise": subtotal + gst,
+                    "gst_percent": float(gst_percent),
+                })
+    return quotes
+
+
+def quote(hotel: Dict, nights: int, checkin_date=None, gst_percent=GST_PERCENT) -> Dict:
+    """Quote a single stay. Without a check-in date, date-based rules are not applied."""
+    if checkin_date is None:
+        return quote_many([hotel], [date.today()], [nights], gst_percent, rules=[])[0]
+    return quote_many([hotel], [checkin_date], [nights], gst_percent)[0]
+
+
+@lru_cache(maxsize=512)
+def _calendar(hotel_key: tuple, start: date, days: int, nights: int) -> tuple:
+    hotel = dict(hotel_key)
+    dates = [start + timedelta(days=i) for i in range(days)]
+    return tuple(quote_many([hotel], dates, [nights]))
+
+
+def price_calendar(hotel: Dict, days: int = 30, nights: int = 1, start: Optional[date] = None) -> List[Dict]:
+    """Quotes for checking in on each of the next `days` days, starting tomorrow (check-in
+    must be in the future). Cached per hotel, start day and arguments."""
+    key = (("id", hotel["id"]), ("price_per_night", hotel["price_per_night"]))
+    return list(_calendar(key, start or date.today() + timedelta(days=1), days, nights))
@@ -0,0 +1,212 @@
+"""
+rate_limit.py
+Per-client, per-route request rate limiting.
+
+Limits use a sliding-window counter: each key keeps the request count of the current and the
+previous fixed window, and the rate is estimated as
+    previous * (share of the previous window still inside the sliding window) + current
+so every check is O(1) time and memory per key, with no per-request timestamps.
+
+Routes are matched by longest path prefix against RATE_LIMIT_ROUTES ("/chat=60,/hotels=600",
+requests per minute; 0 disables limiting for the prefix); everything else gets
+RATE_LIMIT_PER_MINUTE. Each route prefix has its own counter per client IP.
+
+Counters live in process memory by default, and keys idle for two windows are evicted. With
+several API workers, set RATE_LIMIT_DB_PATH to keep the counters in a SQLite file that all
+workers on the host share, so a limit holds across them. SQLite checks may wait on the file
+lock of another worker, so the middleware runs them in the threadpool instead of on the event
+loop.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+RATE_LIMIT_PER_MINUTE = int(os.getenv("RATE_LIMIT_PER_MINUTE", "100"))
+RATE_LIMIT_ROUTES = os.getenv("RATE_LIMIT_ROUTES", "/chat=60,/hotels=600,/webhooks/=0")
+RATE_LIMIT_DB_PATH = os.getenv("RATE_LIMIT_DB_PATH", "")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+
+def parse_routes(spec: str) -> Dict[str, int]:
+    """"/chat=60,/hotels=600" -> {"/chat": 60, "/hotels": 600}."""
+    routes = {}
+    for item in spec.split(","):
+        if item.strip():
+            prefix, _, limit = item.partition("=")
+            routes[prefix.strip()] = int(limit)
+    return routes
+
+
+def estimate(prev: int, cur: int, elapsed: float, window: float) -> float:
+    """Requests in the sliding window ending `elapsed` seconds into the current window."""
+    return prev * (1 - elapsed / window) + cur
+
+
+def retry_after(prev: int, cur: int, elapsed: float, window: float, limit: int) -> int:
+    """Whole seconds until one more request fits under `limit`."""
+    if cur + 1 > limit or not prev:
+        return max(1, math.ceil(window - elapsed))
+    # Solve prev * (1 - t / window) + cur + 1 <= limit for t
+    t = window * (1 - (limit - cur - 1) / prev)
+    return max(1, math.ceil(t - elapsed))
+
+
+class MemoryCounterStore:
+    """Sliding-window counters for one process, evicting keys idle for two windows."""
+
+    blocking = False
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._counters: "OrderedDict[str, list]" = OrderedDict()  # key -> [window, cur, prev, last_seen], LRU order
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._counters)
+
+    def hit(self, key: str, limit: int, window: float, now: float) -> Tuple[bool, int]:
+        """Count a request if it fits. Returns (allowed, retry_after_seconds)."""
+        idx, elapsed = divmod(now, window)
+        with self._lock:
+            self._evict(now, window)
+            c = self._counters.get(key)
+            if c is None:
+                c = self._counters[key] = [idx, 0, 0, now]
+            else:
+                self._counters.move_to_end(key)
+                if c[0] != idx:
+                    c[2] = c[1] if idx - c[0] == 1 else 0
+                    c[0], c[1] = idx, 0
+            c[3] = now
+            if estimate(c[2], c[1], elapsed, window) + 1 > limit:
+                return False, retry_after(c[2], c[1], elapsed, window, limit)
+            c[1] += 1
+            return True, 0
+
+    def _evict(self, now: float, window: float):
+        counters = self._counters
+        while counters:
+            key, c = next(iter(counters.items()))
+            if now - c[3] < 2 * window and len(counters) < self.max_keys:
+                break
+            del counters[key]
+
+
+class SQLiteCounterStore:
+    """Sliding-window counters in a SQLite file shared by every worker on the host."""
+
+    EVICT_EVERY = 1000
+    blocking = True  # hit() may wait up to busy_timeout for other workers
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._hits = 0
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS rate_limits ("
+            "key TEXT PRIMARY KEY, window INTEGER NOT NULL, cur INTEGER NOT NULL, "
+            "prev INTEGER NOT NULL, last_seen REAL NOT NULL)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def hit(self, key: str, limit: int, window: float, now: float) -> Tuple[bool, int]:
+        idx, elapsed = divmod(now, window)
+        idx = int(idx)
+        conn = self._connection()
+        # BEGIN IMMEDIATE: read-modify-write of the counter is atomic across processes
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT window, cur, prev FROM rate_limits WHERE key = ?", (key,)).fetchone()
+            stored, cur, prev = row if row else (idx, 0, 0)
+            if stored != idx:
+                prev = cur if idx - stored == 1 else 0
+                cur = 0
+            allowed = estimate(prev, cur, elapsed, window) + 1 <= limit
+            if allowed:
+                cur += 1
+            conn.execute(
+                "INSERT INTO rate_limits (key, window, cur, prev, last_seen) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET window = excluded.window, cur = excluded.cur, "
+                "prev = excluded.prev, last_seen = excluded.last_seen",
+                (key, idx, cur, prev, now)
+            )
+            self._hits += 1
+            if self._hits % self.EVICT_EVERY == 0:
+                conn.execute("DELETE FROM rate_limits WHERE last_seen < ?", (now - 2 * window,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, 0 if allowed else retry_after(prev, cur, elapsed, window, limit)
+
+
+class RateLimiter:
+    def __init__(self, default_limit: int = RATE_LIMIT_PER_MINUTE, routes: Optional[Dict[str, int]] = None,
+                 window_seconds: float = 60.0, store=None, clock=time.time):
+        self.default_limit = default_limit
+        self.window = window_seconds
+        self.store = store if store is not None else MemoryCounterStore()
+        self._clock = clock
+        # Longest prefix first, so "/chat/batch" can override "/chat"
+        self._routes: List[Tuple[str, int]] = sorted((routes or {}).items(), key=lambda r: len(r[0]), reverse=True)
+
+    def route_limit(self, path: str) -> Tuple[str, int]:
+        for prefix, limit in self._routes:
+            if path.startswith(prefix):
+                return prefix, limit
+        return "*", self.default_limit
+
+    def check(self, client: str, path: str) -> Tuple[bool, int, int]:
+        """Count a request. Returns (allowed, limit, retry_after_seconds); limit 0 means unlimited."""
+        prefix, limit = self.route_limit(path)
+        if limit <= 0:
+            return True, 0, 0
+        allowed, retry = self.store.hit(f"{prefix}|{client}", limit, self.window, self._clock())
+        return allowed, limit, retry
+
+    async def acheck(self, client: str, path: str) -> Tuple[bool, int, int]:
+        """check() for async callers; stores that may block run in the threadpool."""
+        if getattr(self.store, "blocking", False):
+            return await run_in_threadpool(self.check, client, path)
+        return self.check(client, path)
+
+
+class RateLimitMiddleware:
+    def __init__(self, limiter: RateLimiter, logger=None):
+        self.limiter = limiter
+        self.logger = logger
+
+    async def __call__(self, request: Request, call_next):
+        client_ip = request.client.host if request.client else "unknown"
+        allowed, limit, retry = await self.limiter.acheck(client_ip, request.url.path)
+        if not allowed:
+            if self.logger:
+                self.logger.warning(f"Rate limit exceeded for IP: {client_ip} on {request.url.path}")
+            return JSONResponse(
+                status_code=429,
+                content={"detail": "Too many requests. Please try again later."},
+                headers={"Retry-After": str(retry), "X-RateLimit-Limit": str(limit)}
+            )
+        return await call_next(request)
+
+
+def limiter_from_env() -> RateLimiter:
+    store = SQLiteCounterStore(RATE_LIMIT_DB_PATH) if RATE_LIMIT_DB_PATH else MemoryCounterStore()
+    return RateLimiter(RATE_LIMIT_PER_MINUTE, parse_routes(RATE_LIMIT_ROUTES), store=store)
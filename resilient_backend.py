@@ -0,0 +1,330 @@
+"""
+resilient_backend.py
+Remote-first supabase client that keeps working through Supabase outages.
+
+While the remote DB is reachable every query goes to it. When a query fails with a
+connectivity error the client switches to the local SQLite store: reads are served locally
+and writes are applied locally and recorded in a local outbox (the written rows, or for an
+update its filters and changes, since the rows it targets may exist only remotely; it is
+replayed as the same update after the table's rows). A background thread keeps
+probing the remote; once it answers, the outbox is replayed in batched, idempotent upserts
+(rows carry their ids) with bounded concurrency, and the client switches back to remote only
+when the outbox is empty. Requests never wait on a dead endpoint after the first failure.
+"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from local_rpc import RPC_RESULT_TABLES
+from log_pipeline import get_logger
+
+log = get_logger("resilient_backend")
+
+try:
+    import httpx
+    _TRANSPORT_ERRORS = (httpx.TransportError, OSError, TimeoutError)
+except Exception:
+    _TRANSPORT_ERRORS = (OSError, TimeoutError)
+
+# Replay order respects foreign keys: users before the rows that reference them
+SYNC_TABLE_ORDER = ["users", "message_templates", "bookings", "invoices", "payment_intents", "conversations", "audit_logs"]
+
+# Builder methods ResilientTable records and replays on the chosen backend
+QUERY_METHODS = {"select", "eq", "in_", "gt", "gte", "lt", "lte", "order", "limit", "insert", "upsert", "update", "delete"}
+
+# Outbox entries with this on_conflict hold an offline update (its filters and changes), not a row
+UPDATE_ENTRY = "update"
+FILTER_METHODS = {"eq", "in_", "gt", "gte", "lt", "lte"}
+
+
+def _as_utc(dt: datetime) -> datetime:
+    # Outbox rows written before timestamps were UTC-aware are naive local time
+    return dt if dt.tzinfo else dt.astimezone(timezone.utc)
+
+
+def is_outage_error(e: Exception) -> bool:
+    """True for errors that mean the remote could not be reached (not bad queries)."""
+    if isinstance(e, _TRANSPORT_ERRORS):
+        return True
+    # Gateways answer 502/503/504 with HTML, which the client fails to decode as JSON
+    return isinstance(e, json.JSONDecodeError)
+
+
+class ResilientTable:
+    """Records the builder calls and replays them on the remote or local table at execute()."""
+
+    def __init__(self, client: "ResilientSupabase", name: str):
+        self._client = client
+        self._name = name
+        self._calls = []
+        self._write = None  # ("insert"|"upsert"|"update"|"delete", on_conflict)
+
+    def __getattr__(self, method):
+        if method not in QUERY_METHODS:
+            raise AttributeError(method)
+
+        def record(*args, **kwargs):
+            self._calls.append((method, args, kwargs))
+            if method == "insert":
+                self._write = ("insert", "id")
+            elif method == "upsert":
+                self._write = ("upsert", kwargs.get("on_conflict") or (args[1] if len(args) > 1 else "id"))
+            elif method == "update":
+                # Queued as the update itself (filters + changes): the matching rows may exist
+                # only remotely, so the local result cannot stand in for them
+                self._write = ("update", UPDATE_ENTRY)
+            elif method == "delete":
+                self._write = ("delete", None)
+            return self
+        return record
+
+    def _apply(self, backend):
+        query = backend.table(self._name)
+        for method, args, kwargs in self._calls:
+            query = getattr(query, method)(*args, **kwargs)
+        return query
+
+    def execute(self):
+        return self._client._execute(self)
+
+
+class ResilientRPC:
+    def __init__(self, client: "ResilientSupabase", fn: str, params):
+        self._client = client
+        self._fn = fn
+        self._params = params or {}
+
+    def execute(self):
+        return self._client._execute_rpc(self._fn, self._params)
+
+
+class ResilientSupabase:
+    def __init__(self, remote, local, probe_interval: float = 10.0, batch_size: int = 200,
+                 concurrency: int = 4, online: bool = True,
+                 replay_writers: Optional[Dict[str, Callable]] = None):
+        """`replay_writers` maps a table to fn(rows, client) used instead of a plain upsert
+        during replay (e.g. conversations, which may need placeholder users first)."""
+        self.remote = remote
+        self.local = local
+        self.probe_interval = probe_interval
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.replay_writers = replay_writers or {}
+        self.online = online
+        self._lock = threading.RLock()
+        self._probe_thread = None
+        self._stats = {"replayed_rows": 0, "last_sync_at": None, "last_error": None, "syncing": False}
+        self._init_outbox()
+        if not online or self.pending_count():
+            self.online = False
+            self._start_probe()
+
+    def table(self, name):
+        return ResilientTable(self, name)
+
+    def rpc(self, fn, params=None):
+        return ResilientRPC(self, fn, params)
+
+    # -- routing ---------------------------------------------------------------------
+
+    def _execute(self, query: ResilientTable):
+        if self.online:
+            try:
+                return query._apply(self.remote).execute()
+            except Exception as e:
+                if not is_outage_error(e):
+                    raise
+                log.warning(f"Supabase unreachable, switching to local storage: {e}")
+                self._go_offline()
+        return self._execute_local(query)
+
+    def _execute_local(self, query: ResilientTable):
+        if not query._write:
+            return query._apply(self.local).execute()
+        with self._lock:
+            if self.online:
+                # Came back online while we waited for the lock
+                return query._apply(self.remote).execute()
+            if query._write[0] == "delete":
+                # The outbox replays rows as upserts; a delete cannot be queued that way
+                raise RuntimeError(f"Cannot delete from '{query._name}' while Supabase is unreachable")
+            with self.local.transaction() as conn:
+                r = query._apply(self.local).execute()
+                op, on_conflict = query._write
+                now = datetime.now(timezone.utc).isoformat()
+                if op == "update":
+                    calls = [[m, list(args), kwargs] for m, args, kwargs in query._calls
+                             if m == "update" or m in FILTER_METHODS]
+                    entries = [json.dumps(calls, default=str)]
+                else:
+                    entries = [json.dumps(row, default=str) for row in r.data]
+                conn.executemany(
+                    "INSERT INTO sync_outbox (table_name, on_conflict, row, created_at) VALUES (?, ?, ?, ?)",
+                    [(query._name, on_conflict, entry, now) for entry in entries]
+                )
+            return r
+
+    def _execute_rpc(self, fn: str, params):
+        if self.online:
+            try:
+                return self.remote.rpc(fn, params).execute()
+            except Exception as e:
+                if not is_outage_error(e):
+                    raise
+                log.warning(f"Supabase unreachable, switching to local storage: {e}")
+                self._go_offline()
+        with self._lock:
+            if self.online:
+                return self.remote.rpc(fn, params).execute()
+            with self.local.transaction() as conn:
+                r = self.local.rpc(fn, params).execute()
+                now = datetime.now(timezone.utc).isoformat()
+                conn.executemany(
+                    "INSERT INTO sync_outbox (table_name, on_conflict, row, created_at) VALUES (?, ?, ?, ?)",
+                    [(table, "id", json.dumps(r.data[key], default=str), now)
+                     for key, table in RPC_RESULT_TABLES.get(fn, {}).items() if r.data.get(key)]
+                )
+            return r
+
+    def _go_offline(self):
+        with self._lock:
+            self.online = False
+        self._start_probe()
+
+    # -- outbox ----------------------------------------------------------------------
+
+    def _init_outbox(self):
+        conn = self.local.connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sync_outbox ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT, table_name TEXT NOT NULL, on_conflict TEXT NOT NULL,"
+            " row TEXT NOT NULL, created_at TEXT NOT NULL)"
+        )
+        # Offline-created users that turned out to exist remotely (same phone) -> remote id
+        conn.execute("CREATE TABLE IF NOT EXISTS sync_user_remap (local_id TEXT PRIMARY KEY, remote_id TEXT NOT NULL)")
+
+    def pending_count(self) -> int:
+        return self.local.connection().execute("SELECT COUNT(*) FROM sync_outbox").fetchone()[0]
+
+    def sync_status(self) -> Dict:
+        """Progress/lag metrics for the offline outbox."""
+        conn = self.local.connection()
+        pending, oldest = conn.execute("SELECT COUNT(*), MIN(created_at) FROM sync_outbox").fetchone()
+        lag = (datetime.now(timezone.utc) - _as_utc(datetime.fromisoformat(oldest))).total_seconds() if oldest else 0.0
+        replayed = self._stats["replayed_rows"]
+        return {
+            "online": self.online,
+            "syncing": self._stats["syncing"],
+            "pending_rows": pending,
+            "replayed_rows": replayed,
+            "progress": round(replayed / (replayed + pending), 4) if (replayed + pending) else 1.0,
+            "lag_seconds": round(lag, 3),
+            "last_sync_at": self._stats["last_sync_at"],
+            "last_error": self._stats["last_error"],
+        }
+
+    # -- probing and replay ------------------------------------------------------------
+
+    def _start_probe(self):
+        with self._lock:
+            if self._probe_thread and self._probe_thread.is_alive():
+                return
+            self._probe_thread = threading.Thread(target=self._probe_loop, name="supabase-probe", daemon=True)
+            self._probe_thread.start()
+
+    def _probe_loop(self):
+        while not self.online:
+            time.sleep(self.probe_interval)
+            try:
+                self.remote.table("users").select("id").limit(1).execute()
+                self.replay()
+                with self._lock:
+                    if not self.pending_count():
+                        self.online = True
+                        log.info("Supabase reachable again; outbox replayed, using remote DB")
+                        return
+            except Exception as e:
+                self._stats["last_error"] = str(e)
+
+    def _remap_users(self, rows: List[Dict]) -> Dict[str, str]:
+        """Users created offline may already exist remotely under another id (same phone).
+        Records local_id -> remote_id for those so referencing rows can be rewritten."""
+        phones = [r["phone"] for r in rows if r.get("phone")]
+        remap = {}
+        for i in range(0, len(phones), self.batch_size):
+            chunk = phones[i:i + self.batch_size]
+            existing = self.remote.table("users").select("id, phone").in_("phone", chunk).execute().data
+            by_phone = {r["phone"]: r["id"] for r in existing}
+            for row in rows:
+                remote_id = by_phone.get(row.get("phone"))
+                if remote_id and remote_id != row["id"]:
+                    remap[row["id"]] = remote_id
+        if remap:
+            self.local.connection().executemany(
+                "INSERT OR REPLACE INTO sync_user_remap (local_id, remote_id) VALUES (?, ?)", list(remap.items())
+            )
+        return remap
+
+    def replay(self):
+        """Replay the outbox to the remote in batches; safe to rerun (upserts by key)."""
+        conn = self.local.connection()
+        self._stats["syncing"] = True
+        try:
+            remap = dict(conn.execute("SELECT local_id, remote_id FROM sync_user_remap").fetchall())
+            groups = conn.execute("SELECT DISTINCT table_name, on_conflict FROM sync_outbox").fetchall()
+            # A table's queued updates run after its queued rows, which they may target
+            order = lambda g: (SYNC_TABLE_ORDER.index(g[0]) if g[0] in SYNC_TABLE_ORDER else len(SYNC_TABLE_ORDER),
+                               g[1] == UPDATE_ENTRY)
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="sync") as pool:
+                for table, on_conflict in sorted(groups, key=order):
+                    while True:
+                        entries = conn.execute(
+                            "SELECT seq, row FROM sync_outbox WHERE table_name = ? AND on_conflict = ? ORDER BY seq LIMIT ?",
+                            (table, on_conflict, self.batch_size * self.concurrency)
+                        ).fetchall()
+                        if not entries:
+                            break
+                        if on_conflict == UPDATE_ENTRY:
+                            # In order, one request each (filters differ)
+                            for entry in entries:
+                                self._update_remote(table, json.loads(entry[1]))
+                                conn.execute("DELETE FROM sync_outbox WHERE seq = ?", (entry[0],))
+                                self._stats["replayed_rows"] += 1
+                            continue
+                        rows = [json.loads(e[1]) for e in entries]
+                        if table == "users":
+                            remap.update(self._remap_users(rows))
+                            rows = [r for r in rows if r["id"] not in remap]
+                        elif remap:
+                            for r in rows:
+                                if r.get("user_id") in remap:
+                                    r["user_id"] = remap[r["user_id"]]
+                        batches = [rows[i:i + self.batch_size] for i in range(0, len(rows), self.batch_size)]
+                        # Bounded concurrency: at most `concurrency` batches in flight per round
+                        list(pool.map(lambda b: self._upsert_remote(table, b, on_conflict), batches))
+                        conn.execute(
+                            "DELETE FROM sync_outbox WHERE seq <= ? AND table_name = ? AND on_conflict = ?",
+                            (entries[-1][0], table, on_conflict)
+                        )
+                        self._stats["replayed_rows"] += len(entries)
+            self._stats["last_sync_at"] = datetime.now(timezone.utc).isoformat()
+            self._stats["last_error"] = None
+        finally:
+            self._stats["syncing"] = False
+
+    def _update_remote(self, table: str, calls: List):
+        query = self.remote.table(table)
+        for method, args, kwargs in calls:
+            query = getattr(query, method)(*args, **kwargs)
+        return query.execute()
+
+    def _upsert_remote(self, table: str, rows: List[Dict], on_conflict: str):
+        if not rows:
+            return
+        writer = self.replay_writers.get(table)
+        if writer:
+            return writer(rows, self.remote)
+        return self.remote.table(table).upsert(rows, on_conflict=on_conflict).execute()
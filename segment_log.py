@@ -0,0 +1,326 @@
+"""
+segment_log.py
+Local append-only segment log with a background shipper.
+
+`append()` writes one JSON line to the active segment file and returns; it never waits on
+the disk or the database. A sync thread flushes and fsyncs the active segment every
+`fsync_ms` (group commit), so an acknowledged record is on disk within that window. Segments
+roll over at `segment_bytes` and every start opens a fresh one, so a line torn by a crash is
+only ever at the end of an old segment (it is skipped).
+
+The shipper reads records after its checkpoint (segment number + byte offset, persisted
+atomically in `checkpoint.json`), hands them to `ship_fn` in batches of up to `max_batch`, and
+advances the checkpoint only after the batch was accepted; failures are retried with
+exponential backoff. Shipped segments are deleted. After a crash, records after the last
+checkpoint are shipped again, so `ship_fn` must be idempotent (records carry their own ids).
+
+Several processes (e.g. uvicorn workers) may share one directory: each claims its own
+`worker-N` subdirectory by holding an exclusive lock on its `lock` file, and keeps it until
+it stops. The lock is released when a process dies, so a directory left behind by a dead
+worker is either claimed again by the next one to start or, if nobody does, adopted by a
+running worker's shipper, which ships what is left in it.
+"""
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from log_pipeline import get_logger, dumps
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+log = get_logger("segment_log")
+
+ADOPT_INTERVAL_SECONDS = 60.0
+
+
+def _try_lock(path: str):
+    """Exclusive, non-blocking lock on `path`; the open lock file, or None if another process holds it."""
+    f = open(path, "a+")
+    try:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+class SegmentLog:
+    def __init__(self, directory: str, ship_fn: Callable[[List[Dict[str, Any]]], Any], name: str = "segment_log",
+                 segment_bytes: int = 8 * 1024 * 1024, fsync_ms: int = 50, max_batch: int = 500,
+                 ship_interval_ms: int = 500, max_backoff: float = 30.0):
+        self.root = directory
+        self.directory: Optional[str] = None  # this process's worker-N subdirectory, claimed on start
+        self._ship_fn = ship_fn
+        self.name = name
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_ms / 1000.0
+        self.max_batch = max_batch
+        self.ship_interval = ship_interval_ms / 1000.0
+        self.max_backoff = max_backoff
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._segment = 0      # number of the active segment
+        self._size = 0         # bytes appended to the active segment
+        self._dirty = False
+        self._checkpoint: Tuple[int, int] = (0, 0)
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._dir_lock = None
+        self._next_adopt = 0.0
+        self.stats = {"appended": 0, "shipped": 0, "failed_ships": 0, "skipped_lines": 0, "adopted": 0}
+
+    # ---- writer ----
+
+    def start(self):
+        if self._threads:
+            return
+        self.directory = self._claim_directory()
+        self._checkpoint = self._load_checkpoint()
+        segments = self._segments()
+        self._segment = max(segments[-1] if segments else 0, self._checkpoint[0]) + 1
+        self._open_segment()
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._sync_loop, name=f"{self.name}-sync", daemon=True),
+            threading.Thread(target=self._ship_loop, name=f"{self.name}-ship", daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+
+    def append(self, record: Dict[str, Any]):
+        """Append one record; returns without waiting for disk or database."""
+        line = dumps(record) + "\n"
+        with self._lock:
+            if self._file is None:
+                raise RuntimeError(f"{self.name} is not running")
+            self._file.write(line)
+            self._size += len(line.encode("utf-8"))
+            self._dirty = True
+            self.stats["appended"] += 1
+            if self._size >= self.segment_bytes:
+                self._roll()
+
+    def append_many(self, records: List[Dict[str, Any]]):
+        for record in records:
+            self.append(record)
+
+    def _claim_directory(self) -> str:
+        """The first worker-N subdirectory no other process holds (locked until close())."""
+        n = 0
+        while True:
+            path = os.path.join(self.root, f"worker-{n}")
+            os.makedirs(path, exist_ok=True)
+            self._dir_lock = _try_lock(os.path.join(path, "lock"))
+            if self._dir_lock:
+                return path
+            n += 1
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{segment:010d}.log")
+
+    def _segments(self) -> List[int]:
+        return sorted(int(f[:-4]) for f in os.listdir(self.directory) if f.endswith(".log") and f[:-4].isdigit())
+
+    def _open_segment(self):
+        self._file = open(self._path(self._segment), "a", encoding="utf-8")
+        self._size = self._file.tell()
+
+    def _roll(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._segment += 1
+        self._open_segment()
+        self._dirty = False
+
+    def _sync(self):
+        with self._lock:
+            if not self._dirty or self._file is None:
+                return
+            self._file.flush()
+            fd = os.dup(self._file.fileno())
+            self._dirty = False
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self._wake.set()
+
+    def _sync_loop(self):
+        while not self._stop.wait(self.fsync_interval):
+            try:
+                self._sync()
+            except Exception as e:
+                log.warning(f"{self.name}: fsync failed: {e}")
+
+    # ---- shipper ----
+
+    def _checkpoint_path(self) -> str:
+        return os.path.join(self.directory, "checkpoint.json")
+
+    def _load_checkpoint(self) -> Tuple[int, int]:
+        try:
+            with open(self._checkpoint_path(), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return int(data["segment"]), int(data["offset"])
+        except FileNotFoundError:
+            return 0, 0
+
+    def _save_checkpoint(self, checkpoint: Tuple[int, int]):
+        tmp = self._checkpoint_path() + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"segment": checkpoint[0], "offset": checkpoint[1]}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._checkpoint_path())
+        self._checkpoint = checkpoint
+
+    def _read_batch(self) -> Tuple[List[Dict[str, Any]], Tuple[int, int]]:
+        """Records after the checkpoint (complete lines only) and the position after them."""
+        segment, offset = self._checkpoint
+        with self._lock:
+            active = self._segment
+        for seg in self._segments():
+            if seg < segment:
+                continue
+            if seg > segment:
+                # Moving to a later segment: the previous one has been fully read
+                segment, offset = seg, 0
+            records = []
+            with open(self._path(seg), "rb") as f:
+                f.seek(offset)
+                while len(records) < self.max_batch:
+                    line = f.readline()
+                    if not line.endswith(b"\n"):
+                        if line and seg != active:
+                            # Torn write from a crash at the end of an old segment
+                            self.stats["skipped_lines"] += 1
+                            log.warning(f"{self.name}: skipping incomplete record at end of segment {seg}")
+                            offset += len(line)
+                        break
+                    offset += len(line)
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        self.stats["skipped_lines"] += 1
+                        log.warning(f"{self.name}: skipping unreadable record in segment {seg}")
+            if records or seg == active:
+                return records, (segment, offset)
+            # Old segment fully shipped: move the checkpoint past it
+            self._advance((seg + 1, 0))
+            segment, offset = self._checkpoint
+        return [], self._checkpoint
+
+    def _advance(self, position: Tuple[int, int]):
+        """Persist the checkpoint and delete the segments before it."""
+        self._save_checkpoint(position)
+        for seg in self._segments():
+            if seg < self._checkpoint[0]:
+                try:
+                    os.remove(self._path(seg))
+                except OSError:
+                    pass
+
+    def _ship_once(self) -> int:
+        records, position = self._read_batch()
+        if records:
+            self._ship_fn(records)
+            self.stats["shipped"] += len(records)
+        if position != self._checkpoint:
+            self._advance(position)
+        return len(records)
+
+    def _adopt_orphans(self):
+        """Ship what is left in directories of workers that are gone, then release them."""
+        self._next_adopt = time.monotonic() + ADOPT_INTERVAL_SECONDS
+        for name in sorted(os.listdir(self.root)):
+            path = os.path.join(self.root, name)
+            if not name.startswith("worker-") or path == self.directory or not os.path.isdir(path):
+                continue
+            if not any(f.endswith(".log") for f in os.listdir(path)):
+                continue
+            lock = _try_lock(os.path.join(path, "lock"))
+            if lock is None:
+                continue  # a live worker owns it
+            try:
+                orphan = SegmentLog(self.root, self._ship_fn, name=f"{self.name}-{name}", max_batch=self.max_batch)
+                orphan.directory = path
+                orphan._checkpoint = orphan._load_checkpoint()
+                segments = orphan._segments()
+                orphan._segment = (segments[-1] if segments else 0) + 1  # no active segment: all are complete
+                while orphan._ship_once():
+                    pass
+                self.stats["adopted"] += orphan.stats["shipped"]
+                log.info(f"{self.name}: shipped {orphan.stats['shipped']} record(s) left in {path}")
+            finally:
+                lock.close()
+
+    def _ship_loop(self):
+        backoff = self.ship_interval
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() >= self._next_adopt:
+                    self._adopt_orphans()
+                shipped = self._ship_once()
+                backoff = self.ship_interval
+            except Exception as e:
+                self.stats["failed_ships"] += 1
+                log.warning(f"{self.name}: shipping failed, retrying in {backoff:.1f}s: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            if shipped < self.max_batch:
+                self._wake.wait(self.ship_interval)
+                self._wake.clear()
+
+    def backlog(self) -> int:
+        """Bytes appended but not yet shipped (approximate)."""
+        with self._lock:
+            active, size = self._segment, self._size
+        segment, offset = self._checkpoint
+        total = 0
+        for seg in self._segments():
+            if seg >= segment:
+                total += (size if seg == active else os.path.getsize(self._path(seg))) - (offset if seg == segment else 0)
+        return total
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Sync to disk and wait until everything appended so far has been shipped."""
+        self._sync()
+        deadline = time.monotonic() + timeout
+        while self.backlog() > 0:
+            if time.monotonic() > deadline:
+                return False
+            self._wake.set()
+            time.sleep(0.01)
+        return True
+
+    def close(self, timeout: float = 5.0):
+        """Ship what is left (best effort) and stop; unshipped records stay on disk."""
+        if not self._threads:
+            return
+        self.flush(timeout)
+        self._stop.set()
+        self._wake.set()
+        for t in self._threads:
+            t.join(timeout)
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+        self._threads = []
+        self._dir_lock.close()
+        self._dir_lock = None
@@ -0,0 +1,450 @@
+"""
+sqlite_backend.py
+Durable local backend implementing the subset of the supabase table API used by this app:
+table().select().eq().in_().gt()/gte()/lt()/lte().order().limit().insert().upsert().update().delete().execute()
+
+Used by db.py when Supabase is not configured or unreachable, instead of the in-memory
+FakeSupabase. The schema is applied from supabase_tables.sql (translated to SQLite, including
+its indexes); conversations get an FTS5 full-text index maintained by triggers. Connections are per thread, in WAL mode with a busy timeout, so concurrent
+writers queue on the database lock instead of failing; statements are parameterised and
+served from sqlite3's prepared statement cache.
+"""
+import json
+import pathlib
+import re
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from uuid import uuid4
+
+from local_rpc import LocalRPC
+from log_pipeline import get_logger
+from text_search import conversation_text, fts5_query, query_tokens, tokenize
+
+log = get_logger("sqlite_backend")
+
+SQL_FILE = pathlib.Path(__file__).parent / 'supabase_tables.sql'
+
+
+class SQLiteResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+def split_sql_statements(sql: str) -> List[str]:
+    """Split a SQL script on ';', ignoring comments and semicolons inside $$-quoted bodies."""
+    sql = re.sub(r"--[^\n]*", "", sql)
+    statements, current, in_dollar = [], [], False
+    for part in re.split(r"(\$\$|;)", sql):
+        if part == "$$":
+            in_dollar = not in_dollar
+            current.append(part)
+        elif part == ";" and not in_dollar:
+            stmt = "".join(current).strip()
+            if stmt:
+                statements.append(stmt)
+            current = []
+        else:
+            current.append(part)
+    stmt = "".join(current).strip()
+    if stmt:
+        statements.append(stmt)
+    return statements
+
+
+def _translate_types(stmt: str) -> str:
+    stmt = re.sub(r"\bpublic\.", "", stmt)
+    stmt = re.sub(r"\s+DEFAULT\s+gen_random_uuid\(\)", "", stmt, flags=re.I)
+    stmt = re.sub(r"'([^']*)'::jsonb", r"'\1'", stmt)
+    # Same text format as datetime.now(timezone.utc).isoformat(), so timestamps sort correctly
+    stmt = re.sub(r"\bDEFAULT\s+now\(\)", "DEFAULT (strftime('%Y-%m-%dT%H:%M:%f000+00:00', 'now'))", stmt, flags=re.I)
+    stmt = re.sub(r"\b(uuid|timestamptz|jsonb)\b", lambda m: "JSON" if m.group(1).lower() == "jsonb" else "TEXT", stmt, flags=re.I)
+    return stmt
+
+
+def translate_schema(sql: str):
+    """Translate the Postgres schema into SQLite statements.
+
+    Returns (create_statements, added_columns, json_columns) where added_columns is a list of
+    (table, column, definition) from `ALTER TABLE ... ADD COLUMN IF NOT EXISTS` and
+    json_columns maps table -> set of jsonb columns. Statements SQLite cannot express
+    (functions, GIN indexes, grants, ...) are skipped.
+    """
+    creates, added, json_cols = [], [], {}
+    for stmt in split_sql_statements(sql):
+        head = " ".join(stmt.split()[:3]).upper()
+        if head.startswith("CREATE TABLE"):
+            m = re.match(r"CREATE TABLE IF NOT EXISTS\s+(?:public\.)?(\w+)\s*\((.*)\)\s*$", stmt, re.S | re.I)
+            if not m:
+                continue
+            table, body = m.group(1), m.group(2)
+            for line in body.split("\n"):
+                col = re.match(r"\s*(\w+)\s+jsonb\b", line, re.I)
+                if col:
+                    json_cols.setdefault(table, set()).add(col.group(1))
+            creates.append(_translate_types(stmt))
+        elif head.startswith("CREATE INDEX") or head.startswith("CREATE UNIQUE"):
+            if re.search(r"\bUSING\b", stmt, re.I):
+                continue
+            creates.append(_translate_types(stmt))
+        elif head.startswith("ALTER TABLE"):
+            m = re.match(r"ALTER TABLE\s+(?:public\.)?(\w+)\s+ADD COLUMN IF NOT EXISTS\s+(\w+)\s+(.*)$", stmt, re.S | re.I)
+            if not m:
+                continue
+            table, column, definition = m.groups()
+            if re.match(r"jsonb\b", definition.strip(), re.I):
+                json_cols.setdefault(table, set()).add(column)
+            added.append((table, column, _translate_types(definition)))
+    return creates, added, json_cols
+
+
+class SQLiteTable:
+    def __init__(self, db: "SQLiteSupabase", name: str):
+        self._db = db
+        self._name = name
+        self._select_cols = None
+        self._filters = []
+        self._limit = None
+        self._order = []  # (col, desc), in priority order
+        self._insert_payload = None
+        self._upsert_payload = None
+        self._update_payload = None
+        self._delete = False
+        self._on_conflict = "id"
+        self._ignore_duplicates = False
+
+    def select(self, *cols):
+        self._select_cols = [c.strip() for c in ",".join(cols).split(",") if c.strip()] if cols else None
+        return self
+
+    def eq(self, col, val):
+        self._filters.append((col, "=", val))
+        return self
+
+    def in_(self, col, values):
+        self._filters.append((col, "IN", list(values)))
+        return self
+
+    def gt(self, col, val):
+        self._filters.append((col, ">", val))
+        return self
+
+    def gte(self, col, val):
+        self._filters.append((col, ">=", val))
+        return self
+
+    def lt(self, col, val):
+        self._filters.append((col, "<", val))
+        return self
+
+    def lte(self, col, val):
+        self._filters.append((col, "<=", val))
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    def order(self, col, desc=False, ascending=None):
+        if not col:
+            raise ValueError("order() column cannot be empty")
+        self._order.append((col, (not ascending) if ascending is not None else desc))
+        return self
+
+    def insert(self, payload):
+        self._insert_payload = payload
+        return self
+
+    def upsert(self, payload, on_conflict="id", ignore_duplicates=False):
+        self._upsert_payload = payload
+        self._on_conflict = on_conflict
+        self._ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, changes):
+        self._update_payload = changes
+        return self
+
+    def delete(self):
+        self._delete = True
+        return self
+
+    def _column(self, col: str) -> str:
+        if col not in self._db.columns(self._name):
+            raise ValueError(f"Column '{col}' does not exist in table '{self._name}'")
+        return f'"{col}"'
+
+    def _prepare_row(self, payload) -> Dict:
+        if not isinstance(payload, dict):
+            raise ValueError("Insert payload must be a dictionary")
+        row = dict(payload)
+        columns = self._db.columns(self._name)
+        if "id" in columns:
+            row.setdefault("id", str(uuid4()))
+        if "created_at" in columns:
+            row.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+        return row
+
+    def _where(self):
+        if not self._filters:
+            return "", []
+        clauses, params = [], []
+        for col, op, val in self._filters:
+            if not col:
+                raise ValueError("Filter column name cannot be empty")
+            if val is None and op == "=":
+                clauses.append(f"{self._column(col)} IS NULL")
+            elif op == "IN":
+                if not val:
+                    clauses.append("0")
+                    continue
+                clauses.append(f"{self._column(col)} IN ({', '.join('?' for _ in val)})")
+                params.extend(self._db.encode(self._name, col, v) for v in val)
+            else:
+                clauses.append(f"{self._column(col)} {op} ?")
+                params.append(self._db.encode(self._name, col, val))
+        return " WHERE " + " AND ".join(clauses), params
+
+    def _write(self, payloads, upsert: bool):
+        payloads = payloads if isinstance(payloads, list) else [payloads]
+        rows = [self._prepare_row(p) for p in payloads]
+        if not rows:
+            return []
+        provided = set().union(*(p.keys() for p in payloads))
+        cols = list(rows[0].keys())
+        for row in rows[1:]:
+            cols.extend(c for c in row.keys() if c not in cols)
+        quoted = ", ".join(self._column(c) for c in cols)
+        sql = f'INSERT INTO "{self._name}" ({quoted}) VALUES ({", ".join("?" for _ in cols)})'
+        if upsert:
+            conflict = self._column(self._on_conflict)
+            updates = ", ".join(f"{self._column(c)} = excluded.{self._column(c)}" for c in cols
+                                if c not in (self._on_conflict, "id") and (c != "created_at" or c in provided))
+            sql += f" ON CONFLICT ({conflict}) DO " + (f"UPDATE SET {updates}" if updates and not self._ignore_duplicates
+                                                       else "NOTHING")
+        values = [[self._db.encode(self._name, c, row.get(c)) for c in cols] for row in rows]
+        with self._db.transaction() as conn:
+            if upsert and self._ignore_duplicates:
+                # Only the rows actually inserted are returned, like ON CONFLICT DO NOTHING in Postgres
+                return [row for row, v in zip(rows, values) if conn.execute(sql, v).rowcount]
+            conn.executemany(sql, values)
+            if upsert:
+                # Return the stored rows (an upsert may have kept the existing id)
+                keys = [row.get(self._on_conflict) for row in rows]
+                placeholders = ", ".join("?" for _ in keys)
+                cur = conn.execute(f'SELECT * FROM "{self._name}" WHERE {conflict} IN ({placeholders})',
+                                   [self._db.encode(self._name, self._on_conflict, k) for k in keys])
+                return [self._db.decode_row(self._name, r) for r in cur.fetchall()]
+        return rows
+
+    def _update(self, changes) -> List[Dict]:
+        if not self._filters:
+            raise ValueError("update() requires at least one filter")
+        if not changes:
+            return []
+        where, params = self._where()
+        assignments = ", ".join(f"{self._column(c)} = ?" for c in changes)
+        values = [self._db.encode(self._name, c, v) for c, v in changes.items()]
+        with self._db.transaction() as conn:
+            # Collect the rowids first: the update may change the columns the filters match on
+            rowids = [r[0] for r in conn.execute(f'SELECT rowid FROM "{self._name}"{where}', params)]
+            if not rowids:
+                return []
+            placeholders = ", ".join("?" for _ in rowids)
+            conn.execute(f'UPDATE "{self._name}" SET {assignments} WHERE rowid IN ({placeholders})', values + rowids)
+            cur = conn.execute(f'SELECT * FROM "{self._name}" WHERE rowid IN ({placeholders})', rowids)
+            return [self._db.decode_row(self._name, r) for r in cur.fetchall()]
+
+    def _delete_rows(self) -> List[Dict]:
+        if not self._filters:
+            raise ValueError("delete() requires at least one filter")
+        where, params = self._where()
+        with self._db.transaction() as conn:
+            rows = [self._db.decode_row(self._name, r) for r in
+                    conn.execute(f'SELECT * FROM "{self._name}"{where}', params).fetchall()]
+            if rows:
+                conn.execute(f'DELETE FROM "{self._name}"{where}', params)
+            return rows
+
+    def execute(self):
+        try:
+            if self._delete:
+                self._delete = False
+                return SQLiteResponse(self._delete_rows())
+            if self._update_payload is not None:
+                changes, self._update_payload = self._update_payload, None
+                return SQLiteResponse(self._update(changes))
+            if self._upsert_payload is not None:
+                payload, self._upsert_payload = self._upsert_payload, None
+                return SQLiteResponse(self._write(payload, upsert=True))
+            if self._insert_payload is not None:
+                payload, self._insert_payload = self._insert_payload, None
+                return SQLiteResponse(self._write(payload, upsert=False))
+
+            if self._select_cols and self._select_cols != ["*"]:
+                cols = ", ".join(self._column(c) for c in self._select_cols)
+            else:
+                cols = "*"
+            where, params = self._where()
+            sql = f'SELECT {cols} FROM "{self._name}"{where}'
+            if self._order:
+                sql += " ORDER BY " + ", ".join(f"{self._column(c)} {'DESC' if d else 'ASC'}" for c, d in self._order)
+            if self._limit:
+                if self._limit < 0:
+                    raise ValueError("Limit must be non-negative")
+                sql += " LIMIT ?"
+                params.append(int(self._limit))
+            cur = self._db.connection().execute(sql, params)
+            return SQLiteResponse([self._db.decode_row(self._name, r) for r in cur.fetchall()])
+        except ValueError as e:
+            raise ValueError(f"Query error in table '{self._name}': {str(e)}")
+        except sqlite3.Error as e:
+            raise Exception(f"Unexpected database error in table '{self._name}': {str(e)}")
+
+
+class SQLiteSupabase:
+    """supabase-compatible client over a local SQLite file."""
+
+    def __init__(self, path: str, schema_path: Optional[pathlib.Path] = None, busy_timeout: float = 10.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._columns: Dict[str, List[str]] = {}
+        self._json_columns: Dict[str, set] = {}
+        self._apply_schema(pathlib.Path(schema_path or SQL_FILE).read_text())
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                                   check_same_thread=False, cached_statements=256)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def transaction(self):
+        return _Transaction(self.connection())
+
+    def rpc(self, fn, params=None):
+        return LocalRPC(self, fn, params)
+
+    def table(self, name):
+        if name not in self._columns:
+            raise ValueError(f"Table '{name}' does not exist")
+        return SQLiteTable(self, name)
+
+    def columns(self, table: str) -> List[str]:
+        return self._columns[table]
+
+    def encode(self, table: str, col: str, val):
+        if col in self._json_columns.get(table, ()) and val is not None:
+            return json.dumps(val, default=str)
+        return val
+
+    def decode_row(self, table: str, row: sqlite3.Row) -> Dict:
+        data = dict(row)
+        for col in self._json_columns.get(table, ()):
+            if isinstance(data.get(col), str):
+                try:
+                    data[col] = json.loads(data[col])
+                except ValueError:
+                    pass
+        return data
+
+    def _apply_schema(self, sql: str):
+        creates, added, self._json_columns = translate_schema(sql)
+        conn = self.connection()
+        with _Transaction(conn):
+            for stmt in creates:
+                if stmt.upper().startswith("CREATE INDEX") or stmt.upper().startswith("CREATE UNIQUE"):
+                    continue
+                conn.execute(stmt)
+            for table, column, definition in added:
+                existing = {r["name"] for r in conn.execute(f'PRAGMA table_info("{table}")')}
+                if column not in existing:
+                    # SQLite cannot add a REFERENCES column with a non-NULL default; the FK is informational here
+                    conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {definition}')
+            for stmt in creates:
+                if stmt.upper().startswith("CREATE INDEX") or stmt.upper().startswith("CREATE UNIQUE"):
+                    conn.execute(stmt)
+        self._ensure_search_index(conn)
+        for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')"):
+            self._columns[name] = [r["name"] for r in conn.execute(f'PRAGMA table_info("{name}")')]
+
+    # Searchable text of a conversation row (see text_search.conversation_text)
+    _SEARCH_TEXT = ("coalesce({t}.message, '') || ' ' || coalesce((SELECT group_concat(value, ' ') "
+                    "FROM json_tree({t}.template_params) WHERE atom IS NOT NULL), '')")
+
+    def _ensure_search_index(self, conn: sqlite3.Connection):
+        """FTS5 index over conversations, kept in sync by triggers on every write path."""
+        self.search_enabled = False
+        if "conversations" not in {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}:
+            return
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'conversations_fts'").fetchone()
+        try:
+            with _Transaction(conn):
+                conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts USING fts5(body, tokenize = 'unicode61')")
+                new, old = self._SEARCH_TEXT.format(t="new"), self._SEARCH_TEXT.format(t="old")
+                conn.execute("CREATE TRIGGER IF NOT EXISTS conversations_fts_ai AFTER INSERT ON conversations BEGIN "
+                             f"INSERT INTO conversations_fts (rowid, body) VALUES (new.rowid, {new}); END")
+                conn.execute("CREATE TRIGGER IF NOT EXISTS conversations_fts_ad AFTER DELETE ON conversations BEGIN "
+                             "DELETE FROM conversations_fts WHERE rowid = old.rowid; END")
+                conn.execute("CREATE TRIGGER IF NOT EXISTS conversations_fts_au AFTER UPDATE ON conversations BEGIN "
+                             "DELETE FROM conversations_fts WHERE rowid = old.rowid; "
+                             f"INSERT INTO conversations_fts (rowid, body) VALUES (new.rowid, {new}); END")
+                if not exists:
+                    # Index the rows written before the search index existed
+                    conn.execute("INSERT INTO conversations_fts (rowid, body) "
+                                 f"SELECT rowid, {self._SEARCH_TEXT.format(t='conversations')} FROM conversations")
+            self.search_enabled = True
+        except sqlite3.OperationalError as e:
+            log.warning(f"SQLite FTS5 unavailable, conversation search will scan the table: {e}")
+
+    def search_conversations(self, query: str, limit: int = 20, offset: int = 0) -> List[Dict]:
+        """Ranked full-text search (see text_search.py); best first, ties newest first."""
+        tokens = query_tokens(query)
+        if not tokens:
+            return []
+        conn = self.connection()
+        if self.search_enabled:
+            # bm25() is lower for better matches; rank is reported higher-is-better
+            cur = conn.execute(
+                "SELECT c.*, -bm25(conversations_fts) AS rank FROM conversations_fts "
+                "JOIN conversations c ON c.rowid = conversations_fts.rowid "
+                "WHERE conversations_fts MATCH ? ORDER BY bm25(conversations_fts), c.created_at DESC, c.id DESC "
+                "LIMIT ? OFFSET ?",
+                (fts5_query(tokens), limit, offset)
+            )
+            return [self.decode_row("conversations", r) for r in cur.fetchall()]
+        rows = [self.decode_row("conversations", r) for r in
+                conn.execute("SELECT * FROM conversations ORDER BY created_at DESC, id DESC").fetchall()]
+        hits = []
+        for row in rows:
+            words = tokenize(conversation_text(row))
+            if all(any(w.startswith(t) for w in words) for t in tokens):
+                hits.append({**row, "rank": 1.0})
+        return hits[offset:offset + limit]
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT; takes the write lock up front so concurrent writers wait
+    on busy_timeout instead of failing with a deadlock on lock upgrade. Nested use joins the
+    outer transaction."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self._owner = False
+
+    def __enter__(self):
+        self._owner = not self.conn.in_transaction
+        if self._owner:
+            self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._owner:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
@@ -19,16 +19,34 @@ CREATE TABLE IF NOT EXISTS public.bookings (
   created_at timestamptz DEFAULT now()
 );
 
+-- Create message_templates table (bot reply templates, content-addressed by hash)
+CREATE TABLE IF NOT EXISTS public.message_templates (
+  hash text PRIMARY KEY,
+  body text NOT NULL,
+  created_at timestamptz DEFAULT now()
+);
+
 -- Create conversations table
+-- Templated bot rows store an empty message plus template_hash/template_params
 CREATE TABLE IF NOT EXISTS public.conversations (
   id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
   user_id uuid REFERENCES public.users(id) ON DELETE SET NULL,
   role text NOT NULL,
   message text NOT NULL,
+  template_hash text REFERENCES public.message_templates(hash),
+  template_params jsonb,
+  message_preview text,
   meta jsonb DEFAULT '{}'::jsonb,
   created_at timestamptz DEFAULT now()
 );
 
+-- Upgrade existing conversations tables created before message templates
+ALTER TABLE public.conversations ADD COLUMN IF NOT EXISTS template_hash text REFERENCES public.message_templates(hash);
+ALTER TABLE public.conversations ADD COLUMN IF NOT EXISTS template_params jsonb;
+-- First 100 characters of the message, so list views need not read full messages
+-- (NULL for templated rows and for rows stored before the column existed)
+ALTER TABLE public.conversations ADD COLUMN IF NOT EXISTS message_preview text;
+
 -- Create audit_logs table
 CREATE TABLE IF NOT EXISTS public.audit_logs (
   id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -41,11 +59,173 @@ CREATE TABLE IF NOT EXISTS public.audit_logs (
   created_at timestamptz DEFAULT now()
 );
 
+-- Create invoices table (one invoice per booking; id is derived from the booking id)
+CREATE TABLE IF NOT EXISTS public.invoices (
+  id text PRIMARY KEY,
+  booking_id uuid UNIQUE NOT NULL REFERENCES public.bookings(id) ON DELETE CASCADE,
+  user_id uuid REFERENCES public.users(id) ON DELETE SET NULL,
+  hotel_id text NOT NULL,
+  subtotal numeric(12,2) NOT NULL,
+  gst_percent numeric(5,2) NOT NULL,
+  gst numeric(12,2) NOT NULL,
+  total numeric(12,2) NOT NULL,
+  html text NOT NULL,
+  etag text NOT NULL,
+  created_at timestamptz DEFAULT now()
+);
+
+-- Create payment_intents table (pending -> succeeded | failed | cancelled, driven by provider webhooks)
+CREATE TABLE IF NOT EXISTS public.payment_intents (
+  id text PRIMARY KEY,
+  booking_id uuid REFERENCES public.bookings(id) ON DELETE SET NULL,
+  amount_inr int NOT NULL,
+  currency text NOT NULL DEFAULT 'INR',
+  description text,
+  status text NOT NULL DEFAULT 'pending',
+  client_secret text,
+  created_at timestamptz DEFAULT now(),
+  updated_at timestamptz DEFAULT now()
+);
+
+-- Payment state of a booking, set by payment reconciliation
+ALTER TABLE public.bookings ADD COLUMN IF NOT EXISTS payment_status text DEFAULT 'unpaid';
+ALTER TABLE public.bookings ADD COLUMN IF NOT EXISTS paid_at timestamptz;
+
+-- Create daily_stats table (analytics counters; id is "<day>|<metric>|<dimension>", see analytics.py)
+CREATE TABLE IF NOT EXISTS public.daily_stats (
+  id text PRIMARY KEY,
+  day date NOT NULL,
+  metric text NOT NULL,
+  dimension text NOT NULL DEFAULT '',
+  value numeric NOT NULL DEFAULT 0,
+  updated_at timestamptz DEFAULT now()
+);
+
 -- Create indexes
+CREATE INDEX IF NOT EXISTS idx_payment_intents_booking_id ON public.payment_intents(booking_id);
 CREATE INDEX IF NOT EXISTS idx_bookings_user_id ON public.bookings(user_id);
+CREATE INDEX IF NOT EXISTS idx_bookings_checkin_date ON public.bookings(checkin_date);
 CREATE INDEX IF NOT EXISTS idx_conversations_user_id ON public.conversations(user_id);
 CREATE INDEX IF NOT EXISTS idx_audit_logs_user_id ON public.audit_logs(user_id);
+-- created_at indexes: admin views order by it and the archiver moves whole months by it.
+-- The keyset index replaces the earlier single-column idx_conversations_created_at, which
+-- IF NOT EXISTS would otherwise leave in place under the same name on existing databases
+DROP INDEX IF EXISTS public.idx_conversations_created_at;
+CREATE INDEX IF NOT EXISTS idx_conversations_created_at_id ON public.conversations(created_at DESC, id DESC);
+-- Keyset pages of /admin/chats filtered by user
+CREATE INDEX IF NOT EXISTS idx_conversations_user_created_at ON public.conversations(user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_audit_logs_created_at ON public.audit_logs(created_at);
+CREATE INDEX IF NOT EXISTS idx_daily_stats_day ON public.daily_stats(day);
 
 -- Grant access to 'anon' or public role (optional; please review security needs)
 -- If your project enforces Row Level Security (RLS), ensure policies allow inserts/selects for service key
 -- GRANT SELECT, INSERT ON public.users, public.bookings, public.conversations TO anon;
+
+-- Atomic booking: user upsert + booking insert + audit insert in one round trip / one transaction.
+-- Called as supabase.rpc('book_hotel', {...}); returns {"booking": ..., "user": ..., "audit_log": ...}
+CREATE OR REPLACE FUNCTION public.book_hotel(
+  p_name text,
+  p_phone text,
+  p_hotel_id text,
+  p_hotel_name text,
+  p_checkin_date date,
+  p_nights int,
+  p_visitors int,
+  p_total_price numeric,
+  p_audit_details jsonb DEFAULT '{}'::jsonb
+) RETURNS jsonb
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_user public.users;
+  v_booking public.bookings;
+  v_audit public.audit_logs;
+BEGIN
+  -- ON CONFLICT makes the phone upsert race-free; the no-op update returns the existing row
+  INSERT INTO public.users (name, phone)
+  VALUES (p_name, p_phone)
+  ON CONFLICT (phone) DO UPDATE SET phone = EXCLUDED.phone
+  RETURNING * INTO v_user;
+
+  INSERT INTO public.bookings (user_id, hotel_id, hotel_name, checkin_date, nights, visitors, total_price)
+  VALUES (v_user.id, p_hotel_id, p_hotel_name, p_checkin_date, p_nights, p_visitors, p_total_price)
+  RETURNING * INTO v_booking;
+
+  INSERT INTO public.audit_logs (user_id, action, resource_type, resource_id, details)
+  VALUES (v_user.id, 'BOOKING_CREATED', 'booking', v_booking.id::text, COALESCE(p_audit_details, '{}'::jsonb))
+  RETURNING * INTO v_audit;
+
+  RETURN jsonb_build_object('booking', to_jsonb(v_booking), 'user', to_jsonb(v_user), 'audit_log', to_jsonb(v_audit));
+END;
+$$;
+
+-- Full-text search over conversations: message text plus template parameter values
+-- (see text_search.py). The tsvector is not stored; an expression GIN index covers it.
+CREATE OR REPLACE FUNCTION public.conversation_search_vector(p_message text, p_params jsonb)
+RETURNS tsvector
+LANGUAGE sql
+IMMUTABLE
+AS $$
+  SELECT to_tsvector('simple', coalesce(p_message, ''))
+      || jsonb_to_tsvector('simple', coalesce(p_params, '{}'::jsonb), '["string", "numeric"]');
+$$;
+
+CREATE INDEX IF NOT EXISTS idx_conversations_search
+  ON public.conversations USING GIN (public.conversation_search_vector(message, template_params));
+
+-- Ranked search: every word of p_query is a prefix match and all are required.
+-- Called as supabase.rpc('search_conversations', {...}); returns a JSON array of rows with "rank"
+CREATE OR REPLACE FUNCTION public.search_conversations(
+  p_query text,
+  p_limit int DEFAULT 20,
+  p_offset int DEFAULT 0
+)
+RETURNS jsonb
+LANGUAGE sql
+STABLE
+AS $$
+  WITH q AS (
+    SELECT to_tsquery('simple', string_agg(w || ':*', ' & ')) AS query
+    FROM (
+      SELECT w FROM regexp_split_to_table(lower(p_query), '[^[:alnum:]_]+') AS w
+      WHERE w <> '' LIMIT 8
+    ) words
+  ), hits AS (
+    SELECT c.*, ts_rank(public.conversation_search_vector(c.message, c.template_params), q.query) AS rank
+    FROM public.conversations c, q
+    WHERE public.conversation_search_vector(c.message, c.template_params) @@ q.query
+    ORDER BY rank DESC, c.created_at DESC, c.id DESC
+    LIMIT p_limit OFFSET p_offset
+  )
+  SELECT coalesce(jsonb_agg(to_jsonb(hits) ORDER BY hits.rank DESC, hits.created_at DESC, hits.id DESC), '[]'::jsonb)
+  FROM hits;
+$$;
+
+-- Atomic analytics increments: adds each element's value to its counter, creating it if missing.
+-- Called as supabase.rpc('increment_daily_stats', {"p_rows": [{"id", "day", "metric", "dimension", "value"}, ...]})
+CREATE OR REPLACE FUNCTION public.increment_daily_stats(p_rows jsonb)
+RETURNS void
+LANGUAGE sql
+AS $$
+  INSERT INTO public.daily_stats (id, day, metric, dimension, value, updated_at)
+  SELECT r->>'id', (r->>'day')::date, r->>'metric', coalesce(r->>'dimension', ''), (r->>'value')::numeric, now()
+  FROM jsonb_array_elements(p_rows) AS r
+  ON CONFLICT (id) DO UPDATE
+    SET value = public.daily_stats.value + excluded.value, updated_at = now();
+$$;
+
+-- Analytics rebuild: replaces each metric's counters from its "since" day on with p_rows, atomically.
+-- Called as supabase.rpc('replace_daily_stats', {"p_ranges": [{"metric", "since"}, ...], "p_rows": [...]})
+CREATE OR REPLACE FUNCTION public.replace_daily_stats(p_ranges jsonb, p_rows jsonb)
+RETURNS void
+LANGUAGE sql
+AS $$
+  DELETE FROM public.daily_stats d
+  USING jsonb_array_elements(p_ranges) AS r
+  WHERE d.metric = r->>'metric' AND d.day >= (r->>'since')::date;
+  INSERT INTO public.daily_stats (id, day, metric, dimension, value, updated_at)
+  SELECT r->>'id', (r->>'day')::date, r->>'metric', coalesce(r->>'dimension', ''), (r->>'value')::numeric, now()
+  FROM jsonb_array_elements(p_rows) AS r
+  ON CONFLICT (id) DO UPDATE
+    SET value = excluded.value, updated_at = now();
+$$;
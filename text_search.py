@@ -0,0 +1,127 @@
+"""
+text_search.py
+Full-text search over conversations for the admin search endpoint.
+
+The searchable text of a conversation row is its message plus the values of its template
+parameters (template-backed bot messages store the hotel names, prices, ids etc. there;
+the shared template body itself is not indexed). Text is split into lowercase word tokens
+and every query word is a prefix match, all words required, so "taj 9876" finds a message
+mentioning "Taj Palace" and "+91 98765 43210".
+
+Each backend keeps its own inverted index, updated on every write to conversations:
+Postgres an expression GIN index over a tsvector (see supabase_tables.sql), SQLite an FTS5
+table kept in sync by triggers, and FakeSupabase the `InvertedIndex` below. Results are
+ranked (ts_rank in Postgres, BM25 elsewhere), ties newest first.
+"""
+import bisect
+import math
+import re
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Longest query accepted, in words; the rest is ignored
+MAX_QUERY_TOKENS = 8
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+
+def query_tokens(query: str) -> List[str]:
+    return tokenize(query)[:MAX_QUERY_TOKENS]
+
+
+def _param_values(params: Any) -> Iterable[str]:
+    if isinstance(params, dict):
+        for value in params.values():
+            yield from _param_values(value)
+    elif isinstance(params, (list, tuple)):
+        for value in params:
+            yield from _param_values(value)
+    elif params is not None:
+        yield str(params)
+
+
+def conversation_text(row: Dict[str, Any]) -> str:
+    return " ".join([row.get("message") or "", *_param_values(row.get("template_params"))])
+
+
+def fts5_query(tokens: List[str]) -> str:
+    """SQLite FTS5 MATCH expression: every token as a quoted prefix, implicitly ANDed."""
+    return " ".join(f'"{t}"*' for t in tokens)
+
+
+class InvertedIndex:
+    """Incremental in-memory inverted index with prefix queries and BM25 ranking."""
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[Any, int]] = defaultdict(dict)  # term -> doc -> term frequency
+        self._terms: List[str] = []  # sorted vocabulary, for prefix lookups
+        self._doc_terms: Dict[Any, Dict[str, int]] = {}
+        self._lengths: Dict[Any, int] = {}
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    def add(self, doc_id, text: str):
+        self.remove(doc_id)
+        counts: Dict[str, int] = defaultdict(int)
+        for token in tokenize(text):
+            counts[token] += 1
+        self._doc_terms[doc_id] = counts
+        self._lengths[doc_id] = sum(counts.values())
+        self._total_length += self._lengths[doc_id]
+        for term, tf in counts.items():
+            postings = self._postings[term]
+            if not postings:
+                bisect.insort(self._terms, term)
+            postings[doc_id] = tf
+
+    def remove(self, doc_id):
+        counts = self._doc_terms.pop(doc_id, None)
+        if counts is None:
+            return
+        self._total_length -= self._lengths.pop(doc_id)
+        for term in counts:
+            postings = self._postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+                i = bisect.bisect_left(self._terms, term)
+                if i < len(self._terms) and self._terms[i] == term:
+                    del self._terms[i]
+
+    def _expand(self, prefix: str) -> List[str]:
+        i = bisect.bisect_left(self._terms, prefix)
+        j = bisect.bisect_left(self._terms, prefix + "\U0010ffff")
+        return self._terms[i:j]
+
+    def search(self, tokens: List[str]) -> Dict[Any, float]:
+        """doc_id -> score of the documents matching every token as a prefix."""
+        if not tokens or not self._doc_terms:
+            return {}
+        n = len(self._doc_terms)
+        avg_length = self._total_length / n or 1.0
+        scores: Optional[Dict[Any, float]] = None
+        # Rarest query word first, so the candidate set shrinks as fast as possible
+        expanded = sorted((self._expand(t) for t in tokens), key=lambda terms: sum(len(self._postings[x]) for x in terms))
+        for terms in expanded:
+            matched: Dict[Any, float] = defaultdict(float)
+            for term in terms:
+                postings = self._postings[term]
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    if scores is not None and doc_id not in scores:
+                        continue
+                    norm = tf + self.K1 * (1 - self.B + self.B * self._lengths[doc_id] / avg_length)
+                    matched[doc_id] += idf * tf * (self.K1 + 1) / norm
+            scores = matched if scores is None else {d: scores[d] + s for d, s in matched.items()}
+            if not scores:
+                return {}
+        return scores
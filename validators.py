@@ -1,6 +1,6 @@
 import re
 from datetime import datetime
-from typing import Tuple, Optional
+from typing import Tuple, Optional, List, Dict
 
 def validate_phone(phone: str) -> Tuple[bool, Optional[str]]:
     phone = phone.strip().replace("+", "").replace(" ", "").replace("-", "")
@@ -21,11 +21,13 @@ def validate_date(date_str: str) -> Tuple[bool, Optional[str]]:
     except ValueError:
         return False, "Date must be in YYYY-MM-DD format"
 
+MAX_NIGHTS = 365
+
 def validate_nights(nights: int) -> Tuple[bool, str]:
     if not isinstance(nights, int) or nights < 1:
         return False, "Nights must be a positive integer"
-    if nights > 365:
-        return False, "Nights cannot exceed 365"
+    if nights > MAX_NIGHTS:
+        return False, f"Nights cannot exceed {MAX_NIGHTS}"
     return True, str(nights)
 
 def validate_visitors(visitors: int) -> Tuple[bool, str]:
@@ -59,6 +61,69 @@ def validate_booking_input(name: str, phone: str, checkin_date: str, nights: int
     
     return True, None
 
+def validate_booking_rows(rows: List[Dict]) -> List[Tuple[bool, Optional[str]]]:
+    """Batch form of validate_booking_input for bulk bookings (same checks and messages).
+
+    Rows come straight from uploaded JSON/CSV, so field types are checked first. Each distinct
+    date or phone is checked only once, since spreadsheet rows repeat them heavily.
+    """
+    date_checks: Dict[str, Tuple[bool, Optional[str]]] = {}
+    phone_checks: Dict[str, Tuple[bool, Optional[str]]] = {}
+    results = []
+    for row in rows:
+        if not isinstance(row, dict):
+            results.append((False, "Row must be an object"))
+            continue
+        name = row.get("name")
+        phone = row.get("phone")
+        checkin_date = row.get("checkin_date")
+        if isinstance(phone, int) and not isinstance(phone, bool):
+            phone = str(phone)
+        
+        if not isinstance(name, str) or len(name.strip()) < 2:
+            results.append((False, "Name must be at least 2 characters"))
+            continue
+        if len(name) > 100:
+            results.append((False, "Name cannot exceed 100 characters"))
+            continue
+        
+        if not isinstance(phone, str):
+            results.append((False, "Phone: Phone must contain only digits"))
+            continue
+        if phone not in phone_checks:
+            phone_checks[phone] = validate_phone(phone)
+        valid_phone, error = phone_checks[phone]
+        if not valid_phone:
+            results.append((False, f"Phone: {error}"))
+            continue
+        
+        if not isinstance(checkin_date, str):
+            results.append((False, "Date: Date must be in YYYY-MM-DD format"))
+            continue
+        if checkin_date not in date_checks:
+            date_checks[checkin_date] = validate_date(checkin_date)
+        valid_date, error = date_checks[checkin_date]
+        if not valid_date:
+            results.append((False, f"Date: {error}"))
+            continue
+        
+        valid_nights, error = validate_nights(row.get("nights"))
+        if not valid_nights:
+            results.append((False, f"Nights: {error}"))
+            continue
+        
+        valid_visitors, error = validate_visitors(row.get("visitors", 1))
+        if not valid_visitors:
+            results.append((False, f"Visitors: {error}"))
+            continue
+        
+        if not isinstance(row.get("hotel_id"), str):
+            results.append((False, "Hotel not found"))
+            continue
+        
+        results.append((True, None))
+    return results
+
 def mask_pii(phone: str = "", name: str = None) -> dict:
     """Mask personally identifiable information for secure display."""
     if not phone:
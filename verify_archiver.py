@@ -0,0 +1,98 @@
+"""verify_archiver.py
+Correctness check for archiver.py against an in-memory database: cold months move to archive
+files and leave the database, hot months stay, point lookups find every archived row, a
+rerun merges late rows into an existing archive without duplicates, a run interrupted
+between writing the archive and deleting its rows loses nothing, and retention expires old
+archives.
+
+The check swaps db.supabase for a FakeSupabase, so it never touches a configured database.
+"""
+import os
+import sys
+import tempfile
+from unittest import mock
+from uuid import uuid4
+
+import archiver
+import db
+
+CURRENT = '2030-06'
+failures = []
+
+
+def expect(label, got, want):
+    if got != want:
+        failures.append(f'{label}: got {got!r}, expected {want!r}')
+
+
+def add_conversations(month, count):
+    rows = [{'id': str(uuid4()), 'user_id': None, 'role': 'user', 'message': f'm{i}',
+             'created_at': f'{month}-{1 + i % 28:02d}T10:00:00+00:00'} for i in range(count)]
+    db.supabase.table('conversations').insert(rows).execute()
+    return rows
+
+
+def db_ids(month=None):
+    rows = db.supabase.table('conversations').select('id, created_at').execute().data
+    return {r['id'] for r in rows if month is None or r['created_at'].startswith(month)}
+
+
+def archived_ids(month, root):
+    return [r['id'] for r in archiver.iter_archive('conversations', month, root)]
+
+
+def main():
+    print('Checking archival...')
+    db.supabase = db.FakeSupabase()
+    with tempfile.TemporaryDirectory() as root, \
+            mock.patch.object(archiver, 'ARCHIVE_HOT_MONTHS', 'conversations=3,audit_logs=3'), \
+            mock.patch.object(archiver, 'ARCHIVE_KEEP_MONTHS', 'conversations=0,audit_logs=0'):
+        january = add_conversations('2030-01', 2500)
+        february = add_conversations('2030-02', 10)
+        hot = add_conversations('2030-04', 20)  # inside the 3-month hot window
+
+        summary = archiver.run(root=root, current=CURRENT)['conversations']
+        expect('cold months', summary['months'], ['2030-01', '2030-02'])
+        expect('rows archived', summary['archived'], 2510)
+        expect('rows left in the database', db_ids(), {r['id'] for r in hot})
+        expect('archive is sorted by id', archived_ids('2030-01', root), sorted(r['id'] for r in january))
+        missing = [r['id'] for r in january + february if not archiver.find_archived('conversations', r['id'], root)]
+        expect('point lookups', missing, [])
+        expect('unknown id', archiver.find_archived('conversations', 'no-such-id', root), None)
+
+        # Late rows for an archived month are merged into its archive
+        late = add_conversations('2030-02', 5)
+        archiver.run(root=root, current=CURRENT)
+        expect('merged archive', sorted(archived_ids('2030-02', root)), sorted(r['id'] for r in february + late))
+
+        # Crash after the archive was written but before its rows were deleted: the rerun
+        # finds the rows again and must neither duplicate nor lose them
+        march = add_conversations('2030-03', 30)
+        with mock.patch.object(db, 'delete_rows', side_effect=RuntimeError('crash')):
+            try:
+                archiver.run(root=root, current='2030-07')
+                failures.append('interrupted run did not fail')
+            except RuntimeError:
+                pass
+        expect('rows kept after crash', len(db_ids('2030-03')), 30)
+        archiver.run(root=root, current='2030-07')
+        expect('rerun after crash', sorted(archived_ids('2030-03', root)), sorted(r['id'] for r in march))
+        expect('rows deleted after rerun', db_ids('2030-03'), set())
+
+        # Retention: keep 4 archived months before 2030-07 -> 2030-01 and 2030-02 expire
+        with mock.patch.object(archiver, 'ARCHIVE_KEEP_MONTHS', 'conversations=4,audit_logs=0'):
+            expired = archiver.run(root=root, current='2030-07')['conversations']['expired']
+        expect('expired months', expired, ['2030-01', '2030-02'])
+        expect('archives left', archiver.archived_months('conversations', root), ['2030-03'])
+        expect('expired rows not found', archiver.find_archived('conversations', january[0]['id'], root), None)
+        expect('files left', sorted(os.listdir(os.path.join(root, 'conversations'))),
+               ['2030-03.index.json', '2030-03.ndjson.gz'])
+
+    for failure in failures:
+        print('  ', failure)
+    print('✅ Archival checks passed' if not failures else f'❌ {len(failures)} archival check(s) failed')
+    sys.exit(0 if not failures else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""verify_inventory.py
+Concurrency check for inventory holds: many clients race for the last rooms of one hotel and
+the script verifies that no night is ever overbooked.
+
+By default the check runs in-process against inventory.Inventory (threads holding, releasing,
+committing and letting holds expire). With --api it fires concurrent /book requests at a
+running server (AI_AGENT_BASE) and checks that at most INVENTORY_ROOMS_PER_HOTEL succeed.
+"""
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from inventory import Inventory
+
+BASE = os.getenv('AI_AGENT_BASE', 'http://127.0.0.1:8000')
+CHECKIN = '2030-01-10'
+
+
+def check_in_process(workers=64, attempts=2000, rooms=5):
+    inv = Inventory(hold_seconds=0.05, rooms_per_hotel=rooms)
+    violations = []
+
+    def check():
+        for d in ('2030-01-10', '2030-01-11', '2030-01-12'):
+            used = inv._held[('h1', d)] + inv._booked[('h1', d)]
+            if used > rooms:
+                violations.append((d, used))
+
+    def client(i):
+        rnd = random.Random(i)
+        # Overlapping stays so holds compete on shared nights
+        checkin = rnd.choice(['2030-01-10', '2030-01-11'])
+        hold = inv.hold('h1', checkin, rnd.choice([1, 2]), owner=f'user{i}')
+        if not hold:
+            return 'sold_out'
+        time.sleep(rnd.random() * 0.02)
+        with inv._lock:
+            check()
+        action = rnd.random()
+        if action < 0.4:
+            inv.release(hold.id)
+            return 'released'
+        if action < 0.5:
+            time.sleep(0.06)  # let it expire
+        return 'committed' if inv.commit(hold.id) else 'expired'
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        outcomes = list(pool.map(client, range(attempts)))
+    with inv._lock:
+        check()
+        booked = {d: inv._booked[('h1', d)] for d in ('2030-01-10', '2030-01-11', '2030-01-12')}
+    summary = {o: outcomes.count(o) for o in set(outcomes)}
+    print('Outcomes:', summary)
+    print('Booked rooms per night:', booked, f'(capacity {rooms})')
+    print('Inventory stats:', inv.stats)
+    return not violations and all(v <= rooms for v in booked.values())
+
+
+def check_api(requests=100):
+    import httpx
+
+    def book(i):
+        payload = {
+            'user_id': f'verify-{i}',
+            'name': 'Verify Tester',
+            'phone': f'+9198{i:08d}',
+            'hotel_id': 'h2',
+            'checkin_date': CHECKIN,
+            'nights': 1,
+            'visitors': 1
+        }
+        return httpx.post(f"{BASE}/book", json=payload, timeout=30).status_code
+
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        codes = list(pool.map(book, range(requests)))
+    rooms = int(os.getenv('INVENTORY_ROOMS_PER_HOTEL', '10'))
+    print('Status codes:', {c: codes.count(c) for c in set(codes)})
+    print(f'{codes.count(200)} bookings succeeded for {rooms} rooms')
+    return codes.count(200) <= rooms
+
+
+def main():
+    print('Checking inventory holds under concurrent load...')
+    ok = check_api() if '--api' in sys.argv else check_in_process()
+    print('✅ No overbooking' if ok else '❌ Overbooking detected')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
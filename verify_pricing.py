@@ -0,0 +1,126 @@
+"""verify_pricing.py
+Correctness check for pricing.py: GST rounding, stacking of rate rules, rule date boundaries,
+the price calendar and the prefix-sum batch quotes.
+
+Everything runs in-process with explicit rules, so PRICING_RULES_PATH and GST_PERCENT of the
+current environment do not affect the result.
+"""
+import sys
+from datetime import date, timedelta
+
+import pricing
+from pricing import RateRule, _apply_bp, _percent_bp, format_inr, gst_paise, nightly_rates, quote_many, to_paise
+
+HOTEL = {'id': 'h1', 'price_per_night': 2500}
+failures = []
+
+
+def expect(label, got, want):
+    if got != want:
+        failures.append(f'{label}: got {got!r}, expected {want!r}')
+
+
+def check_rounding():
+    # x.5 paise of GST rounds up, anything below rounds down
+    expect('18% of 25 paise', gst_paise(25, 18), 5)  # 4.5
+    expect('18% of 24 paise', gst_paise(24, 18), 4)  # 4.32
+    expect('12.5% of 4 paise', gst_paise(4, '12.5'), 1)  # 0.5
+    expect('12.5% of 3 paise', gst_paise(3, '12.5'), 0)  # 0.375
+    expect('18% of Rs 2500', gst_paise(to_paise(2500), 18), 45000)
+    expect('to_paise(0.005)', to_paise('0.005'), 1)
+    expect('to_paise(19.99)', to_paise(19.99), 1999)  # float input is not truncated to 1998
+    expect('percent 12.5 -> bp', _percent_bp(12.5), 1250)
+    expect('format_inr', format_inr(123456789), '1,234,567.89')
+    expect('format_inr negative', format_inr(-5), '-0.05')
+    q = quote_many([{'id': 'h', 'price_per_night': '0.25'}], ['2030-01-07'], [1], gst_percent=18, rules=[])[0]
+    expect('quote total', (q['subtotal_paise'], q['gst_paise'], q['total_paise']), (25, 5, 30))
+
+
+def check_rules():
+    base = to_paise(HOTEL['price_per_night'])
+    weekend = RateRule(15, name='weekend', weekdays=[4, 5])
+    festival = RateRule(30, name='festival', start='2030-01-11', end='2030-01-13', hotel_ids=['h1'])
+    other_hotel = RateRule(50, name='elsewhere', hotel_ids=['h2'])
+    discount = RateRule(-10, name='promo', start='2030-01-13', end='2030-01-13')
+    rules = [weekend, festival, other_hotel, discount]
+    # 2030-01-07 is a Monday; the stay covers Mon..Mon
+    rates = nightly_rates(HOTEL, date(2030, 1, 7), 8, rules)
+    want = [
+        base,                                  # Mon 07
+        base,                                  # Tue 08
+        base,                                  # Wed 09
+        base,                                  # Thu 10
+        _apply_bp(base, 10000 + 1500 + 3000),  # Fri 11: weekend + festival start day
+        _apply_bp(base, 10000 + 1500 + 3000),  # Sat 12: weekend + festival
+        _apply_bp(base, 10000 + 3000 - 1000),  # Sun 13: festival end day + promo
+        base,                                  # Mon 14: festival over
+    ]
+    expect('stacked nightly rates', rates, want)
+    expect('rules for other hotels ignored', nightly_rates({'id': 'h3', 'price_per_night': 2500},
+                                                           date(2030, 1, 7), 1, rules), [base])
+
+    # A 1-night stay checking in on the last festival night vs. the first night after it
+    last, after = quote_many([HOTEL], ['2030-01-13', '2030-01-14'], [1], gst_percent=18, rules=[festival])
+    expect('inclusive end date', last['subtotal_paise'], _apply_bp(base, 13000))
+    expect('day after end date', after['subtotal_paise'], base)
+    before, first = quote_many([HOTEL], ['2030-01-10', '2030-01-11'], [1], gst_percent=18, rules=[festival])
+    expect('day before start date', before['subtotal_paise'], base)
+    expect('inclusive start date', first['subtotal_paise'], _apply_bp(base, 13000))
+
+
+def check_batch_matches_single():
+    rules = [RateRule(15, weekdays=[4, 5]), RateRule(30, start='2030-02-01', end='2030-02-03')]
+    hotels = [HOTEL, {'id': 'h2', 'price_per_night': '1999.99'}]
+    dates = [date(2030, 1, 20) + timedelta(days=i) for i in range(20)]
+    nights = [1, 2, 5, 14]
+    quotes = quote_many(hotels, dates, nights, gst_percent=18, rules=rules)
+    expect('batch size', len(quotes), len(hotels) * len(dates) * len(nights))
+    for q in quotes:
+        hotel = hotels[0] if q['hotel_id'] == 'h1' else hotels[1]
+        rates = nightly_rates(hotel, date.fromisoformat(q['checkin_date']), q['nights'], rules)
+        subtotal = sum(rates)
+        gst = gst_paise(subtotal, 18)
+        got = (q['nightly_paise'], q['subtotal_paise'], q['gst_paise'], q['total_paise'])
+        if got != (rates, subtotal, gst, subtotal + gst):
+            failures.append(f"batch quote {q['hotel_id']} {q['checkin_date']} x{q['nights']} differs from single quote")
+            break
+
+
+def check_calendar():
+    saved = pricing.RATE_RULES
+    pricing.RATE_RULES = []
+    pricing._calendar.cache_clear()
+    try:
+        start = date(2030, 12, 30)
+        cal = pricing.price_calendar(HOTEL, days=5, nights=2, start=start)
+        expect('calendar length', len(cal), 5)
+        expect('calendar first day', cal[0]['checkin_date'], '2030-12-30')
+        expect('calendar crosses the year', cal[-1]['checkin_date'], '2031-01-03')
+        expect('calendar nights', {q['nights'] for q in cal}, {2})
+        tomorrow = (date.today() + timedelta(days=1)).isoformat()
+        expect('calendar starts tomorrow', pricing.price_calendar(HOTEL, days=1)[0]['checkin_date'], tomorrow)
+    finally:
+        pricing.RATE_RULES = saved
+        pricing._calendar.cache_clear()
+
+    try:
+        quote_many([HOTEL], ['2030-01-07'], [0], rules=[])
+        failures.append('zero nights accepted')
+    except ValueError:
+        pass
+
+
+def main():
+    print('Checking pricing...')
+    check_rounding()
+    check_rules()
+    check_batch_matches_single()
+    check_calendar()
+    for failure in failures:
+        print('  ', failure)
+    print('✅ Pricing checks passed' if not failures else f'❌ {len(failures)} pricing check(s) failed')
+    sys.exit(0 if not failures else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""verify_rate_limit.py
+Correctness check for rate_limit.py: route limits, the sliding-window estimate at window
+boundaries, key eviction, and a limit shared by several worker processes through the SQLite
+counter store.
+
+Runs in-process with a fake clock; the shared-store check starts real processes on a
+temporary SQLite file.
+"""
+import os
+import sys
+import tempfile
+from multiprocessing import Pool
+
+from rate_limit import MemoryCounterStore, RateLimiter, SQLiteCounterStore
+
+failures = []
+
+
+def expect(label, got, want):
+    if got != want:
+        failures.append(f'{label}: got {got!r}, expected {want!r}')
+
+
+class Clock:
+    def __init__(self, now=6000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def allowed_count(limiter, client, path, n):
+    return sum(limiter.check(client, path)[0] for _ in range(n))
+
+
+def check_routes(store_factory):
+    clock = Clock()
+    limiter = RateLimiter(5, {'/chat': 3, '/chat/batch': 1, '/webhooks/': 0}, store=store_factory(), clock=clock)
+    expect('default limit', allowed_count(limiter, 'a', '/hotels', 10), 5)
+    expect('route limit', allowed_count(limiter, 'a', '/chat', 10), 3)
+    expect('longest prefix wins', allowed_count(limiter, 'a', '/chat/batch', 10), 1)
+    expect('unlimited route', allowed_count(limiter, 'a', '/webhooks/payments', 100), 100)
+    expect('clients are separate', allowed_count(limiter, 'b', '/chat', 10), 3)
+    allowed, limit, retry = limiter.check('a', '/chat')
+    expect('denied with limit', (allowed, limit), (False, 3))
+    if not 1 <= retry <= 60:
+        failures.append(f'retry_after out of range: {retry}')
+
+
+def check_sliding_window(store_factory):
+    # 10 requests at the end of one window still count for part of the next
+    clock = Clock(6059.0)
+    limiter = RateLimiter(10, store=store_factory(), clock=clock)
+    expect('fill previous window', allowed_count(limiter, 'a', '/x', 10), 10)
+    clock.now = 6060.0 + 15  # 75% of the previous window still inside -> 7.5 counted
+    expect('carry over 75%', allowed_count(limiter, 'a', '/x', 10), 2)
+    clock.now = 6060.0 + 45  # 25% -> 2.5 previous + 2 current
+    expect('carry over 25%', allowed_count(limiter, 'a', '/x', 10), 5)
+    clock.now = 6060.0 + 120  # two windows later nothing carries over
+    expect('idle two windows', allowed_count(limiter, 'a', '/x', 20), 10)
+
+
+def check_eviction():
+    clock = Clock()
+    store = MemoryCounterStore(max_keys=100)
+    limiter = RateLimiter(1, store=store, clock=clock)
+    for i in range(500):
+        limiter.check(f'client{i}', '/x')
+    if len(store) > 100:
+        failures.append(f'memory store holds {len(store)} keys (max 100)')
+    clock.now += 121
+    limiter.check('fresh', '/x')
+    expect('idle keys evicted', len(store), 1)
+
+
+def _worker(args):
+    path, n = args
+    limiter = RateLimiter(50, store=SQLiteCounterStore(path))
+    return sum(limiter.check('shared-ip', '/x')[0] for _ in range(n))
+
+
+def check_shared_store(path):
+    with Pool(4) as pool:
+        allowed = sum(pool.map(_worker, [(path, 40)] * 4))
+    # The fixed window may roll over while the workers run, allowing up to one more window's worth
+    if not 50 <= allowed <= 100:
+        failures.append(f'{allowed} of 160 requests allowed across 4 workers (limit 50)')
+    print(f'Shared SQLite store: {allowed} of 160 requests allowed across 4 workers (limit 50/min)')
+
+
+def main():
+    print('Checking rate limiting...')
+    with tempfile.TemporaryDirectory() as tmp:
+        def sqlite_store():
+            return SQLiteCounterStore(tempfile.mkstemp(suffix='.db', dir=tmp)[1])
+
+        for name, factory in (('memory', MemoryCounterStore), ('sqlite', sqlite_store)):
+            before = len(failures)
+            check_routes(factory)
+            check_sliding_window(factory)
+            print(f'{name} store:', 'ok' if len(failures) == before else 'FAILED')
+        check_eviction()
+        check_shared_store(os.path.join(tmp, 'shared.db'))
+    for failure in failures:
+        print('  ', failure)
+    print('✅ Rate limit checks passed' if not failures else f'❌ {len(failures)} rate limit check(s) failed')
+    sys.exit(0 if not failures else 1)
+
+
+if __name__ == '__main__':
+    main()
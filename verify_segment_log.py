@@ -0,0 +1,84 @@
+"""verify_segment_log.py
+Durability check for segment_log.py: records appended by worker processes that share one
+directory, some of which crash before shipping with a torn last line, must all be
+shipped at least once.
+
+Workers run as real processes on a temporary directory and ship into an NDJSON file that
+stands in for the audit_logs table.
+"""
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import segment_log
+from segment_log import SegmentLog
+
+RECORDS = 3000
+
+
+def _sink(path):
+    def ship(rows):
+        with open(path, 'a', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row) + '\n')
+    return ship
+
+
+def _fail(rows):
+    raise RuntimeError('database unreachable')
+
+
+def worker(root, out, tag, crash):
+    log = SegmentLog(root, _fail if crash else _sink(out), segment_bytes=64 * 1024, fsync_ms=5, ship_interval_ms=20)
+    log.start()
+    for i in range(RECORDS):
+        log.append({'id': f'{tag}-{i:05d}', 'payload': 'x' * 40})
+    if crash:
+        log._sync()
+        with open(log._path(log._segment), 'a', encoding='utf-8') as f:
+            f.write('{"id": "torn')  # crash mid-write
+        os._exit(1)
+    log.close()
+
+
+def main():
+    print('Checking the segment log with crashing workers...')
+    with tempfile.TemporaryDirectory() as tmp:
+        root, out = os.path.join(tmp, 'audit_log'), os.path.join(tmp, 'shipped.ndjson')
+        tags = [('live-a', False), ('crashed-b', True), ('live-c', False), ('crashed-d', True)]
+        procs = [multiprocessing.Process(target=worker, args=(root, out, tag, crash)) for tag, crash in tags]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        dirs = sorted(d for d in os.listdir(root) if d.startswith('worker-'))
+        print('Worker directories:', dirs)
+
+        # A restarting worker claims a free directory and adopts the ones the crashed workers left
+        segment_log.ADOPT_INTERVAL_SECONDS = 0.1
+        restarted = SegmentLog(root, _sink(out), ship_interval_ms=20)
+        restarted.start()
+        deadline = time.monotonic() + 10
+        while restarted.stats['adopted'] < RECORDS and time.monotonic() < deadline:
+            time.sleep(0.05)
+        restarted.flush()
+        restarted.close()
+        print('Restarted worker:', restarted.directory, restarted.stats)
+
+        with open(out, encoding='utf-8') as f:
+            ids = [json.loads(line)['id'] for line in f]
+        expected = {f'{tag}-{i:05d}' for tag, _ in tags for i in range(RECORDS)}
+        missing = expected - set(ids)
+    print(f'Shipped {len(ids)} records ({len(set(ids))} distinct) of {len(expected)} appended')
+    ok = not missing and set(ids) == expected and len(dirs) == len(tags)
+    if missing:
+        print(f'   {len(missing)} records were never shipped, e.g. {sorted(missing)[:3]}')
+    print('✅ Every record shipped' if ok else '❌ Segment log lost records')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+"""
+write_behind.py
+Write-behind queue that batches rows and flushes them to the database off the request path.
+
+Rows are appended to a local spill file (journal) before they are acknowledged, so rows that
+were accepted but not yet flushed survive a crash and are replayed on the next start. The
+flush function must be idempotent (rows carry their own ids and are upserted), because a
+replay may resend rows that already reached the database.
+
+The journal is split into segments (`spill_path`, then `spill_path.1`, `.2`, ...): after
+`max_batch` rows the writer moves on to a new segment, and a segment is deleted (or, for the
+current one, truncated) as soon as every row journaled in it has been flushed. Under steady
+load the journal therefore holds little more than the rows still queued.
+"""
+import glob
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Dict, Any, Optional
+
+from log_pipeline import get_logger
+
+log = get_logger("write_behind")
+
+
+class WriteBehindQueue:
+    """Accumulate rows and flush them in bulk every `flush_interval_ms` or `max_batch` rows.
+
+    - Memory is bounded by `max_pending`; producers wait up to `put_timeout` seconds for space
+      (backpressure) and after that the row is kept only in the spill file until the next replay.
+    - Failed flushes are retried with exponential backoff; rows stay queued in order.
+    - `close()` flushes what is left; anything that still cannot be written stays in the spill file.
+    """
+
+    def __init__(self, flush_fn: Callable[[List[Dict[str, Any]]], Any], name: str = "write_behind",
+                 max_batch: int = 100, flush_interval_ms: int = 200, max_pending: int = 10000,
+                 spill_path: Optional[str] = None, put_timeout: float = 0.5, max_backoff: float = 5.0):
+        self._flush_fn = flush_fn
+        self.name = name
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_pending = max_pending
+        self.spill_path = spill_path
+        self.put_timeout = put_timeout
+        self.max_backoff = max_backoff
+
+        self._pending = deque()  # (journal segment, row)
+        self._cond = threading.Condition()
+        self._spill_lock = threading.Lock()
+        self._spill_file = None
+        self._segment = 0  # journal segment new rows are appended to
+        self._segment_written = 0  # rows appended to the current segment
+        self._segment_rows: Dict[int, float] = {}  # segment -> rows in it not yet flushed
+        self._spilled_only = False  # rows that overflowed memory and live only in the spill file
+        self._in_flight = 0
+        self._closed = False
+        self._thread = None
+        self.stats = {"submitted": 0, "flushed": 0, "failed_flushes": 0, "overflowed": 0}
+
+    def start(self):
+        """Replay any rows left in the spill file and start the background writer."""
+        if self._thread:
+            return
+        segments = self._existing_segments()
+        try:
+            self._replay_segments(segments)
+            self._remove_segments(segments)
+        except Exception as e:
+            # Keep the journal; the writer retries the replay in the background
+            self._spilled_only = True
+            self._segment = max(segments) + 1
+            self._segment_rows = {seg: float("inf") for seg in segments}
+            log.warning(f"{self.name}: spill file replay failed, will retry: {e}")
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def submit(self, row: Dict[str, Any]):
+        """Queue one row. Returns once the row is journaled; never waits on the database."""
+        self.submit_many([row])
+
+    def submit_many(self, rows: List[Dict[str, Any]]):
+        if self._closed:
+            raise RuntimeError(f"{self.name} queue is closed")
+        with self._cond:
+            deadline = time.monotonic() + self.put_timeout
+            for row in rows:
+                while len(self._pending) >= self.max_pending:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                # Journal under the queue lock so the writer never truncates a row it has not seen
+                segment = self._journal(row)
+                if len(self._pending) >= self.max_pending:
+                    # Still full: the journal copy is picked up by the next replay
+                    self._spilled_only = True
+                    self.stats["overflowed"] += 1
+                    continue
+                self._pending.append((segment, row))
+            self.stats["submitted"] += len(rows)
+            self._cond.notify_all()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Block until everything queued so far has been written (or timeout). Returns success."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify_all()
+            while self._pending or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout: float = 5.0):
+        """Stop accepting rows and flush what is left before returning."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self._close_journal()
+
+    def pending_count(self) -> int:
+        return len(self._pending) + self._in_flight
+
+    def _segment_path(self, segment: int) -> str:
+        return self.spill_path if segment == 0 else f"{self.spill_path}.{segment}"
+
+    def _existing_segments(self) -> List[int]:
+        if not self.spill_path:
+            return []
+        segments = [0] if os.path.exists(self.spill_path) else []
+        for path in glob.glob(glob.escape(self.spill_path) + ".*"):
+            suffix = path[len(self.spill_path) + 1:]
+            if suffix.isdigit():
+                segments.append(int(suffix))
+        return sorted(segments)
+
+    def _journal(self, row) -> Optional[int]:
+        """Append a row to the current journal segment; returns the segment."""
+        if not self.spill_path:
+            return None
+        with self._spill_lock:
+            if self._spill_file is None:
+                self._spill_file = open(self._segment_path(self._segment), "a", encoding="utf-8")
+            self._spill_file.write(json.dumps(row, default=str) + "\n")
+            self._spill_file.flush()
+            self._segment_written += 1
+            self._segment_rows[self._segment] = self._segment_rows.get(self._segment, 0) + 1
+            return self._segment
+
+    def _rotate_journal(self):
+        """Start a new segment (called with the spill lock held)."""
+        if self._spill_file:
+            os.fsync(self._spill_file.fileno())
+            self._spill_file.close()
+            self._spill_file = None
+        self._segment += 1
+        self._segment_written = 0
+
+    def _release(self, entries):
+        """Count flushed rows out of their segments and drop the segments that are done."""
+        if not self.spill_path:
+            return
+        with self._spill_lock:
+            for segment, _ in entries:
+                if segment in self._segment_rows:  # gone if a replay already covered it
+                    self._segment_rows[segment] -= 1
+            for segment, outstanding in list(self._segment_rows.items()):
+                if outstanding <= 0 and segment != self._segment:
+                    self._remove_segments([segment])
+                    del self._segment_rows[segment]
+            if self._segment_rows.get(self._segment, 0) <= 0:
+                # Everything journaled in the current segment is in the database
+                if self._spill_file:
+                    self._spill_file.seek(0)
+                    self._spill_file.truncate()
+                self._segment_written = 0
+                self._segment_rows.pop(self._segment, None)
+            elif self._segment_written >= self.max_batch:
+                self._rotate_journal()
+
+    def _remove_segments(self, segments: List[int]):
+        for segment in segments:
+            try:
+                os.remove(self._segment_path(segment))
+            except FileNotFoundError:
+                pass
+
+    def _close_journal(self):
+        with self._spill_lock:
+            if self._spill_file:
+                self._spill_file.close()
+                self._spill_file = None
+
+    def _sync_journal(self):
+        with self._spill_lock:
+            if self._spill_file:
+                os.fsync(self._spill_file.fileno())
+
+    def _replay_segments(self, segments: List[int]) -> int:
+        """Upsert every row of the given journal segments (the files are left in place)."""
+        replayed = 0
+        for segment in segments:
+            rows = []
+            try:
+                with open(self._segment_path(segment), "r", encoding="utf-8") as f:
+                    for line in f:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        try:
+                            rows.append(json.loads(line))
+                        except ValueError:
+                            # A torn last line from a crash mid-write; everything before it is intact
+                            continue
+            except FileNotFoundError:
+                continue
+            for i in range(0, len(rows), self.max_batch):
+                self._flush_fn(rows[i:i + self.max_batch])
+            replayed += len(rows)
+        self.stats["flushed"] += replayed
+        return replayed
+
+    def _run(self):
+        backoff = self.flush_interval
+        while True:
+            with self._cond:
+                if not self._pending and not self._closed:
+                    self._cond.wait(self.flush_interval)
+                if len(self._pending) < self.max_batch and not self._closed:
+                    # Give the batch a chance to fill up to max_batch within one interval
+                    self._cond.wait_for(lambda: len(self._pending) >= self.max_batch or self._closed,
+                                        self.flush_interval)
+                replay = False
+                if not self._pending:
+                    if self._closed:
+                        return
+                    replay = self._spilled_only
+                    if not replay:
+                        continue
+                if not replay:
+                    entries = [self._pending.popleft() for _ in range(min(self.max_batch, len(self._pending)))]
+                    batch = [row for _, row in entries]
+                    self._in_flight = len(batch)
+                    self._cond.notify_all()
+
+            if replay:
+                if not self._replay_journal():
+                    with self._cond:
+                        self._cond.wait(self.max_backoff)
+                continue
+
+            try:
+                self._sync_journal()
+                self._flush_fn(batch)
+            except Exception as e:
+                self.stats["failed_flushes"] += 1
+                log.warning(f"{self.name}: flush of {len(batch)} rows failed, retrying: {e}")
+                with self._cond:
+                    self._pending.extendleft(reversed(entries))
+                    self._in_flight = 0
+                    closed = self._closed
+                    self._cond.notify_all()
+                if closed:
+                    # Leave the rows in the spill file for the next start
+                    return
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            backoff = self.flush_interval
+            self._release(entries)
+            with self._cond:
+                self.stats["flushed"] += len(batch)
+                self._in_flight = 0
+                self._cond.notify_all()
+
+    def _replay_journal(self) -> bool:
+        """Replay the segments still holding unflushed rows, i.e. rows that overflowed memory
+        and exist only on disk (their already-flushed neighbours are simply upserted again).
+
+        Replays without the queue lock, so producers keep journaling into a fresh segment.
+        Segments with rows that were queued in memory meanwhile are left to the next replay:
+        the writer still has to count those rows out of them."""
+        with self._cond, self._spill_lock:
+            self._rotate_journal()
+            queued = {seg for seg, _ in self._pending}
+            candidates = [seg for seg, n in self._segment_rows.items() if n > 0 and seg != self._segment]
+            segments = sorted(seg for seg in candidates if seg not in queued)
+            self._spilled_only = len(segments) < len(candidates)
+        try:
+            self._replay_segments(segments)
+        except Exception as e:
+            self._spilled_only = True
+            log.warning(f"{self.name}: spill file replay failed, will retry: {e}")
+            return False
+        with self._spill_lock:
+            self._remove_segments(segments)
+            for segment in segments:
+                self._segment_rows.pop(segment, None)
+        return True